@@ -0,0 +1,116 @@
+import math
+import threading
+
+import numpy as np
+import torch
+
+from latentsync.whisper.whisper.audio import HOP_LENGTH, N_FRAMES, SAMPLE_RATE, load_audio
+from latentsync.whisper.whisper.audio import log_mel_spectrogram, pad_or_trim
+
+# whisper编码器输出每秒50帧，每帧对应两个mel帧
+SAMPLES_PER_FEATURE = HOP_LENGTH * 2
+FEATURES_PER_WINDOW = N_FRAMES // 2
+
+
+def frame_loudness_db(audio_samples, num_frames, fps, sample_rate=SAMPLE_RATE):
+    """每个视频帧对应音频片段的RMS（dBFS），没有音频的帧为-inf"""
+    samples_per_frame = sample_rate / fps
+    loudness = np.full(num_frames, -np.inf)
+    for i in range(num_frames):
+        segment = audio_samples[int(i * samples_per_frame) : int((i + 1) * samples_per_frame)]
+        if len(segment) > 0:
+            rms = np.sqrt(np.mean(np.square(segment, dtype=np.float64)))
+            loudness[i] = 20 * np.log10(max(rms, 1e-10))
+    return loudness
+
+
+class StreamingAudioFeatures:
+    """按30秒窗口增量计算whisper编码器特征，按视频帧号惰性产出whisper_chunks
+
+    长度、下标和每个chunk的取值范围与Audio2Feature.feature2chunks相同，可以像列表一样取下标、切片和求长度。
+    mel频谱与transcribe一样对整段音频计算并归一化，窗口从中截取；但transcribe按30秒不重叠分段编码，
+    这里相邻窗口重叠overlap_seconds、每个窗口只保留中间部分，所以只有第一个窗口保留的部分
+    （前30秒减去overlap_seconds/2）与整段计算在数值误差内一致，之后的特征因编码器上下文不同而有差异，
+    不是逐一对应的（见tests/test_audio_features.py），因此只在--streaming_audio时使用，默认仍整段计算。
+    只缓存最近使用的窗口的编码结果，编码器输出的占用与音频长度无关（原始采样点和mel频谱仍整段保存，
+    16kHz单声道每10分钟约38MB和19MB）；访问已经释放的位置时重新计算对应窗口。
+    """
+
+    def __init__(self, audio_encoder, audio_path, fps=25, overlap_seconds=2.0, max_cached_windows=3):
+        self.audio_encoder = audio_encoder
+        self.fps = fps
+        self.audio_samples = load_audio(audio_path)
+        # 与transcribe相同，对数mel的动态范围按整段音频的最大值截断
+        self.mel = log_mel_spectrogram(self.audio_samples)
+        self.num_features = math.ceil(len(self.audio_samples) / SAMPLES_PER_FEATURE)
+        self.feature_multiplier = 50.0 / fps
+        # 与feature2chunks相同：起始特征下标超出特征长度的第一帧也包含在内
+        i = 0
+        while int(i * self.feature_multiplier) <= self.num_features:
+            i += 1
+        self._length = i + 1
+
+        self.margin = int(overlap_seconds * 50 / 2)
+        self.stride = FEATURES_PER_WINDOW - 2 * self.margin
+        self.max_cached_windows = max_cached_windows
+        self._windows = {}
+        self._lock = threading.Lock()
+        self.windows_encoded = 0
+
+        model = audio_encoder.model
+        self.device = next(model.parameters()).device
+        self.dtype = torch.float16 if self.device.type == "cuda" else torch.float32
+
+    def __len__(self):
+        return self._length
+
+    def _window_index(self, feature_index):
+        return max(feature_index - self.margin, 0) // self.stride
+
+    @torch.no_grad()
+    def _encode_window(self, window_index):
+        start = window_index * self.stride
+        # 每个特征对应两个mel帧；不足30秒的部分与transcribe一样在mel上补零
+        mel = pad_or_trim(self.mel[:, start * 2 : start * 2 + N_FRAMES], N_FRAMES)
+        mel = mel.to(self.device, dtype=self.dtype)[None]
+        _, embeddings = self.audio_encoder.model.encoder(mel, include_embeddings=True)
+        # (1, layers, 1500, dim) -> (1500, layers, dim)，与audio2feat的特征布局一致
+        embeddings = torch.from_numpy(embeddings[0].transpose(1, 0, 2))
+        self.windows_encoded += 1
+        return start, embeddings
+
+    def _feature(self, feature_index):
+        # 调用时需持有self._lock
+        window_index = self._window_index(feature_index)
+        window = self._windows.pop(window_index, None)
+        if window is None:
+            window = self._encode_window(window_index)
+        # 最近使用的窗口放在最后，超出数量时释放最早的窗口
+        self._windows[window_index] = window
+        while len(self._windows) > self.max_cached_windows:
+            self._windows.pop(next(iter(self._windows)))
+        start, embeddings = window
+        return embeddings[feature_index - start]
+
+    def _chunk(self, frame_index):
+        # 与Audio2Feature.get_sliced_feature相同的取值范围和边界处理
+        audio_feat_length = self.audio_encoder.audio_feat_length
+        center = int(frame_index * self.feature_multiplier)
+        left = center - audio_feat_length[0] * 2
+        right = center + (audio_feat_length[1] + 1) * 2
+        features = [self._feature(min(max(i, 0), self.num_features - 1)) for i in range(left, right)]
+        return torch.cat(features, dim=0).reshape(-1, self.audio_encoder.embedding_dim)
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                return [self._chunk(i) for i in range(*index.indices(self._length))]
+            if index < 0:
+                index += self._length
+            if not 0 <= index < self._length:
+                raise IndexError(f"whisper chunk index {index} out of range")
+            return self._chunk(index)
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self[i]
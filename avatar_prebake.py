@@ -0,0 +1,249 @@
+# 头像视频预烘焙：参考帧和遮罩帧的VAE编码只取决于源视频，预先算好保存到磁盘，
+# 之后每次用新音频生成时按帧号读取，跳过VAE编码。
+#
+# PYTHONPATH=.:./submodules/LatentSync python avatar_prebake.py --video_path assets/demo1_video.mp4
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+from device_utils import PRECISIONS, resolve_device, select_dtype
+from face_aligner import FaceAligner
+from disk_cache import DiskLRUCache, hash_file
+from face_alignment_cache import get_face_alignment_cache
+from frame_source import FrameSource
+
+CACHE_VERSION = 1
+
+
+def _numpy_dtype(weight_dtype):
+    # numpy没有bfloat16，非fp16一律按fp32保存，读回时再转换，数值不变
+    return np.float16 if weight_dtype == torch.float16 else np.float32
+
+
+class PrebakedLatents:
+    """一个头像视频预先计算好的VAE编码分布参数，按帧号以内存映射方式读取"""
+
+    def __init__(self, entry_dir):
+        with open(entry_dir / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.num_frames = self.meta["num_frames"]
+        self.masked_image_moments = np.load(entry_dir / "masked_image_moments.npy", mmap_mode="r")
+        self.image_moments = np.load(entry_dir / "image_moments.npy", mmap_mode="r")
+
+    def get(self, start, count):
+        end = start + count
+        masked_image_moments = torch.from_numpy(np.array(self.masked_image_moments[start:end]))
+        image_moments = torch.from_numpy(np.array(self.image_moments[start:end]))
+        return masked_image_moments, image_moments
+
+    def take(self, indices):
+        """按任意帧号读取，用于循环视频"""
+        masked_image_moments = torch.from_numpy(np.asarray(self.masked_image_moments[indices]))
+        image_moments = torch.from_numpy(np.asarray(self.image_moments[indices]))
+        return masked_image_moments, image_moments
+
+
+class PrebakeWriter:
+    def __init__(self, store, entry_dir, num_frames, moments_shape, dtype):
+        self.store = store
+        self.entry_dir = entry_dir
+        store.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.temp_dir = Path(tempfile.mkdtemp(dir=store.cache_dir, prefix=".tmp_"))
+        shape = (num_frames, *moments_shape)
+        self.masked_image_moments = np.lib.format.open_memmap(
+            self.temp_dir / "masked_image_moments.npy", mode="w+", dtype=dtype, shape=shape
+        )
+        self.image_moments = np.lib.format.open_memmap(
+            self.temp_dir / "image_moments.npy", mode="w+", dtype=dtype, shape=shape
+        )
+        self.written = 0
+
+    def write(self, start, masked_image_moments, image_moments):
+        end = start + len(image_moments)
+        self.masked_image_moments[start:end] = masked_image_moments.float().cpu().numpy()
+        self.image_moments[start:end] = image_moments.float().cpu().numpy()
+        self.written = max(self.written, end)
+
+    def commit(self, meta):
+        self.masked_image_moments.flush()
+        self.image_moments.flush()
+        del self.masked_image_moments, self.image_moments
+        with open(self.temp_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(dict(meta, num_frames=self.written), f)
+        shutil.rmtree(self.entry_dir, ignore_errors=True)
+        try:
+            os.rename(self.temp_dir, self.entry_dir)
+        except OSError:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            return
+        self.store.evict()
+
+    def abort(self):
+        self.masked_image_moments = None
+        self.image_moments = None
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class AvatarLatentStore(DiskLRUCache):
+    """按源视频、分辨率、遮罩图、精度和VAE区分的预烘焙结果，超过max_bytes时按最近使用时间淘汰
+
+    正在使用的条目被淘汰时，已经以内存映射打开的文件在使用结束前仍然可读。
+    """
+
+    def __init__(self, cache_dir="output/cache/avatar_latents", max_bytes=8 << 30):
+        super().__init__(cache_dir, max_bytes)
+
+    def entry_dir(self, video_path, resolution, mask_image_path, weight_dtype, vae):
+        params = {
+            "version": CACHE_VERSION,
+            "video": hash_file(video_path),
+            "resolution": resolution,
+            "mask": hash_file(mask_image_path),
+            "dtype": str(weight_dtype),
+            "vae": str(getattr(vae.config, "_name_or_path", "")),
+        }
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+        return self.cache_dir / digest
+
+    def load(self, video_path, resolution, mask_image_path, weight_dtype, vae, num_frames):
+        """返回至少包含前num_frames帧的预烘焙结果，否则返回None"""
+        entry_dir = self.entry_dir(video_path, resolution, mask_image_path, weight_dtype, vae)
+        prebaked = None
+        if (entry_dir / "meta.json").exists():
+            try:
+                prebaked = PrebakedLatents(entry_dir)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"预烘焙结果损坏，已忽略: {entry_dir} ({e})")
+        if prebaked is not None and prebaked.num_frames >= num_frames:
+            self.record_hit(entry_dir)
+            return prebaked
+        self.record_miss()
+        return None
+
+    def writer(self, video_path, resolution, mask_image_path, weight_dtype, vae, num_frames, moments_shape):
+        entry_dir = self.entry_dir(video_path, resolution, mask_image_path, weight_dtype, vae)
+        return PrebakeWriter(self, entry_dir, num_frames, moments_shape, _numpy_dtype(weight_dtype))
+
+
+_avatar_latent_store = AvatarLatentStore()
+
+
+def get_avatar_latent_store():
+    return _avatar_latent_store
+
+
+@torch.no_grad()
+def prebake_avatar(
+    pipeline,
+    video_path,
+    height,
+    mask_image_path,
+    weight_dtype,
+    batch_size=16,
+    alignment_workers=4,
+):
+    """对头像视频的全部帧做人脸对齐和VAE编码并保存，返回写入的帧数"""
+    device = pipeline._execution_device
+    image_processor = pipeline.get_image_processor(height, mask_image_path)
+    latent_size = height // pipeline.vae_scale_factor
+    moments_shape = (2 * pipeline.vae.config.latent_channels, latent_size, latent_size)
+
+    frame_source = FrameSource(video_path, batch_size)
+    frame_count = frame_source.frame_count
+
+    alignment_cache = get_face_alignment_cache()
+    cached_alignment = alignment_cache.load(video_path, height, frame_count)
+    alignment_writer = None
+    face_aligner = None
+    if cached_alignment is None:
+        alignment_writer = alignment_cache.writer(video_path, height, frame_count)
+        face_aligner = FaceAligner(image_processor, num_workers=alignment_workers)
+
+    writer = get_avatar_latent_store().writer(
+        video_path, height, mask_image_path, weight_dtype, pipeline.vae, frame_count, moments_shape
+    )
+    try:
+        written = 0
+        for slot, start, frames in frame_source:
+            if cached_alignment is not None:
+                faces, _, _ = cached_alignment.get(start, len(frames))
+            else:
+                faces, boxes, affine_matrices = face_aligner(frames)
+                alignment_writer.write(start, faces, boxes, affine_matrices)
+            frame_source.release(slot)
+
+            pixel_values, masked_pixel_values, _ = image_processor.prepare_masks_and_masked_images(
+                faces, affine_transform=False
+            )
+            writer.write(
+                start,
+                pipeline.encode_moments(masked_pixel_values, device, weight_dtype),
+                pipeline.encode_moments(pixel_values, device, weight_dtype),
+            )
+            written = start + len(faces)
+            print(f"Prebaked {written}/{frame_count} frames")
+
+        writer.commit({"resolution": height, "dtype": str(weight_dtype)})
+        writer = None
+        if alignment_writer is not None:
+            alignment_writer.commit()
+            alignment_writer = None
+        return written
+    finally:
+        frame_source.close()
+        if face_aligner is not None:
+            face_aligner.close()
+        if writer is not None:
+            writer.abort()
+        if alignment_writer is not None:
+            alignment_writer.abort()
+
+
+def main():
+    from inference_video import load_pipeline
+    from model_registry import get_registry
+
+    SUBMODULES_PATH = Path("submodules")
+    CONFIGS_PATH = Path(SUBMODULES_PATH, "LatentSync/configs")
+    UNET_CONFIG_PATH = Path(CONFIGS_PATH, "unet/stage2.yaml")
+    CHECKPOINT_PATH = Path("checkpoints/latentsync_unet.pt")
+    MASK_IMAGE_PATH = Path(SUBMODULES_PATH, "LatentSync/latentsync/utils/mask.png")
+
+    parser = argparse.ArgumentParser(description="Prebake VAE latents of an avatar video")
+    parser.add_argument("--configs_path", type=str, default=CONFIGS_PATH.absolute().as_posix())
+    parser.add_argument("--unet_config_path", type=str, default=UNET_CONFIG_PATH.absolute().as_posix())
+    parser.add_argument("--inference_ckpt_path", type=str, default=CHECKPOINT_PATH.absolute().as_posix())
+    parser.add_argument("--mask_image_path", type=str, default=MASK_IMAGE_PATH.absolute().as_posix())
+    parser.add_argument("--video_path", type=str, required=True)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--device", type=str, default="auto")
+    parser.add_argument("--precision", type=str, default="auto", choices=list(PRECISIONS))
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    device = resolve_device(args.device)
+    dtype = select_dtype(device, args.precision)
+
+    with get_registry().acquire(config, args, dtype, device, load_pipeline, warmup=False) as pipeline:
+        num_frames = prebake_avatar(
+            pipeline,
+            args.video_path,
+            config.data.resolution,
+            args.mask_image_path,
+            dtype,
+            batch_size=args.batch_size,
+        )
+    print(f"Prebaked {num_frames} frames of {args.video_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# CFG模式的速度/质量对比：同一段视频和音频、同一随机种子，分别用full/interval/cache生成，
+# 以full的输出为参考，统计每帧扩散耗时和生成区域内的PSNR
+#
+# PYTHONPATH=.:./submodules/LatentSync python benchmarks/bench_cfg.py \
+#     --video_path assets/demo1_video.mp4 --audio_path assets/demo1_audio.wav --guidance_scale 2.0
+
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+from omegaconf import OmegaConf
+
+from device_utils import make_generator, resolve_device, select_dtype
+from inference_video import apply_preset, build_parser, load_pipeline
+from lipsync_pipeline_optimized import ping_pong_indices
+from model_registry import get_registry
+
+
+def read_frames(video_path):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    cap.release()
+    return np.array(frames)
+
+
+def generated_region(reference, source):
+    """参考输出与源视频不同的像素的外接框，即人脸贴回的区域"""
+    if len(reference) > len(source):
+        source = source[ping_pong_indices(0, len(reference), len(source))]
+    changed = (np.abs(reference.astype(np.int16) - source[: len(reference)].astype(np.int16)).max(axis=-1) > 8).any(axis=0)
+    ys, xs = np.nonzero(changed)
+    if len(ys) == 0:
+        return 0, reference.shape[1], 0, reference.shape[2]
+    return ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0**2 / mse)
+
+
+def main():
+    # 路径、步数、CFG区间等参数与inference_video相同，--cfg_mode由本脚本逐个切换
+    parser = build_parser(video_out_required=False)
+    parser.add_argument("--output_dir", type=str, default="output/bench_cfg")
+    parser.set_defaults(guidance_scale=2.0)
+    args = apply_preset(parser.parse_args())
+
+    config = OmegaConf.load(args.unet_config_path)
+    device = resolve_device(args.device)
+    dtype = select_dtype(device, args.precision)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    results = {}
+    with get_registry().acquire(config, args, dtype, device, load_pipeline) as pipeline:
+        pipeline.set_scheduler(args.scheduler)
+        for cfg_mode in ("full", "interval", "cache"):
+            video_out_path = os.path.join(args.output_dir, f"{cfg_mode}.mp4")
+            start_time = time.perf_counter()
+            pipeline(
+                video_path=args.video_path,
+                audio_path=args.audio_path,
+                video_out_path=video_out_path,
+                num_frames=config.data.num_frames,
+                num_inference_steps=args.inference_steps,
+                guidance_scale=args.guidance_scale,
+                weight_dtype=dtype,
+                width=config.data.resolution,
+                height=config.data.resolution,
+                mask_image_path=args.mask_image_path,
+                cfg_mode=cfg_mode,
+                cfg_interval=tuple(args.cfg_interval),
+                cfg_refresh=args.cfg_refresh,
+                generator=make_generator(pipeline._execution_device, args.seed),
+            )
+            total_seconds = time.perf_counter() - start_time
+            diffusion = pipeline.stage_timings["diffusion"]
+            cfg_stats = pipeline.cfg_stats
+            results[cfg_mode] = {
+                "video": video_out_path,
+                "seconds": round(total_seconds, 3),
+                "diffusion_seconds_per_frame": round(diffusion["seconds"] / max(diffusion["count"], 1), 4),
+                "uncond_steps": cfg_stats["uncond_steps"],
+                "steps": cfg_stats["steps"],
+            }
+
+    reference = read_frames(results["full"]["video"])
+    y0, y1, x0, x1 = generated_region(reference, read_frames(args.video_path))
+    for cfg_mode, result in results.items():
+        frames = read_frames(result["video"])
+        count = min(len(frames), len(reference))
+        result["psnr_face_region"] = round(psnr(frames[:count, y0:y1, x0:x1], reference[:count, y0:y1, x0:x1]), 2)
+        result["speedup"] = round(
+            results["full"]["diffusion_seconds_per_frame"] / max(result["diffusion_seconds_per_frame"], 1e-9), 2
+        )
+
+    print(f"{'mode':<10} {'s/frame':>10} {'speedup':>8} {'uncond':>10} {'PSNR(dB)':>9}")
+    for cfg_mode, result in results.items():
+        print(
+            f"{cfg_mode:<10} {result['diffusion_seconds_per_frame']:>10.4f} {result['speedup']:>7.2f}x "
+            f"{result['uncond_steps']:>4}/{result['steps']:<5} {result['psnr_face_region']:>9.2f}"
+        )
+    with open(os.path.join(args.output_dir, "results.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
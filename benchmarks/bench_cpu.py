@@ -0,0 +1,109 @@
+# CPU吞吐测试：在不同线程数和精度下跑完整的唇形同步流水线，统计每帧耗时和单节点每小时可生成的帧数，
+# 用于无GPU节点的容量规划。建议使用几秒钟的短视频，CPU上每帧耗时以秒计。
+#
+# PYTHONPATH=.:./submodules/LatentSync python benchmarks/bench_cpu.py \
+#     --video_path assets/demo1_video.mp4 --audio_path assets/demo1_audio.wav --threads 8 16 --precisions bf16 fp32
+
+import argparse
+import json
+import os
+import platform
+import time
+from pathlib import Path
+
+import torch
+from accelerate.utils import set_seed
+from omegaconf import OmegaConf
+
+from device_utils import PRECISIONS, configure_cpu_threads, cpu_supports_bf16, select_dtype
+from inference_video import PRESETS, load_pipeline
+from model_registry import get_registry
+
+
+def main():
+    SUBMODULES_PATH = Path("submodules")
+    CONFIGS_PATH = Path(SUBMODULES_PATH, "LatentSync/configs")
+    UNET_CONFIG_PATH = Path(CONFIGS_PATH, "unet/stage2.yaml")
+    CHECKPOINT_PATH = Path("checkpoints/latentsync_unet.pt")
+    MASK_IMAGE_PATH = Path(SUBMODULES_PATH, "LatentSync/latentsync/utils/mask.png")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--configs_path", type=str, default=CONFIGS_PATH.absolute().as_posix())
+    parser.add_argument("--unet_config_path", type=str, default=UNET_CONFIG_PATH.absolute().as_posix())
+    parser.add_argument("--inference_ckpt_path", type=str, default=CHECKPOINT_PATH.absolute().as_posix())
+    parser.add_argument("--mask_image_path", type=str, default=MASK_IMAGE_PATH.absolute().as_posix())
+    parser.add_argument("--video_path", type=str, required=True)
+    parser.add_argument("--audio_path", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, default="output/bench_cpu")
+    parser.add_argument("--guidance_scale", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--preset", type=str, default="draft", choices=list(PRESETS))
+    parser.add_argument("--threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--precisions", type=str, nargs="+", default=["auto"], choices=list(PRECISIONS))
+    parser.add_argument("--no_channels_last", dest="channels_last", action="store_false")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+    scheduler_name = PRESETS[args.preset]["scheduler"]
+    inference_steps = PRESETS[args.preset]["inference_steps"]
+
+    results = {
+        "machine": {
+            "processor": platform.processor() or platform.machine(),
+            "logical_cpus": os.cpu_count(),
+            "cpu_capability": torch.backends.cpu.get_cpu_capability(),
+            "native_bf16": cpu_supports_bf16(),
+            "torch": torch.__version__,
+        },
+        "preset": args.preset,
+        "runs": [],
+    }
+    for precision in args.precisions:
+        dtype = select_dtype("cpu", precision)
+        with get_registry().acquire(config, args, dtype, "cpu", load_pipeline) as pipeline:
+            pipeline.set_scheduler(scheduler_name)
+            for threads in args.threads:
+                num_threads = configure_cpu_threads(threads)
+                video_out_path = os.path.join(args.output_dir, f"{str(dtype).split('.')[-1]}_{num_threads}t.mp4")
+                set_seed(args.seed)
+                start_time = time.perf_counter()
+                pipeline(
+                    video_path=args.video_path,
+                    audio_path=args.audio_path,
+                    video_out_path=video_out_path,
+                    num_frames=config.data.num_frames,
+                    num_inference_steps=inference_steps,
+                    guidance_scale=args.guidance_scale,
+                    weight_dtype=dtype,
+                    width=config.data.resolution,
+                    height=config.data.resolution,
+                    mask_image_path=args.mask_image_path,
+                )
+                total_seconds = time.perf_counter() - start_time
+                num_output_frames = max(pipeline.stage_timings["diffusion"]["count"], 1)
+                results["runs"].append(
+                    {
+                        "dtype": str(dtype).split(".")[-1],
+                        "threads": num_threads,
+                        "frames": num_output_frames,
+                        "seconds": round(total_seconds, 3),
+                        "seconds_per_frame": round(total_seconds / num_output_frames, 4),
+                        "frames_per_hour": round(3600 * num_output_frames / total_seconds, 1),
+                        "stages": pipeline.stage_timings,
+                    }
+                )
+        get_registry().release()
+
+    print(f"{'dtype':<10} {'threads':>7} {'frames':>7} {'s/frame':>10} {'frames/h':>10}")
+    for run in results["runs"]:
+        print(
+            f"{run['dtype']:<10} {run['threads']:>7} {run['frames']:>7} "
+            f"{run['seconds_per_frame']:>10.4f} {run['frames_per_hour']:>10.1f}"
+        )
+    with open(os.path.join(args.output_dir, "results.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
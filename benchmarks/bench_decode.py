@@ -0,0 +1,64 @@
+# 视频解码吞吐测试：逐帧cap.read()+cvtColor+np.array与FrameSource各后端对比，输出每秒帧数
+#
+# PYTHONPATH=. python benchmarks/bench_decode.py --video_path assets/demo1_video.mp4 --backends opencv ffmpeg
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from frame_source import FrameSource
+
+
+def decode_inline(video_path, batch_size):
+    # 原先__call__中read_video的做法
+    cap = cv2.VideoCapture(video_path)
+    total = 0
+    while True:
+        frames = []
+        for _ in range(batch_size):
+            success, frame = cap.read()
+            if not success:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if not frames:
+            break
+        total += len(np.array(frames))
+    cap.release()
+    return total
+
+
+def decode_source(video_path, batch_size, backend):
+    frame_source = FrameSource(video_path, batch_size, backend=backend)
+    total = 0
+    try:
+        for slot, _, frames in frame_source:
+            total += len(frames)
+            frame_source.release(slot)
+    finally:
+        frame_source.close()
+    return total, frame_source.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video_path", type=str, required=True)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--backends", type=str, nargs="+", default=["opencv", "ffmpeg"])
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    total = decode_inline(args.video_path, args.batch_size)
+    inline_fps = total / (time.perf_counter() - start_time)
+    print(f"inline read_video: {inline_fps:8.2f} fps ({total} frames)")
+
+    for backend in args.backends:
+        start_time = time.perf_counter()
+        total, stats = decode_source(args.video_path, args.batch_size, backend)
+        fps = total / (time.perf_counter() - start_time)
+        print(f"FrameSource[{backend}]: {fps:8.2f} fps  decode thread {stats['fps']:8.2f} fps  speedup={fps / inline_fps:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# 人脸对齐吞吐测试：对同一段视频分别用不同的检测线程数做对齐，输出每秒帧数
+#
+# PYTHONPATH=.:./submodules/LatentSync python benchmarks/bench_face_alignment.py --video_path assets/demo1_video.mp4
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from face_aligner import FaceAligner, create_image_processor
+
+
+def read_frames(video_path, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        success, frame = cap.read()
+        if not success:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    cap.release()
+    return np.array(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video_path", type=str, required=True)
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--num_frames", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--device", type=str, default="cuda")
+    args = parser.parse_args()
+
+    frames = read_frames(args.video_path, args.num_frames)
+    print(f"Frames: {len(frames)}, size: {frames.shape[2]}x{frames.shape[1]}, cpus: {os.cpu_count()}")
+
+    reference = None
+    baseline_fps = None
+    for num_workers in sorted(set(args.workers)):
+        # 每次都新建ImageProcessor，保证平滑状态从头开始
+        image_processor = create_image_processor(args.resolution, args.device)
+        face_aligner = FaceAligner(image_processor, num_workers=num_workers)
+        start_time = time.perf_counter()
+        faces, _, affine_matrices = face_aligner(frames)
+        fps = len(frames) / (time.perf_counter() - start_time)
+        face_aligner.close()
+
+        if reference is None:
+            reference = (faces, affine_matrices)
+            baseline_fps = fps
+        identical = bool((faces == reference[0]).all()) and all(
+            np.array_equal(a, b) for a, b in zip(affine_matrices, reference[1])
+        )
+        print(f"workers={num_workers:<3d} {fps:8.2f} fps  speedup={fps / baseline_fps:5.2f}x  identical={identical}")
+
+
+if __name__ == "__main__":
+    main()
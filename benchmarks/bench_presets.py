@@ -0,0 +1,123 @@
+# 速度/质量档位对比：同一段视频和音频、同一随机种子，分别用draft/standard/high生成，
+# 统计每个输出帧的耗时，并用SyncNet评估口型同步置信度（需要checkpoints/auxiliary/syncnet_v2.model）
+#
+# PYTHONPATH=.:./submodules/LatentSync python benchmarks/bench_presets.py \
+#     --video_path assets/demo1_video.mp4 --audio_path assets/demo1_audio.wav --guidance_scale 2.0
+
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+from omegaconf import OmegaConf
+
+from device_utils import make_generator, resolve_device, select_dtype
+from inference_video import PRESETS, build_parser, load_pipeline
+from model_registry import get_registry
+
+SYNCNET_PATH = Path("checkpoints/auxiliary/syncnet_v2.model")
+
+
+def load_syncnet(device):
+    """加载LatentSync自带的SyncNet评估模型，缺少依赖或权重时返回None，只统计速度"""
+    if not SYNCNET_PATH.exists():
+        print(f"{SYNCNET_PATH} not found, skip sync confidence")
+        return None
+    try:
+        from eval.syncnet import SyncNetEval
+        from eval.syncnet_detect import SyncNetDetector
+    except ImportError as e:
+        print(f"SyncNet eval is not available ({e}), skip sync confidence")
+        return None
+    syncnet = SyncNetEval(device=device)
+    syncnet.loadParameters(SYNCNET_PATH.as_posix())
+    return syncnet, SyncNetDetector
+
+
+def sync_confidence(syncnet, video_path, work_dir):
+    from eval.eval_sync_conf import syncnet_eval
+
+    syncnet, detector_cls = syncnet
+    detect_results_dir = os.path.join(work_dir, "detect_results")
+    temp_dir = os.path.join(work_dir, "temp")
+    detector = detector_cls(device=syncnet.device, detect_results_dir=detect_results_dir)
+    try:
+        av_offset, confidence = syncnet_eval(
+            syncnet, detector, video_path, temp_dir, detect_results_dir=detect_results_dir
+        )
+    finally:
+        shutil.rmtree(detect_results_dir, ignore_errors=True)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return av_offset, confidence
+
+
+def main():
+    # 路径、设备和精度等参数与inference_video相同，--scheduler/--inference_steps由各档位决定
+    parser = build_parser(video_out_required=False)
+    parser.add_argument("--output_dir", type=str, default="output/bench_presets")
+    parser.add_argument("--presets", type=str, nargs="+", default=list(PRESETS), choices=list(PRESETS))
+    parser.set_defaults(guidance_scale=2.0)
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    device = resolve_device(args.device)
+    dtype = select_dtype(device, args.precision)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    results = {}
+    with get_registry().acquire(config, args, dtype, device, load_pipeline) as pipeline:
+        for preset in args.presets:
+            scheduler_name = PRESETS[preset]["scheduler"]
+            inference_steps = PRESETS[preset]["inference_steps"]
+            pipeline.set_scheduler(scheduler_name)
+            video_out_path = os.path.join(args.output_dir, f"{preset}.mp4")
+            start_time = time.perf_counter()
+            pipeline(
+                video_path=args.video_path,
+                audio_path=args.audio_path,
+                video_out_path=video_out_path,
+                num_frames=config.data.num_frames,
+                num_inference_steps=inference_steps,
+                guidance_scale=args.guidance_scale,
+                weight_dtype=dtype,
+                width=config.data.resolution,
+                height=config.data.resolution,
+                mask_image_path=args.mask_image_path,
+                generator=make_generator(pipeline._execution_device, args.seed),
+            )
+            total_seconds = time.perf_counter() - start_time
+            diffusion = pipeline.stage_timings["diffusion"]
+            num_output_frames = max(diffusion["count"], 1)
+            results[preset] = {
+                "scheduler": scheduler_name,
+                "inference_steps": inference_steps,
+                "video": video_out_path,
+                "seconds": round(total_seconds, 3),
+                "seconds_per_frame": round(total_seconds / num_output_frames, 4),
+                "diffusion_seconds_per_frame": round(diffusion["seconds"] / num_output_frames, 4),
+            }
+
+    # SyncNet在生成全部结果之后再加载，不与扩散模型争用显存
+    syncnet = load_syncnet(device)
+    for preset, result in results.items():
+        if syncnet is None:
+            result["av_offset"] = result["sync_confidence"] = None
+            continue
+        av_offset, confidence = sync_confidence(syncnet, result["video"], os.path.join(args.output_dir, preset))
+        result["av_offset"] = int(av_offset)
+        result["sync_confidence"] = round(float(confidence), 3)
+
+    print(f"{'preset':<10} {'scheduler':<10} {'steps':>5} {'s/frame':>10} {'diff s/frame':>13} {'sync conf':>10}")
+    for preset, result in results.items():
+        confidence = "-" if result["sync_confidence"] is None else f"{result['sync_confidence']:.3f}"
+        print(
+            f"{preset:<10} {result['scheduler']:<10} {result['inference_steps']:>5} "
+            f"{result['seconds_per_frame']:>10.4f} {result['diffusion_seconds_per_frame']:>13.4f} {confidence:>10}"
+        )
+    with open(os.path.join(args.output_dir, "results.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
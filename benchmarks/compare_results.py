@@ -0,0 +1,128 @@
+# 比较两次run_suite.py的结果：按每单位耗时（s/item）计算变化，超过阈值的记为回归，有回归时退出码为1，
+# 可以直接用在CI里。--stages同时比较各阶段耗时（只报告，不影响退出码）。
+#
+# python benchmarks/compare_results.py output/bench_suite/base.json output/bench_suite/head.json --threshold 0.1
+
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def classify(change, threshold):
+    if change is None:
+        return "-"
+    if change > threshold:
+        return "REGRESSION"
+    if change < -threshold:
+        return "faster"
+    return "ok"
+
+
+def relative_change(base, head):
+    if not base or head is None:
+        return None
+    return head / base - 1
+
+
+def compare(base, head, threshold, min_seconds=0.05):
+    """返回逐项比较结果；耗时低于min_seconds的阶段波动太大，不参与阶段比较"""
+    rows = []
+    for name, head_result in head["benchmarks"].items():
+        base_result = base["benchmarks"].get(name)
+        if base_result is None or "skipped" in base_result or "skipped" in head_result:
+            rows.append({"benchmark": name, "stage": None, "status": "skipped"})
+            continue
+        change = relative_change(base_result["seconds_per_item"], head_result["seconds_per_item"])
+        rows.append(
+            {
+                "benchmark": name,
+                "stage": None,
+                "unit": head_result["unit"],
+                "base": base_result["seconds_per_item"],
+                "head": head_result["seconds_per_item"],
+                "change": change,
+                "status": classify(change, threshold),
+            }
+        )
+        base_stages = base_result.get("stages", {})
+        for stage, stats in head_result.get("stages", {}).items():
+            if stage not in base_stages or max(stats["seconds"], base_stages[stage]["seconds"]) < min_seconds:
+                continue
+            change = relative_change(base_stages[stage]["seconds"], stats["seconds"])
+            rows.append(
+                {
+                    "benchmark": name,
+                    "stage": stage,
+                    "unit": "run",
+                    "base": base_stages[stage]["seconds"],
+                    "head": stats["seconds"],
+                    "change": change,
+                    "status": classify(change, threshold),
+                }
+            )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base", type=str)
+    parser.add_argument("head", type=str)
+    parser.add_argument("--threshold", type=float, default=0.1, help="相对变化超过该比例记为回归")
+    parser.add_argument("--stages", action="store_true")
+    parser.add_argument("--min_stage_seconds", type=float, default=0.05)
+    parser.add_argument("--report", type=str, default=None, help="比较结果另存为JSON")
+    args = parser.parse_args()
+
+    base = load_results(args.base)
+    head = load_results(args.head)
+    print(f"base: {base.get('commit')}{' (dirty)' if base.get('dirty') else ''}")
+    print(f"head: {head.get('commit')}{' (dirty)' if head.get('dirty') else ''}")
+    # 机器或参数不同时耗时没有可比性
+    for key in ("machine", "settings"):
+        differences = sorted(
+            field
+            for field in set(base.get(key, {})) | set(head.get(key, {}))
+            if base.get(key, {}).get(field) != head.get(key, {}).get(field)
+        )
+        if differences:
+            print(f"Warning: {key} differ: {', '.join(differences)}")
+
+    rows = compare(base, head, args.threshold, args.min_stage_seconds)
+    print(f"{'benchmark':<24} {'unit':<14} {'base':>12} {'head':>12} {'change':>9}  status")
+    for row in rows:
+        name = row["benchmark"] if row["stage"] is None else f"  {row['stage']}"
+        if row["stage"] is not None and not args.stages:
+            continue
+        if row["status"] == "skipped":
+            print(f"{name:<24} skipped")
+            continue
+        change = "-" if row["change"] is None else f"{row['change']:+.1%}"
+        print(f"{name:<24} {row['unit']:<14} {row['base'] or 0:>12.6f} {row['head'] or 0:>12.6f} {change:>9}  {row['status']}")
+
+    regressions = [row for row in rows if row["stage"] is None and row["status"] == "REGRESSION"]
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "base": base.get("commit"),
+                    "head": head.get("commit"),
+                    "threshold": args.threshold,
+                    "regressions": [row["benchmark"] for row in regressions],
+                    "rows": rows,
+                },
+                f,
+                indent=2,
+            )
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print(f"No regression above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
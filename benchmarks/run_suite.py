@@ -0,0 +1,306 @@
+# 可复现的基准测试套件：用合成的人脸视频和音调（或小模型TTS生成的音频）作为输入，
+# 分别测量LipsyncPipelineOptimized端到端、infer2、util.loop_video和convert_numbers_to_chinese的耗时，
+# 扩散模型、VAE、whisper和F5-TTS都换成随机初始化的小模型（见tiny_models.py），CPU上即可运行。
+# 结果连同提交号、机器信息和参数写入JSON，用compare_results.py比较两次提交。
+# 缺少依赖的测试项记为skipped，不影响其余测试项。
+#
+# PYTHONPATH=.:./submodules/LatentSync python benchmarks/run_suite.py --output output/bench_suite/head.json
+# PYTHONPATH=.:./submodules/LatentSync python benchmarks/run_suite.py --targets numbers loop_video --repeat 5
+# 给出--video_path时lipsync使用这段真人视频和真实的人脸检测器（CPU上为CPUFaceDetector，需要checkpoints/auxiliary）：
+# PYTHONPATH=.:./submodules/LatentSync python benchmarks/run_suite.py --targets lipsync --video_path assets/demo1_video.mp4
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+import torch
+
+from device_utils import PRECISIONS, configure_cpu_threads, make_generator, resolve_device, select_dtype
+from synthetic import make_face_video, make_mask_image, make_tone_audio
+
+TARGETS = ("numbers", "loop_video", "infer2", "lipsync")
+
+NUMBER_TEXTS = [
+    "1000年后的3025年有50015人参加，增长率50.68%，而500年前只有1000人。",
+    "还有500种服务，费用平均3000.6元/人，每天工作8小时，全年365天。",
+    "订单号20240618共3个商品，总价1299.99元，预计2天后送达。",
+    "第12届比赛于2023年9月23日开幕，共有45个国家和地区的12500名运动员参赛。",
+]
+
+GEN_TEXT = "今天是2024年6月18日，我们一共准备了3个问题。第一个问题关于增长率，去年增长了12.5%。"
+REF_TEXT = "这是一段用于基准测试的参考音频。"
+
+
+def git_revision():
+    """当前提交号，以及工作区是否有未提交的修改"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def machine_info(device):
+    info = {
+        "processor": platform.processor() or platform.machine(),
+        "logical_cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "device": str(device),
+    }
+    if torch.device(device).type == "cuda":
+        info["gpu"] = torch.cuda.get_device_name(torch.device(device))
+    else:
+        info["cpu_capability"] = torch.backends.cpu.get_cpu_capability()
+    return info
+
+
+def measure(fn, repeat, warmup):
+    """warmup次不计时的预热后计时repeat次；fn返回(处理量, 附加信息)，附加信息取最后一次"""
+    for _ in range(warmup):
+        fn()
+    runs = []
+    items, extra = 0, {}
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        items, extra = fn()
+        runs.append(time.perf_counter() - start_time)
+    seconds = statistics.median(runs)
+    result = {
+        "seconds": round(seconds, 4),
+        "min_seconds": round(min(runs), 4),
+        "runs": [round(run, 4) for run in runs],
+        "items": items,
+        "seconds_per_item": round(seconds / items, 6) if items else None,
+    }
+    result.update(extra)
+    return result
+
+
+def bench_numbers(args, inputs):
+    from numbers_converter import convert_numbers_to_chinese
+
+    def run():
+        for _ in range(args.number_iterations):
+            for text in NUMBER_TEXTS:
+                convert_numbers_to_chinese(text)
+        return args.number_iterations * len(NUMBER_TEXTS), {"unit": "text"}
+
+    return measure(run, args.repeat, args.warmup)
+
+
+def bench_loop_video(args, inputs):
+    import util
+
+    output_path = os.path.join(args.work_dir, "looped.mp4")
+
+    def run():
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        util.loop_video(inputs["audio_path"], inputs["video_path"], output_path)
+        # loop_video出错时只打印不抛出
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            raise RuntimeError("util.loop_video did not produce an output file")
+        return util.get_duration(output_path), {"unit": "output_second"}
+
+    return measure(run, args.repeat, args.warmup)
+
+
+def bench_infer2(args, inputs):
+    import soundfile as sf
+
+    from inference_audio import infer2
+    from pipeline_stages import StageTimer
+    from tiny_models import install_tiny_tts
+
+    install_tiny_tts(seed=args.seed)
+
+    def run():
+        timer = StageTimer()
+        (sample_rate, wave), _, _ = infer2(
+            inputs["ref_audio_path"],
+            REF_TEXT,
+            GEN_TEXT,
+            None,
+            False,
+            nfe_step=args.nfe_step,
+            seed=args.seed,
+            save_spectrogram_image=False,
+            timer=timer,
+        )
+        inputs["tts_wave"] = (sample_rate, wave)
+        return round(len(wave) / sample_rate, 3), {"unit": "audio_second", "stages": timer.as_dict()}
+
+    result = measure(run, args.repeat, args.warmup)
+    if args.audio_source == "tts":
+        sample_rate, wave = inputs.pop("tts_wave")
+        sf.write(inputs["audio_path"], wave, sample_rate)
+    return result
+
+
+def bench_lipsync(args, inputs):
+    from omegaconf import OmegaConf
+
+    from tiny_models import build_tiny_lipsync_pipeline
+
+    config = OmegaConf.load(args.unet_config_path)
+    if args.resolution:
+        config.data.resolution = args.resolution
+    mask_image_path = args.mask_image_path
+    if not os.path.exists(mask_image_path):
+        mask_image_path = make_mask_image(os.path.join(args.work_dir, "mask.png"), config.data.resolution)
+
+    start_time = time.perf_counter()
+    synthetic_faces = args.video_path is None
+    video_path = inputs["video_path"] if synthetic_faces else args.video_path
+    pipeline = build_tiny_lipsync_pipeline(
+        config, args.work_dir, inputs["device"], inputs["dtype"], mask_image_path, synthetic_faces=synthetic_faces
+    )
+    setup_seconds = time.perf_counter() - start_time
+    pipeline.set_scheduler(args.scheduler)
+    video_out_path = os.path.join(args.work_dir, "lipsync.mp4")
+
+    def run():
+        pipeline(
+            video_path=video_path,
+            audio_path=inputs["audio_path"],
+            video_out_path=video_out_path,
+            num_frames=config.data.num_frames,
+            num_inference_steps=args.inference_steps,
+            guidance_scale=args.guidance_scale,
+            generator=make_generator(inputs["device"], args.seed),
+            weight_dtype=inputs["dtype"],
+            width=config.data.resolution,
+            height=config.data.resolution,
+            mask_image_path=mask_image_path,
+            # 缓存命中时测不到人脸对齐和VAE编码的耗时
+            use_alignment_cache=False,
+            use_prebaked_latents=False,
+        )
+        frames = pipeline.stage_timings["diffusion"]["count"]
+        return frames, {"unit": "frame", "stages": pipeline.stage_timings}
+
+    result = measure(run, args.repeat, args.warmup)
+    result["setup_seconds"] = round(setup_seconds, 3)
+    result["face_detector"] = "synthetic" if synthetic_faces else type(pipeline.image_processor.face_detector).__name__
+    return result
+
+
+BENCHMARKS = {
+    "numbers": bench_numbers,
+    "loop_video": bench_loop_video,
+    "infer2": bench_infer2,
+    "lipsync": bench_lipsync,
+}
+
+
+def main():
+    SUBMODULES_PATH = Path("submodules")
+    CONFIGS_PATH = Path(SUBMODULES_PATH, "LatentSync/configs")
+    UNET_CONFIG_PATH = Path(CONFIGS_PATH, "unet/stage2.yaml")
+    MASK_IMAGE_PATH = Path(SUBMODULES_PATH, "LatentSync/latentsync/utils/mask.png")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=str, default="output/bench_suite/results.json")
+    parser.add_argument("--work_dir", type=str, default="output/bench_suite/work")
+    parser.add_argument("--targets", type=str, nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--unet_config_path", type=str, default=UNET_CONFIG_PATH.absolute().as_posix())
+    parser.add_argument("--mask_image_path", type=str, default=MASK_IMAGE_PATH.absolute().as_posix())
+    # 合成输入
+    parser.add_argument("--video_seconds", type=float, default=4.0)
+    parser.add_argument("--audio_seconds", type=float, default=6.0)
+    parser.add_argument("--video_width", type=int, default=512)
+    parser.add_argument("--video_height", type=int, default=512)
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--audio_source", type=str, default="tone", choices=["tone", "tts"])
+    parser.add_argument("--video_path", type=str, default=None, help="lipsync改用真人视频和真实的人脸检测器")
+    # 计时
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--number_iterations", type=int, default=200)
+    # 模型
+    parser.add_argument("--resolution", type=int, default=0, help="人脸分辨率，0表示使用unet配置中的值")
+    parser.add_argument("--scheduler", type=str, default="ddim")
+    parser.add_argument("--inference_steps", type=int, default=4)
+    parser.add_argument("--guidance_scale", type=float, default=1.5)
+    parser.add_argument("--nfe_step", type=int, default=4)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--precision", type=str, default="fp32", choices=list(PRECISIONS))
+    parser.add_argument("--num_threads", type=int, default=0)
+    args = parser.parse_args()
+
+    device = resolve_device(args.device)
+    dtype = select_dtype(device, args.precision)
+    if torch.device(device).type == "cpu":
+        configure_cpu_threads(args.num_threads)
+    os.makedirs(args.work_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    # 输入文件每次都重新生成，参数相同时内容相同
+    inputs = {
+        "device": device,
+        "dtype": dtype,
+        "video_path": os.path.join(args.work_dir, "face.mp4"),
+        "audio_path": os.path.join(args.work_dir, "audio.wav"),
+        "ref_audio_path": os.path.join(args.work_dir, "ref_audio.wav"),
+    }
+    make_face_video(
+        inputs["video_path"], args.video_seconds, args.video_width, args.video_height, args.fps, seed=args.seed
+    )
+    make_tone_audio(inputs["audio_path"], args.audio_seconds, seed=args.seed)
+    make_tone_audio(inputs["ref_audio_path"], 4.0, sample_rate=24000, seed=args.seed + 1, pause_every=0)
+
+    targets = list(args.targets)
+    if args.audio_source == "tts" and "lipsync" in targets and "infer2" in targets:
+        # TTS音频由infer2测试项生成，须在lipsync之前运行
+        targets.remove("infer2")
+        targets.insert(targets.index("lipsync"), "infer2")
+    elif args.audio_source == "tts" and "lipsync" in targets:
+        targets.insert(targets.index("lipsync"), "infer2")
+
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_info(device),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "work_dir")},
+        "benchmarks": {},
+    }
+    results["settings"]["dtype"] = str(dtype).split(".")[-1]
+    for name in targets:
+        print(f"Running benchmark {name}")
+        try:
+            results["benchmarks"][name] = BENCHMARKS[name](args, inputs)
+        except ImportError as e:
+            print(f"Skip {name}: {e}")
+            results["benchmarks"][name] = {"skipped": str(e)}
+
+    print(f"{'benchmark':<12} {'unit':<14} {'items':>8} {'median s':>10} {'min s':>10} {'s/item':>10}")
+    for name, result in results["benchmarks"].items():
+        if "skipped" in result:
+            print(f"{name:<12} skipped ({result['skipped']})")
+            continue
+        print(
+            f"{name:<12} {result['unit']:<14} {result['items']:>8} {result['seconds']:>10.4f} "
+            f"{result['min_seconds']:>10.4f} {result['seconds_per_item'] or 0:>10.6f}"
+        )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# 基准测试用的合成输入：画出来的人脸视频（嘴部随时间开合、头部轻微晃动）、带停顿的调幅音调，
+# 以及不依赖insightface权重、按肤色定位人脸的检测器替身。相同参数生成的文件逐字节一致，可跨提交复现。
+
+import math
+
+import cv2
+import numpy as np
+import soundfile as sf
+
+from video_encoder import VideoEncoder
+
+SKIN_BGR = (120, 160, 210)
+
+
+def _face_geometry(frame_index, width, height, fps):
+    # 人脸中心左右、上下缓慢晃动，尺寸约为画面短边的一半
+    t = frame_index / fps
+    size = min(width, height) * 0.5
+    cx = width / 2 + size * 0.06 * math.sin(2 * math.pi * 0.3 * t)
+    cy = height / 2 + size * 0.04 * math.sin(2 * math.pi * 0.2 * t)
+    return cx, cy, size
+
+
+def draw_face_frame(frame_index, width, height, fps, seed=0):
+    """第frame_index帧，BGR uint8"""
+    rng = np.random.default_rng(seed + frame_index)
+    # 渐变背景加少量噪声，避免编码器把画面压缩得过于简单
+    gradient = np.linspace(40, 90, width, dtype=np.float32)[None, :, None]
+    frame = np.broadcast_to(gradient, (height, width, 3)).copy()
+    frame += rng.normal(0, 4, size=frame.shape).astype(np.float32)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+
+    cx, cy, size = _face_geometry(frame_index, width, height, fps)
+    center = (int(cx), int(cy))
+    cv2.ellipse(frame, center, (int(size * 0.4), int(size * 0.5)), 0, 0, 360, SKIN_BGR, -1)
+    for side in (-1, 1):
+        eye = (int(cx + side * size * 0.16), int(cy - size * 0.12))
+        cv2.circle(frame, eye, max(int(size * 0.04), 1), (40, 40, 40), -1)
+        brow_y = int(cy - size * 0.2)
+        cv2.line(
+            frame,
+            (int(cx + side * size * 0.08), brow_y),
+            (int(cx + side * size * 0.24), brow_y),
+            (50, 60, 80),
+            max(int(size * 0.015), 1),
+        )
+    cv2.line(frame, center, (int(cx), int(cy + size * 0.1)), (90, 120, 170), max(int(size * 0.015), 1))
+    # 嘴部开合约4Hz，接近说话的音节速率
+    opening = 0.5 + 0.5 * math.sin(2 * math.pi * 4 * frame_index / fps)
+    mouth_axes = (int(size * 0.12), max(int(size * 0.08 * opening), 1))
+    cv2.ellipse(frame, (int(cx), int(cy + size * 0.25)), mouth_axes, 0, 0, 360, (40, 30, 120), -1)
+    return frame
+
+
+def make_face_video(path, seconds=5.0, width=512, height=512, fps=25, seed=0, crf=18):
+    """合成人脸视频（无音轨），返回帧数"""
+    num_frames = int(round(seconds * fps))
+    encoder = VideoEncoder(path, width, height, fps, preset="veryfast", crf=crf)
+    try:
+        for i in range(num_frames):
+            frame = draw_face_frame(i, width, height, fps, seed)
+            encoder.write(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)[None])
+        encoder.close()
+    except BaseException:
+        encoder.abort()
+        raise
+    return num_frames
+
+
+def make_tone_audio(path, seconds=5.0, sample_rate=16000, seed=0, pause_every=3.0, pause_seconds=0.6):
+    """带停顿的调幅音调（16bit wav）：基频缓慢变化模拟语调，每隔pause_every秒静音一段，
+    静音段可以触发流水线的静音复用逻辑"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 160 + 40 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    wave = 0.3 * voice * envelope + 0.01 * rng.standard_normal(len(t))
+    if pause_every > 0:
+        in_pause = np.mod(t, pause_every) >= pause_every - pause_seconds
+        wave[in_pause] = 0.0
+    sf.write(path, wave.astype(np.float32), sample_rate, subtype="PCM_16")
+    return path
+
+
+def make_mask_image(path, resolution=256):
+    """与LatentSync的mask.png形式相同：上半张脸保留（白），下半张脸遮挡（黑）"""
+    mask = np.full((resolution, resolution, 3), 255, dtype=np.uint8)
+    mask[resolution // 2 :] = 0
+    cv2.imwrite(path, mask)
+    return path
+
+
+class SyntheticFaceDetector:
+    """按肤色定位合成视频中的人脸，返回与insightface FaceDetector相同格式的(bbox, landmark_2d_106)
+
+    只填充人脸对齐用到的眉毛和鼻子关键点，其余点放在人脸中心。
+    """
+
+    def __init__(self, skin_bgr=SKIN_BGR, tolerance=12):
+        skin = np.array(skin_bgr, dtype=np.int16)
+        self.lower = np.clip(skin - tolerance, 0, 255).astype(np.uint8)
+        self.upper = np.clip(skin + tolerance, 0, 255).astype(np.uint8)
+
+    def __call__(self, frame):
+        # 流水线传入的是RGB帧
+        mask = cv2.inRange(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR), self.lower, self.upper)
+        points = cv2.findNonZero(mask)
+        if points is None:
+            return None, None
+        x, y, w, h = cv2.boundingRect(points)
+        cx, cy = x + w / 2, y + h / 2
+        size = h  # 人脸椭圆高度为size
+        landmarks = np.tile([cx, cy], (106, 1)).astype(np.float32)
+        brow_y = cy - size * 0.2
+        landmarks[[43, 48, 49, 51, 50]] = [cx - size * 0.16, brow_y]
+        landmarks[101:106] = [cx + size * 0.16, brow_y]
+        landmarks[[74, 77, 83, 86]] = [cx, cy + size * 0.1]
+        bbox = np.array([x, y, x + w, y + h], dtype=np.int32)
+        return bbox, landmarks
@@ -0,0 +1,181 @@
+# 随机初始化的小模型替身：结构与线上模型相同（同一套diffusers/LatentSync/F5-TTS/vocos代码），
+# 只缩小通道数和层数，CPU上几分钟内可以跑完整条流水线。输出没有意义，只用于测量调度、数据搬运、
+# 编解码等与模型大小无关的开销，以及比较不同提交之间的相对耗时。
+
+import copy
+import os
+from dataclasses import asdict
+from importlib.resources import files
+
+import torch
+from omegaconf import OmegaConf
+
+from synthetic import SyntheticFaceDetector
+
+
+def make_tiny_whisper_checkpoint(path, n_audio_state=64, seed=0):
+    """写一个whisper格式的小checkpoint，Audio2Feature按文件路径正常加载；编码器输入仍是30秒/1500帧"""
+    from latentsync.whisper.whisper.model import ModelDimensions, Whisper
+
+    torch.manual_seed(seed)
+    dims = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=n_audio_state,
+        n_audio_head=2,
+        n_audio_layer=2,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=n_audio_state,
+        n_text_head=2,
+        n_text_layer=1,
+    )
+    model = Whisper(dims)
+    torch.save({"dims": asdict(dims), "model_state_dict": model.state_dict()}, path)
+    return path
+
+
+def make_tiny_vae(resolution, seed=0):
+    from diffusers import AutoencoderKL
+
+    torch.manual_seed(seed)
+    # 4个block与sd-vae-ft-mse相同，下采样倍数仍为8
+    vae = AutoencoderKL(
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        block_out_channels=(16, 32, 32, 32),
+        layers_per_block=1,
+        latent_channels=4,
+        norm_num_groups=8,
+        sample_size=resolution,
+    )
+    vae.config.scaling_factor = 0.18215
+    vae.config.shift_factor = 0
+    return vae
+
+
+def make_tiny_unet(model_config, cross_attention_dim, resolution, seed=0):
+    """按LatentSync的unet配置创建UNet3DConditionModel，只缩小宽度和深度，block类型和输入通道数不变"""
+    from latentsync.models.unet import UNet3DConditionModel
+
+    torch.manual_seed(seed)
+    model_config = copy.deepcopy(OmegaConf.to_container(model_config))
+    num_blocks = len(model_config["block_out_channels"])
+    model_config.update(
+        block_out_channels=[32] + [64] * (num_blocks - 1),
+        layers_per_block=1,
+        norm_num_groups=8,
+        attention_head_dim=8,
+        cross_attention_dim=cross_attention_dim,
+        sample_size=resolution // 8,
+    )
+    if "motion_module_kwargs" in model_config:
+        model_config["motion_module_kwargs"]["num_attention_heads"] = 2
+    return UNet3DConditionModel.from_config(model_config)
+
+
+def make_scheduler():
+    # 与LatentSync configs/scheduler_config.json相同的DDIM配置
+    from diffusers import DDIMScheduler
+
+    return DDIMScheduler(
+        num_train_timesteps=1000,
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        clip_sample=False,
+        set_alpha_to_one=False,
+        steps_offset=1,
+    )
+
+
+def build_tiny_lipsync_pipeline(config, work_dir, device, dtype, mask_image_path, seed=0, synthetic_faces=True):
+    """小模型版LipsyncPipelineOptimized
+
+    synthetic_faces为True时人脸检测换成SyntheticFaceDetector，输入须为synthetic生成的视频；
+    为False时走pipeline.get_image_processor创建真实的insightface检测器（CPU上为CPUFaceDetector），输入须为真人视频。
+    """
+    from latentsync.utils.image_processor import ImageProcessor, load_fixed_mask
+    from latentsync.whisper.audio2feature import Audio2Feature
+
+    from lipsync_pipeline_optimized import LipsyncPipelineOptimized
+
+    resolution = config.data.resolution
+    whisper_path = make_tiny_whisper_checkpoint(os.path.join(work_dir, "tiny_whisper.pt"), seed=seed)
+    audio_encoder = Audio2Feature(
+        model_path=whisper_path,
+        device=device,
+        num_frames=config.data.num_frames,
+        audio_feat_length=config.data.audio_feat_length,
+    )
+    pipeline = LipsyncPipelineOptimized(
+        vae=make_tiny_vae(resolution, seed).to(dtype=dtype),
+        audio_encoder=audio_encoder,
+        denoising_unet=make_tiny_unet(config.model, audio_encoder.embedding_dim, resolution, seed).to(dtype=dtype),
+        scheduler=make_scheduler(),
+    ).to(device)
+    if not synthetic_faces:
+        return pipeline
+
+    # 预先放入共享的ImageProcessor，get_image_processor不再创建insightface检测器
+    execution_device = pipeline._execution_device
+    mask_image = load_fixed_mask(resolution, mask_image_path)
+    image_processor = ImageProcessor(resolution, device="cpu", mask_image=mask_image)
+    image_processor.face_detector = SyntheticFaceDetector()
+    key = (resolution, mask_image_path, str(execution_device))
+    pipeline._shared_image_processors[key] = image_processor
+    return pipeline
+
+
+def install_tiny_tts(engine=None, seed=0):
+    """把小模型版F5-TTS（DiT+CFM）和vocos声码器放进TTSEngine，infer2/infer2_stream直接使用，不再下载权重"""
+    from f5_tts.infer.utils_infer import device, hop_length, n_fft, n_mel_channels, target_sample_rate, win_length
+    from f5_tts.model import CFM, DiT
+    from f5_tts.model.utils import get_tokenizer
+    from vocos import Vocos
+    from vocos.feature_extractors import MelSpectrogramFeatures
+    from vocos.heads import ISTFTHead
+    from vocos.models import VocosBackbone
+
+    from inference_audio import get_tts_engine
+
+    engine = engine or get_tts_engine()
+    torch.manual_seed(seed)
+    vocab_char_map, vocab_size = get_tokenizer(str(files("f5_tts").joinpath("infer/examples/vocab.txt")), "custom")
+    ema_model = CFM(
+        transformer=DiT(
+            dim=64,
+            depth=2,
+            heads=2,
+            ff_mult=2,
+            text_dim=32,
+            conv_layers=1,
+            text_num_embeds=vocab_size,
+            mel_dim=n_mel_channels,
+        ),
+        mel_spec_kwargs=dict(
+            n_fft=n_fft,
+            hop_length=hop_length,
+            win_length=win_length,
+            n_mel_channels=n_mel_channels,
+            target_sample_rate=target_sample_rate,
+            mel_spec_type="vocos",
+        ),
+        odeint_kwargs=dict(method="euler"),
+        vocab_char_map=vocab_char_map,
+    ).to(device)
+    vocoder = Vocos(
+        feature_extractor=MelSpectrogramFeatures(
+            sample_rate=target_sample_rate, n_fft=n_fft, hop_length=hop_length, n_mels=n_mel_channels
+        ),
+        backbone=VocosBackbone(input_channels=n_mel_channels, dim=64, intermediate_dim=192, num_layers=2),
+        head=ISTFTHead(dim=64, n_fft=n_fft, hop_length=hop_length),
+    ).to(device)
+    ema_model.eval()
+    vocoder.eval()
+    with engine._lock:
+        engine.ema_model = ema_model
+        engine.vocoder = vocoder
+    return engine
@@ -0,0 +1,86 @@
+import os
+
+import torch
+
+PRECISIONS = ("auto", "fp16", "bf16", "fp32")
+
+_DTYPES = {
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+    "fp32": torch.float32,
+}
+
+
+def resolve_device(device="auto"):
+    """auto时有GPU用cuda，否则用cpu"""
+    if device in (None, "", "auto"):
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def make_generator(device, seed=-1):
+    """任务自己的随机数生成器，seed为-1时随机选取；不修改全局随机状态，并发任务之间互不影响"""
+    device = torch.device(device)
+    # mps上的噪声在CPU上生成（见prepare_latents）
+    generator = torch.Generator("cpu" if device.type == "mps" else device)
+    if seed == -1:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+    return generator
+
+
+def cpu_supports_bf16():
+    """CPU是否有原生bf16指令（AVX512-BF16或AMX），没有时bf16计算反而比fp32慢"""
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, name)() for name in checks if hasattr(torch.cpu, name))
+
+
+def select_dtype(device, precision="auto"):
+    """推理精度：GPU上compute capability大于7时用fp16；CPU上有原生bf16时用bf16，否则fp32"""
+    if precision != "auto":
+        return _DTYPES[precision]
+    device = torch.device(device)
+    if device.type == "cuda":
+        is_fp16_supported = torch.cuda.is_available() and torch.cuda.get_device_capability(device)[0] > 7
+        return torch.float16 if is_fp16_supported else torch.float32
+    if device.type == "cpu" and cpu_supports_bf16():
+        return torch.bfloat16
+    return torch.float32
+
+
+def configure_cpu_threads(num_threads=0):
+    """设置PyTorch/OpenCV的线程数，num_threads为0时使用物理核数（无法获取时用逻辑核数）"""
+    if num_threads <= 0:
+        try:
+            import psutil
+
+            num_threads = psutil.cpu_count(logical=False) or os.cpu_count()
+        except ImportError:
+            num_threads = os.cpu_count()
+    torch.set_num_threads(num_threads)
+    try:
+        # 只能在第一次并行计算之前设置
+        torch.set_num_interop_threads(max(num_threads // 4, 1))
+    except RuntimeError:
+        pass
+    try:
+        import cv2
+
+        # 人脸对齐在多个线程中调用OpenCV，避免与PyTorch争抢核数
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+    return num_threads
+
+
+def to_channels_last(*modules):
+    """把卷积权重转为channels-last布局，CPU上oneDNN卷积不再需要来回转换"""
+    for module in modules:
+        module.to(memory_format=torch.channels_last)
+
+
+def synchronize(device):
+    device = torch.device(device)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
@@ -0,0 +1,265 @@
+import threading
+import time
+
+import torch
+
+
+CFG_MODES = ("full", "interval", "cache")
+
+
+class DenoiseRequest:
+    """一个chunk的去噪状态：自己的latents、条件输入、音频特征和scheduler，每次step推进一个时间步
+
+    latents的batch维可以有多行（同一任务中连续的几段帧），condition为沿通道维拼接好的mask、masked image
+    和参考图像latents，CFG时batch维为2倍行数（前一半无条件、后一半有条件）。
+    cfg_mode控制无条件分支在哪些步计算：
+      full      每一步都计算（原始做法）
+      interval  只在去噪进度位于cfg_interval=(start, end)区间内的步计算，其余步只用有条件分支
+      cache     每cfg_refresh步计算一次，其余步沿用最近一次的引导残差(有条件 - 无条件)
+    timer为StageTimer时每一步的UNet前向计入unet_step阶段。
+    """
+
+    def __init__(
+        self,
+        latents,
+        condition,
+        audio_embeds,
+        scheduler,
+        timesteps,
+        guidance_scale,
+        extra_step_kwargs,
+        cfg_mode="full",
+        cfg_interval=(0.0, 0.5),
+        cfg_refresh=3,
+        timer=None,
+    ):
+        if cfg_mode not in CFG_MODES:
+            raise ValueError(f"cfg_mode must be one of {CFG_MODES}, got {cfg_mode}")
+        self.latents = latents
+        self.condition = condition
+        self.audio_embeds = audio_embeds
+        self.scheduler = scheduler
+        self.timesteps = timesteps
+        self.guidance_scale = guidance_scale
+        self.extra_step_kwargs = extra_step_kwargs
+        self.do_classifier_free_guidance = guidance_scale > 1.0
+        self.cfg_mode = cfg_mode
+        self.cfg_interval = cfg_interval
+        self.cfg_refresh = max(int(cfg_refresh), 1)
+        self.timer = timer
+        self.step_index = 0
+        # 实际计算了无条件分支的步数
+        self.uncond_steps = 0
+        self._guidance_residual = None
+        self.error = None
+        self._done = threading.Event()
+
+    def _uncond_this_step(self):
+        if not self.do_classifier_free_guidance:
+            return False
+        if self.cfg_mode == "interval":
+            progress = self.step_index / len(self.timesteps)
+            return self.cfg_interval[0] <= progress < self.cfg_interval[1]
+        if self.cfg_mode == "cache":
+            return self._guidance_residual is None or self.step_index % self.cfg_refresh == 0
+        return True
+
+    @property
+    def num_frames(self):
+        return self.latents.shape[0] * self.latents.shape[2]
+
+    @property
+    def finished(self):
+        return self.step_index >= len(self.timesteps)
+
+    def batch_key(self):
+        # 只有形状和精度相同、是否带音频条件相同的请求才能拼到同一个batch
+        return (tuple(self.condition.shape[1:]), self.latents.dtype, self.audio_embeds is None)
+
+    def unet_input(self):
+        """返回本步的(UNet输入, t, 音频特征)"""
+        t = self.timesteps[self.step_index]
+        condition, audio_embeds = self.condition, self.audio_embeds
+        if self._uncond_this_step():
+            # expand the latents if we are doing classifier free guidance
+            denoising_unet_input = torch.cat([self.latents] * 2)
+        else:
+            # 只计算有条件分支，CFG时条件输入和音频特征取后一半
+            denoising_unet_input = self.latents
+            if self.do_classifier_free_guidance:
+                condition = condition[len(condition) // 2 :]
+                if audio_embeds is not None:
+                    audio_embeds = audio_embeds[len(audio_embeds) // 2 :]
+        denoising_unet_input = self.scheduler.scale_model_input(denoising_unet_input, t)
+        # concat latents, mask, masked_image_latents in the channel dimension
+        return torch.cat([denoising_unet_input, condition], dim=1), t, audio_embeds
+
+    def apply(self, noise_pred):
+        t = self.timesteps[self.step_index]
+        # perform guidance
+        if self._uncond_this_step():
+            noise_pred_uncond, noise_pred_audio = noise_pred.chunk(2)
+            if self.cfg_mode == "cache":
+                self._guidance_residual = noise_pred_audio - noise_pred_uncond
+            noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_audio - noise_pred_uncond)
+            self.uncond_steps += 1
+        elif self.do_classifier_free_guidance and self.cfg_mode == "cache":
+            # uncond + g * (cond - uncond) = cond + (g - 1) * (cond - uncond)
+            noise_pred = noise_pred + (self.guidance_scale - 1) * self._guidance_residual
+        # compute the previous noisy sample x_t -> x_t-1
+        self.latents = self.scheduler.step(noise_pred, t, self.latents, **self.extra_step_kwargs).prev_sample
+        self.step_index += 1
+
+    def run(self, denoising_unet):
+        """不经过batcher，逐步完成全部去噪"""
+        while not self.finished:
+            if self.timer is None:
+                self._step(denoising_unet)
+            else:
+                with self.timer("unet_step", sync=True):
+                    self._step(denoising_unet)
+        return self.latents
+
+    def _step(self, denoising_unet):
+        denoising_unet_input, t, audio_embeds = self.unet_input()
+        noise_pred = denoising_unet(denoising_unet_input, t, encoder_hidden_states=audio_embeds).sample
+        self.apply(noise_pred)
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.latents
+
+
+class DiffusionBatcher:
+    """跨任务的连续批处理：多个任务的chunk各自保存去噪状态，每一步把能拼在一起的chunk合成一次UNet前向
+
+    不同chunk可以处于不同的时间步（每行使用自己的t），新chunk随时加入，完成的chunk立即返回给所属任务。
+    使用batcher的任务先attach、结束后detach；close之后等所有任务detach、请求处理完，工作线程退出并释放UNet。
+    """
+
+    def __init__(self, denoising_unet, max_batch_size=4):
+        self.denoising_unet = denoising_unet
+        self.max_batch_size = max_batch_size
+        self._cond = threading.Condition()
+        self._active = []
+        self._thread = None
+        self._users = 0
+        self._closed = False
+        self._metrics = {
+            "requests": 0,
+            "steps": 0,
+            "batched_requests": 0,
+            "frames": 0,
+            "busy_seconds": 0.0,
+        }
+
+    def attach(self):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DiffusionBatcher is closed")
+            self._users += 1
+
+    def detach(self):
+        with self._cond:
+            self._users -= 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def run(self, request):
+        """提交一个chunk并等待去噪完成，返回最终latents"""
+        with self._cond:
+            if self.denoising_unet is None:
+                raise RuntimeError("DiffusionBatcher is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="diffusion-batcher", daemon=True)
+                self._thread.start()
+            self._active.append(request)
+            self._metrics["requests"] += 1
+            self._cond.notify_all()
+        return request.wait()
+
+    def _select(self):
+        # 以等待最久的请求为准，取与它形状相同的请求组成batch
+        key = self._active[0].batch_key()
+        group = []
+        for request in self._active:
+            if request.batch_key() == key:
+                group.append(request)
+                if len(group) >= self.max_batch_size:
+                    break
+        return group
+
+    @torch.no_grad()
+    def _step(self, group):
+        inputs, timesteps, audio_embeds, rows = [], [], [], []
+        for request in group:
+            denoising_unet_input, t, request_audio_embeds = request.unet_input()
+            inputs.append(denoising_unet_input)
+            rows.append(len(denoising_unet_input))
+            t = torch.as_tensor(t, device=denoising_unet_input.device)
+            timesteps.append(t.reshape(1).expand(rows[-1]))
+            audio_embeds.append(request_audio_embeds)
+        # UNet中音频特征按(b f)展开，与输入的batch顺序一致
+        audio_embeds = None if audio_embeds[0] is None else torch.cat(audio_embeds)
+        noise_pred = self.denoising_unet(
+            torch.cat(inputs), torch.cat(timesteps), encoder_hidden_states=audio_embeds
+        ).sample
+        for request, request_noise_pred in zip(group, noise_pred.split(rows)):
+            request.apply(request_noise_pred)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._active:
+                    if self._closed and self._users == 0:
+                        self.denoising_unet = None
+                        self._thread = None
+                        return
+                    self._cond.wait()
+                group = self._select()
+
+            start_time = time.perf_counter()
+            error = None
+            try:
+                self._step(group)
+            except Exception as e:
+                error = e
+            elapsed = time.perf_counter() - start_time
+
+            with self._cond:
+                self._metrics["steps"] += 1
+                self._metrics["batched_requests"] += len(group)
+                self._metrics["busy_seconds"] += elapsed
+                # 参与本次前向的请求排到队尾，轮流处理不同形状的请求
+                self._active = [request for request in self._active if request not in group]
+                for request in group:
+                    # 合并执行的前向，每个参与的请求都等待了完整的耗时
+                    if error is None and request.timer is not None:
+                        request.timer.add("unet_step", elapsed)
+                    if error is not None:
+                        request.error = error
+                        request._done.set()
+                    elif request.finished:
+                        self._metrics["frames"] += request.num_frames
+                        request._done.set()
+                    else:
+                        self._active.append(request)
+
+    def stats(self):
+        with self._cond:
+            metrics = dict(self._metrics)
+            steps = metrics["steps"]
+            busy_seconds = metrics["busy_seconds"]
+            metrics["active"] = len(self._active)
+            metrics["avg_batch_size"] = round(metrics["batched_requests"] / steps, 3) if steps else 0.0
+            metrics["occupancy"] = round(metrics["avg_batch_size"] / self.max_batch_size, 3)
+            metrics["frames_per_second"] = round(metrics["frames"] / busy_seconds, 2) if busy_seconds > 0 else 0.0
+            metrics["busy_seconds"] = round(busy_seconds, 3)
+            return metrics
+
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+
+_hash_memo = {}
+
+
+def hash_file(path):
+    """文件内容的SHA-256；同一进程内按(路径, 大小, 修改时间)记住结果"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _hash_memo:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+class DiskLRUCache:
+    """磁盘缓存的公共部分：每个条目一个目录，目录下meta.json的修改时间记为最近使用时间，
+    总大小超过max_bytes时从最久未使用的条目开始删除（max_bytes为None时不淘汰）。
+    以"."开头的目录是正在写入的临时目录，不参与淘汰。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def record_hit(self, entry_dir):
+        # 更新访问时间，用于LRU淘汰
+        try:
+            os.utime(entry_dir / "meta.json")
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def evict(self):
+        """删除最久未使用的条目直到总大小不超过max_bytes，返回删除的条目数"""
+        if self.max_bytes is None or not self.cache_dir.exists():
+            return 0
+        entries = []
+        total_bytes = 0
+        for entry_dir in self.cache_dir.iterdir():
+            meta_path = entry_dir / "meta.json"
+            if entry_dir.name.startswith(".") or not meta_path.exists():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry_dir.iterdir())
+                last_used = meta_path.stat().st_mtime
+            except OSError:
+                # 其他任务正在删除或替换这个条目
+                continue
+            entries.append((last_used, size, entry_dir))
+            total_bytes += size
+        evicted = 0
+        for _, size, entry_dir in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
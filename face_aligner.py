@@ -0,0 +1,141 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+from einops import rearrange
+
+from latentsync.utils.face_detector import FaceDetector
+from latentsync.utils.image_processor import ImageProcessor
+
+from face_alignment_cache import get_face_alignment_cache
+from frame_source import FrameSource
+
+FACE_DETECTOR_ROOT = "checkpoints/auxiliary"
+
+
+class CPUFaceDetector(FaceDetector):
+    """LatentSync的FaceDetector固定使用CUDAExecutionProvider，这里改用CPUExecutionProvider，
+    检测、筛选和关键点处理沿用FaceDetector.__call__"""
+
+    def __init__(self, root=FACE_DETECTOR_ROOT, det_size=(512, 512)):
+        from insightface.app import FaceAnalysis
+
+        self.app = FaceAnalysis(
+            allowed_modules=["detection", "landmark_2d_106"], root=root, providers=["CPUExecutionProvider"]
+        )
+        self.app.prepare(ctx_id=-1, det_size=det_size)
+
+
+def create_image_processor(resolution, device, mask_image=None):
+    """创建ImageProcessor；LatentSync在CPU上不创建人脸检测器（affine_transform直接报错），CPU上换成CPUFaceDetector"""
+    image_processor = ImageProcessor(resolution, device=device, mask_image=mask_image)
+    if torch.device(device).type == "cpu":
+        image_processor.face_detector = CPUFaceDetector()
+    # copy.copy出的副本共享检测模型，也共享这把锁（见FaceAligner）
+    image_processor.face_detector_lock = threading.Lock()
+    return image_processor
+
+
+class FaceAligner:
+    """逐帧人脸对齐。num_workers>1时人脸检测在线程池中并行执行
+
+    仿射矩阵带有跨帧平滑状态，所以检测完成后仍按帧顺序计算仿射矩阵并裁剪人脸，
+    结果与ImageProcessor.affine_transform逐帧调用完全一致。
+    多个任务共用同一个检测模型时按批加锁：同一批帧仍在线程池中并行检测，不同任务的批次依次执行。
+    """
+
+    def __init__(self, image_processor, num_workers=1):
+        self.image_processor = image_processor
+        self.num_workers = num_workers
+        self._detector_lock = getattr(image_processor, "face_detector_lock", None) or threading.Lock()
+        self._executor = None
+        if num_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="face-detect")
+
+    def detect(self, frame):
+        return self.image_processor.face_detector(frame)
+
+    def align_face(self, frame, bbox, landmark_2d_106):
+        # 与ImageProcessor.affine_transform中检测之后的步骤相同
+        if bbox is None:
+            raise RuntimeError("Face not detected")
+
+        pt_left_eye = np.mean(landmark_2d_106[[43, 48, 49, 51, 50]], axis=0)  # left eyebrow center
+        pt_right_eye = np.mean(landmark_2d_106[101:106], axis=0)  # right eyebrow center
+        pt_nose = np.mean(landmark_2d_106[[74, 77, 83, 86]], axis=0)  # nose center
+
+        landmarks3 = np.round([pt_left_eye, pt_right_eye, pt_nose])
+
+        face, affine_matrix = self.image_processor.restorer.align_warp_face(
+            frame.copy(), landmarks3=landmarks3, smooth=True
+        )
+        box = [0, 0, face.shape[1], face.shape[0]]  # x1, y1, x2, y2
+        resolution = self.image_processor.resolution
+        face = cv2.resize(face, (resolution, resolution), interpolation=cv2.INTER_LANCZOS4)
+        face = rearrange(torch.from_numpy(face), "h w c -> c h w")
+        return face, box, affine_matrix
+
+    def __call__(self, video_frames):
+        with self._detector_lock:
+            return self._align(video_frames)
+
+    def _align(self, video_frames):
+        faces = []
+        boxes = []
+        affine_matrices = []
+        if self._executor is None:
+            for frame in video_frames:
+                face, box, affine_matrix = self.image_processor.affine_transform(frame)
+                faces.append(face)
+                boxes.append(box)
+                affine_matrices.append(affine_matrix)
+        else:
+            # executor.map按输入顺序返回结果
+            detections = self._executor.map(self.detect, video_frames)
+            for frame, (bbox, landmark_2d_106) in zip(video_frames, detections):
+                face, box, affine_matrix = self.align_face(frame, bbox, landmark_2d_106)
+                faces.append(face)
+                boxes.append(box)
+                affine_matrices.append(affine_matrix)
+
+        faces = torch.stack(faces)
+        return faces, boxes, affine_matrices
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def align_video_to_cache(image_processor, video_path, num_workers=4, batch_size=16):
+    """对整个源视频做人脸对齐并写入磁盘缓存，之后的推理直接读取缓存；已缓存时直接返回
+
+    image_processor不能与正在推理的流水线共用，仿射矩阵的平滑状态是逐帧累积的。
+    """
+    resolution = image_processor.resolution
+    alignment_cache = get_face_alignment_cache()
+    frame_source = FrameSource(video_path, batch_size)
+    frame_count = frame_source.frame_count
+    if alignment_cache.load(video_path, resolution, frame_count) is not None:
+        frame_source.close()
+        return frame_count
+
+    if hasattr(image_processor.restorer, "p_bias"):
+        image_processor.restorer.p_bias = None
+    face_aligner = FaceAligner(image_processor, num_workers=num_workers)
+    writer = alignment_cache.writer(video_path, resolution, frame_count)
+    try:
+        for slot, start, frames in frame_source:
+            faces, boxes, affine_matrices = face_aligner(frames)
+            frame_source.release(slot)
+            writer.write(start, faces, boxes, affine_matrices)
+        committed = writer.commit()
+        writer = None
+        return frame_count if committed else 0
+    finally:
+        frame_source.close()
+        face_aligner.close()
+        if writer is not None:
+            writer.abort()
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from disk_cache import DiskLRUCache, hash_file
+
+CACHE_VERSION = 1
+
+
+class CachedAlignment:
+    """一个源视频的人脸对齐结果，人脸图像以内存映射方式读取"""
+
+    def __init__(self, entry_dir):
+        with open(entry_dir / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.num_frames = self.meta["num_frames"]
+        self.faces = np.load(entry_dir / "faces.npy", mmap_mode="r")
+        self.boxes = np.load(entry_dir / "boxes.npy")
+        self.affine_matrices = np.load(entry_dir / "affine_matrices.npy")
+
+    def get(self, start, count):
+        end = start + count
+        faces = torch.from_numpy(np.array(self.faces[start:end]))
+        boxes = [list(box) for box in self.boxes[start:end]]
+        affine_matrices = list(self.affine_matrices[start:end])
+        return faces, boxes, affine_matrices
+
+
+class AlignmentWriter:
+    """边处理边写入对齐结果，全部帧写完后commit才会生效"""
+
+    def __init__(self, cache, entry_dir, num_frames, resolution):
+        self.cache = cache
+        self.entry_dir = entry_dir
+        self.num_frames = num_frames
+        self.resolution = resolution
+        cache.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.temp_dir = Path(tempfile.mkdtemp(dir=cache.cache_dir, prefix=".tmp_"))
+        self.faces = np.lib.format.open_memmap(
+            self.temp_dir / "faces.npy", mode="w+", dtype=np.uint8, shape=(num_frames, 3, resolution, resolution)
+        )
+        self.boxes = np.zeros((num_frames, 4), dtype=np.float64)
+        self.affine_matrices = np.zeros((num_frames, 2, 3), dtype=np.float64)
+        self.written = np.zeros(num_frames, dtype=bool)
+
+    def write(self, start, faces, boxes, affine_matrices):
+        end = start + len(faces)
+        self.faces[start:end] = faces.numpy()
+        self.boxes[start:end] = np.asarray(boxes, dtype=np.float64)
+        self.affine_matrices[start:end] = np.asarray(affine_matrices, dtype=np.float64)
+        self.written[start:end] = True
+
+    def commit(self):
+        if not self.written.all():
+            self.abort()
+            return False
+        self.faces.flush()
+        del self.faces
+        np.save(self.temp_dir / "boxes.npy", self.boxes)
+        np.save(self.temp_dir / "affine_matrices.npy", self.affine_matrices)
+        with open(self.temp_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"num_frames": self.num_frames, "resolution": self.resolution}, f)
+        # 覆盖较短的旧缓存
+        shutil.rmtree(self.entry_dir, ignore_errors=True)
+        try:
+            os.rename(self.temp_dir, self.entry_dir)
+        except OSError:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            return False
+        self.cache.evict()
+        return True
+
+    def abort(self):
+        self.faces = None
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class FaceAlignmentCache(DiskLRUCache):
+    """按源视频内容哈希和分辨率缓存人脸框、仿射矩阵和对齐后的人脸，超过max_bytes时按最近使用时间淘汰"""
+
+    def __init__(self, cache_dir="output/cache/face_alignment", max_bytes=8 << 30):
+        super().__init__(cache_dir, max_bytes)
+
+    def entry_dir(self, video_path, resolution):
+        return self.cache_dir / f"{hash_file(video_path)}_{resolution}_v{CACHE_VERSION}"
+
+    def load(self, video_path, resolution, num_frames):
+        """返回至少包含前num_frames帧的缓存，否则返回None"""
+        entry_dir = self.entry_dir(video_path, resolution)
+        cached = None
+        if (entry_dir / "meta.json").exists():
+            try:
+                cached = CachedAlignment(entry_dir)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"人脸对齐缓存损坏，重新生成: {entry_dir} ({e})")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+        if cached is not None and cached.num_frames >= num_frames:
+            self.record_hit(entry_dir)
+            return cached
+        self.record_miss()
+        return None
+
+    def writer(self, video_path, resolution, num_frames):
+        return AlignmentWriter(self, self.entry_dir(video_path, resolution), num_frames, resolution)
+
+
+_face_alignment_cache = FaceAlignmentCache()
+
+
+def get_face_alignment_cache():
+    return _face_alignment_cache
@@ -0,0 +1,119 @@
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision
+from einops import rearrange
+
+
+def _erode(mask, ksize):
+    # 与cv2.erode相同：矩形核，锚点在核中心，边界不参与取最小值
+    if ksize <= 0:
+        ksize = 3
+    anchor = ksize // 2
+    padded = F.pad(mask, (anchor, ksize - 1 - anchor, anchor, ksize - 1 - anchor), value=float("inf"))
+    # 矩形核可分离：先按行再按列取最小值
+    eroded = -F.max_pool2d(-padded, (1, ksize), stride=1)
+    return -F.max_pool2d(-eroded, (ksize, 1), stride=1)
+
+
+def _gaussian_blur(mask, ksize):
+    # 与cv2.GaussianBlur(sigma=0)相同的核，边界按BORDER_REFLECT_101处理
+    sigma = 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+    x = torch.arange(ksize, dtype=mask.dtype, device=mask.device) - (ksize - 1) / 2
+    kernel = torch.exp(-(x**2) / (2 * sigma**2))
+    kernel = kernel / kernel.sum()
+    pad = ksize // 2
+    mask = F.conv2d(F.pad(mask, (pad, pad, 0, 0), mode="reflect"), kernel.view(1, 1, 1, -1))
+    mask = F.conv2d(F.pad(mask, (0, 0, pad, pad), mode="reflect"), kernel.view(1, 1, -1, 1))
+    return mask
+
+
+def faces_to_uint8(faces, height, width):
+    """与restore_frame相同：缩放到人脸框大小并量化为0~255"""
+    faces = torchvision.transforms.functional.resize(faces, size=(height, width), antialias=True)
+    faces = (faces / 2 + 0.5).clamp(0, 1)
+    return (faces * 255).to(torch.uint8)
+
+
+@torch.no_grad()
+def restore_faces_batched(faces, video_frames, boxes, affine_matrices):
+    """批量把生成的人脸逆仿射变换回原帧并羽化融合
+
+    逐帧版本(AlignRestore.restore_img)用cv2在CPU上处理每一帧；这里用grid_sample对整组帧一次完成，
+    只在人脸所在的区域内计算，最后只把融合好的区域拷回内存。
+    faces: (f, c, h, w)，取值[-1, 1]，在GPU上；video_frames: (f, H, W, 3) uint8 numpy
+    boxes: 每帧的人脸框，人脸先缩放到框的大小再贴回
+    """
+    face_sizes = [(int(y2 - y1), int(x2 - x1)) for x1, y1, x2, y2 in boxes]
+    if len(set(face_sizes)) > 1:
+        # 人脸框大小不同时按大小分组，每组缩放到自己的框大小，与逐帧的restore_frame一致
+        out_frames = video_frames.copy()
+        for face_size in set(face_sizes):
+            index = [i for i, size in enumerate(face_sizes) if size == face_size]
+            out_frames[index] = restore_faces_batched(
+                faces[torch.tensor(index, device=faces.device)],
+                video_frames[index],
+                [boxes[i] for i in index],
+                [affine_matrices[i] for i in index],
+            )
+        return out_frames
+
+    device = faces.device
+    num_frames = len(faces)
+    frame_height, frame_width = video_frames.shape[1:3]
+    face_height, face_width = face_sizes[0]
+
+    face_uint8 = faces_to_uint8(faces, face_height, face_width).float()
+    affine = torch.from_numpy(np.asarray(affine_matrices, dtype=np.float64))
+
+    # 人脸区域在原帧中的外接框（整组帧取并集），留出边距
+    inverse = torch.linalg.inv(torch.cat([affine, affine.new_tensor([[[0, 0, 1]]]).expand(num_frames, -1, -1)], 1))
+    corners = affine.new_tensor(
+        [[0, 0, 1], [face_width - 1, 0, 1], [0, face_height - 1, 1], [face_width - 1, face_height - 1, 1]]
+    )
+    corners = torch.einsum("fij,kj->fki", inverse[:, :2], corners)
+    margin = 2
+    roi_x0 = max(int(math.floor(corners[..., 0].min().item())) - margin, 0)
+    roi_y0 = max(int(math.floor(corners[..., 1].min().item())) - margin, 0)
+    roi_x1 = min(int(math.ceil(corners[..., 0].max().item())) + margin + 1, frame_width)
+    roi_y1 = min(int(math.ceil(corners[..., 1].max().item())) + margin + 1, frame_height)
+    if roi_x0 >= roi_x1 or roi_y0 >= roi_y1:
+        return video_frames.copy()
+
+    # 原帧像素(x, y)对应人脸图像中的 affine @ [x, y, 1]
+    ys = torch.arange(roi_y0, roi_y1, dtype=torch.float64)
+    xs = torch.arange(roi_x0, roi_x1, dtype=torch.float64)
+    grid_y, grid_x = torch.meshgrid(ys, xs, indexing="ij")
+    points = torch.stack([grid_x, grid_y, torch.ones_like(grid_x)], dim=-1)
+    source = torch.einsum("fij,hwj->fhwi", affine, points)
+    source[..., 0] = source[..., 0] * 2 / (face_width - 1) - 1
+    source[..., 1] = source[..., 1] * 2 / (face_height - 1) - 1
+    grid = source.to(device=device, dtype=torch.float32)
+
+    inv_restored = F.grid_sample(face_uint8, grid, mode="bilinear", padding_mode="zeros", align_corners=True)
+    inv_restored = inv_restored.round().clamp(0, 255)
+    ones = torch.ones(num_frames, 1, face_height, face_width, device=device)
+    inv_mask = F.grid_sample(ones, grid, mode="bilinear", padding_mode="zeros", align_corners=True)
+
+    inv_mask_erosion = _erode(inv_mask, 2)
+    pasted_face = inv_mask_erosion * inv_restored
+
+    # 羽化宽度取决于每帧的人脸面积，面积相同的帧一起处理
+    total_face_area = inv_mask_erosion.sum(dim=(1, 2, 3)).cpu().numpy()
+    w_edges = [int(area**0.5) // 20 for area in total_face_area]
+    inv_soft_mask = torch.empty_like(inv_mask_erosion)
+    for w_edge in set(w_edges):
+        index = torch.tensor([i for i, w in enumerate(w_edges) if w == w_edge], device=device)
+        inv_mask_center = _erode(inv_mask_erosion[index], w_edge * 2)
+        inv_soft_mask[index] = _gaussian_blur(inv_mask_center, w_edge * 2 + 1)
+
+    roi = torch.from_numpy(np.ascontiguousarray(video_frames[:, roi_y0:roi_y1, roi_x0:roi_x1]))
+    roi = rearrange(roi.to(device), "f h w c -> f c h w").float()
+    blended = inv_soft_mask * pasted_face + (1 - inv_soft_mask) * roi
+    blended = rearrange(blended.clamp(0, 255).to(torch.uint8), "f c h w -> f h w c").cpu().numpy()
+
+    out_frames = video_frames.copy()
+    out_frames[:, roi_y0:roi_y1, roi_x0:roi_x1] = blended
+    return out_frames
@@ -0,0 +1,254 @@
+import queue
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from pipeline_stages import _END, _get, _put
+
+
+class OpenCVBackend:
+    """cv2.VideoCapture解码，直接解码到预分配的数组并原地转换为RGB"""
+
+    def __init__(self, video_path):
+        self._cap = cv2.VideoCapture(video_path)
+        if not self._cap.isOpened():
+            raise ValueError(f"无法打开文件： {video_path}")
+        self.frame_count = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self._cap.get(cv2.CAP_PROP_FPS)
+
+    def read_into(self, frame):
+        success, image = self._cap.read(frame)
+        if not success:
+            return False
+        if not np.shares_memory(image, frame):
+            # 解码尺寸与缓冲区不一致时OpenCV会重新分配数组
+            frame[:] = image
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+        return True
+
+    def close(self):
+        self._cap.release()
+
+
+class DecordBackend:
+    """decord解码，输出已经是RGB"""
+
+    def __init__(self, video_path):
+        try:
+            import decord
+        except ImportError:
+            raise ImportError("decord is not installed, run `pip install decord` or use another backend")
+        self._reader = decord.VideoReader(video_path, ctx=decord.cpu(0))
+        self.frame_count = len(self._reader)
+        self.height, self.width = self._reader[0].shape[:2]
+        self.fps = self._reader.get_avg_fps()
+        self._reader.seek(0)
+        self._index = 0
+
+    def read_into(self, frame):
+        if self._index >= self.frame_count:
+            return False
+        frame[:] = self._reader.next().asnumpy()
+        self._index += 1
+        return True
+
+    def close(self):
+        self._reader = None
+
+
+class FFmpegBackend:
+    """ffmpeg进程解码为rgb24原始帧，通过管道直接读入预分配的数组"""
+
+    def __init__(self, video_path):
+        import ffmpeg
+
+        probe = ffmpeg.probe(video_path)
+        stream = next(s for s in probe["streams"] if s["codec_type"] == "video")
+        self.width = int(stream["width"])
+        self.height = int(stream["height"])
+        numerator, denominator = stream["avg_frame_rate"].split("/")
+        self.fps = float(numerator) / float(denominator) if float(denominator) else 0.0
+        if "nb_frames" in stream:
+            self.frame_count = int(stream["nb_frames"])
+        else:
+            self.frame_count = int(round(float(stream["duration"]) * self.fps))
+        self._process = subprocess.Popen(
+            [
+                "ffmpeg", "-loglevel", "error", "-nostdin", "-i", video_path,
+                "-map", "0:v:0", "-f", "rawvideo", "-pix_fmt", "rgb24", "-",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def read_into(self, frame):
+        view = memoryview(frame.reshape(-1))
+        filled = 0
+        while filled < len(view):
+            n = self._process.stdout.readinto(view[filled:])
+            if not n:
+                return False
+            filled += n
+        return True
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+
+
+BACKENDS = {
+    "opencv": OpenCVBackend,
+    "decord": DecordBackend,
+    "ffmpeg": FFmpegBackend,
+}
+
+
+def register_backend(name, backend_cls):
+    """注册新的解码后端，backend_cls(video_path)需要提供frame_count/width/height/fps和read_into(frame)"""
+    BACKENDS[name] = backend_cls
+
+
+class FrameSource:
+    """后台线程预读视频帧，按batch_size一组产出(slot, start, frames)
+
+    帧解码到固定数量的预分配缓冲区（环形缓冲）中，frames是缓冲区的视图，
+    使用完后必须调用release(slot)归还，否则预读线程会在缓冲区用完时等待。
+    num_buffers需要大于下游同时持有的batch数量。
+    缓冲区总量超过max_buffer_bytes时缩小batch_size，保持为batch_multiple的整数倍（至少一倍）。
+    """
+
+    def __init__(
+        self, video_path, batch_size, backend="opencv", num_buffers=4, max_frames=None,
+        max_buffer_bytes=None, batch_multiple=1,
+    ):
+        self.video_path = video_path
+        self.backend = BACKENDS[backend](video_path)
+        self.frame_count = self.backend.frame_count
+        self.width = self.backend.width
+        self.height = self.backend.height
+        self.fps = self.backend.fps
+        self.max_frames = self.frame_count if max_frames is None else min(max_frames, self.frame_count)
+        self.batch_size = max(min(batch_size, self.max_frames), 1)
+        if max_buffer_bytes is not None:
+            fit = int(max_buffer_bytes // (num_buffers * self.height * self.width * 3))
+            fit = max(fit - fit % batch_multiple, batch_multiple)
+            self.batch_size = max(min(self.batch_size, fit), 1)
+
+        self._buffers = np.empty((num_buffers, self.batch_size, self.height, self.width, 3), dtype=np.uint8)
+        self._free = queue.Queue()
+        for slot in range(num_buffers):
+            self._free.put(slot)
+        self._ready = queue.Queue(maxsize=num_buffers)
+        self._stop = threading.Event()
+        self._error = None
+        self.frames_decoded = 0
+        self.decode_seconds = 0.0
+        self._thread = None
+
+    def _decode(self):
+        try:
+            start = 0
+            while start < self.max_frames:
+                slot = _get(self._free, self._stop)
+                if slot is _END:
+                    return
+                frames = self._buffers[slot]
+                count = min(self.batch_size, self.max_frames - start)
+                start_time = time.perf_counter()
+                decoded = 0
+                while decoded < count and self.backend.read_into(frames[decoded]):
+                    decoded += 1
+                self.decode_seconds += time.perf_counter() - start_time
+                self.frames_decoded += decoded
+                if decoded == 0:
+                    self._free.put(slot)
+                    break
+                if not _put(self._ready, (slot, start, decoded), self._stop):
+                    return
+                start += decoded
+                if decoded < count:
+                    break
+        except BaseException as e:
+            self._error = e
+        finally:
+            _put(self._ready, _END, self._stop)
+
+    def __iter__(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._decode, name="frame-source", daemon=True)
+            self._thread.start()
+        while True:
+            item = _get(self._ready, self._stop)
+            if item is _END:
+                break
+            slot, start, count = item
+            yield slot, start, self._buffers[slot, :count]
+        if self._error is not None:
+            raise self._error
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.backend.close()
+
+    @property
+    def decode_fps(self):
+        return self.frames_decoded / self.decode_seconds if self.decode_seconds > 0 else 0.0
+
+    def stats(self):
+        return {
+            "frames": self.frames_decoded,
+            "seconds": round(self.decode_seconds, 4),
+            "fps": round(self.decode_fps, 2),
+        }
+
+
+class SourceFrameReader:
+    """按帧号随机读取源视频帧（RGB），用于循环播放时不把整段源视频留在内存里
+
+    每次读取indices中最小到最大帧号之间连续的一段，再按indices取出；请求的起点不是上次读到的下一帧时才跳转。
+    """
+
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self._cap = cv2.VideoCapture(video_path)
+        if not self._cap.isOpened():
+            raise ValueError(f"无法打开文件： {video_path}")
+        self.width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self._position = 0
+        self.frames_decoded = 0
+        self.decode_seconds = 0.0
+
+    def read(self, indices):
+        indices = np.asarray(indices)
+        first, last = int(indices.min()), int(indices.max())
+        start_time = time.perf_counter()
+        if first != self._position:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+        frames = np.empty((last - first + 1, self.height, self.width, 3), dtype=np.uint8)
+        for i in range(len(frames)):
+            success, image = self._cap.read(frames[i])
+            if not success:
+                raise RuntimeError(f"Failed to read frame {first + i} of {self.video_path}")
+            if not np.shares_memory(image, frames[i]):
+                frames[i] = image
+            cv2.cvtColor(frames[i], cv2.COLOR_BGR2RGB, dst=frames[i])
+        self._position = last + 1
+        self.decode_seconds += time.perf_counter() - start_time
+        self.frames_decoded += len(frames)
+        return frames[indices - first]
+
+    def close(self):
+        self._cap.release()
@@ -4,11 +4,20 @@ from pathlib import Path
 from omegaconf import OmegaConf
 from datetime import datetime
 import time
-import argparse
+import threading
+from functools import partial
 
-from inference_audio import gpu_decorator, infer2
-from inference_video import main as inference_video_main
-from util import loop_video
+from latentsync.utils.image_processor import load_fixed_mask
+
+from device_utils import resolve_device
+from face_aligner import align_video_to_cache, create_image_processor
+from inference_audio import get_tts_engine, gpu_decorator, infer2_stream
+from inference_video import PRESETS, build_parser, main as inference_video_main
+from lipsync_pipeline_optimized import SCHEDULERS
+from job_scheduler import Stage, get_job_scheduler
+from metrics import get_metrics_registry, peak_memory, reset_peak_memory, start_metrics_server
+from model_registry import get_registry
+from pipeline_stages import StageTimer
 
 # Paths for video processing
 SUBMODULES_PATH = Path("submodules")
@@ -26,69 +35,124 @@ def measure_time(func):
         return result
     return wrapper
 
-# Audio processing function
-@gpu_decorator
-def basic_tts(
-    ref_audio_input,
-    ref_text_input,
-    gen_text_input,
-    remove_silence,
-    cross_fade_duration_slider,
-    nfe_slider,
-    speed_slider
-):
-    if not ref_audio_input:
-        gr.Warning("请提供参考音频。")
-        return gr.update(), gr.update(), ref_text_input
+# 没有GPU的节点在CPU上运行整条流水线
+DEVICE = resolve_device()
 
-    if not gen_text_input.strip():
-        gr.Warning("请输入要生成的文本。")
-        return gr.update(), gr.update(), ref_text_input
-    
+# 各步骤预计占用的显存（CPU上为内存），调度器据此做准入控制
+TTS_MEMORY = 2 << 30
+FACE_PREP_MEMORY = 1 << 30
+DIFFUSION_MEMORY = 6 << 30
+
+# 数值越小越先执行：纯音频任务交互性最强，不被长视频任务挡住
+TTS_PRIORITY = 0
+FACE_PREP_PRIORITY = 5
+VIDEO_PRIORITY = 10
+
+POLL_INTERVAL = 0.2
+
+# Prometheus抓取地址 http://<host>:METRICS_PORT/metrics，单个任务的报告在 /jobs/<job_id>
+METRICS_PORT = 9464
+
+# 多个视频任务同时做扩散推理，各自的chunk在共享UNet上合并成一个batch
+DIFFUSION_WORKERS = 4
+SCHEDULER_POOLS = {
+    "tts": 1,
+    "face_prep": 1,
+    "diffusion": DIFFUSION_WORKERS,
+}
+
+JOB_STATUS_TEXT = {
+    "pending": "等待前置任务",
+    "queued": "排队中",
+    "running": "运行中",
+    "cancelling": "取消中",
+    "done": "已完成",
+    "failed": "失败",
+    "cancelled": "已取消",
+}
+
+_worker_state = threading.local()
+
+
+def job_output_path(job, name, suffix):
+    """输出文件名带上任务id，同一秒内提交的多个任务不会写到同一个文件"""
+    submitted = datetime.fromtimestamp(job.submitted_at).strftime("%Y%m%d_%H%M%S")
+    output_dir = Path("output")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return str(output_dir / f"{name}_{submitted}_{job.id}{suffix}")
+
+
+# Audio processing stage
+@gpu_decorator
+def tts_stage(job, ref_audio, ref_text, gen_text, remove_silence, cross_fade_duration, nfe_step, speed):
+    print("开始生成音频...")
+    timer = StageTimer()
+    start_time = time.perf_counter()
+    reset_peak_memory(DEVICE)
+    stream = infer2_stream(
+        ref_audio,
+        ref_text,
+        gen_text,
+        "F5-TTS",
+        remove_silence,
+        cross_fade_duration=cross_fade_duration,
+        nfe_step=nfe_step,
+        speed=speed,
+        timer=timer,
+    )
     try:
-        print("开始生成音频...")
-        audio_out, spectrogram_path, ref_text_out = infer2(
-            ref_audio_input,
-            ref_text_input,
-            gen_text_input,
-            "F5-TTS",
-            remove_silence,
-            cross_fade_duration=cross_fade_duration_slider,
-            nfe_step=nfe_slider,
-            speed=speed_slider,
-            show_info=gr.Info,
-            progress=gr.Progress()
+        # 每段合成完就把(sample_rate, pcm)放入partial，由web层轮询推送到流式播放器
+        for chunk in stream:
+            job.partial.append(chunk)
+
+        # 完整音频写入文件，供视频生成使用
+        with timer("tts_save"):
+            audio_path = stream.save(job_output_path(job, "tts", ".wav"))
+        get_metrics_registry().observe(
+            "tts",
+            {
+                "job_id": job.id,
+                "audio_path": audio_path,
+                "audio_seconds": round(len(stream.wave) / stream.sample_rate, 3),
+                "seconds": round(time.perf_counter() - start_time, 4),
+                "stages": timer.as_dict(),
+                "peak_memory": peak_memory(DEVICE),
+            },
         )
         print("音频生成完成")
-        print(f"音频已保存至: {audio_out}")
-        return audio_out, ref_text_out
-    except Exception as e:
-        print(f"处理音频时出错: {str(e)}")
-        raise gr.Error(f"处理音频时出错: {str(e)}")
+        print(f"音频已保存至: {audio_path}")
+        return audio_path, stream.ref_text
     finally:
         torch.cuda.empty_cache()
 
-# Video processing function
+
+# Face preparation stage
+def face_prep_stage(job, video_path):
+    # 每个工作线程使用自己的ImageProcessor，不与推理中的流水线共享平滑状态
+    image_processor = getattr(_worker_state, "image_processor", None)
+    if image_processor is None:
+        config = OmegaConf.load(UNET_CONFIG_PATH)
+        mask_image_path = MASK_IMAGE_PATH.absolute().as_posix()
+        mask_image = load_fixed_mask(config.data.resolution, mask_image_path)
+        image_processor = create_image_processor(config.data.resolution, DEVICE, mask_image=mask_image)
+        _worker_state.image_processor = image_processor
+    return align_video_to_cache(image_processor, video_path)
+
+
+# Video processing stages
 @measure_time
-def process_video(
+def diffusion_stage(
+    job,
     video_path,
-    audio_path,
+    tts_job,
     guidance_scale,
     inference_steps,
-    seed
+    seed,
+    cfg_mode,
+    scheduler,
+    temporal_reuse,
 ):
-    output_dir = Path("output")
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    video_file_path = Path(video_path)
-    video_path = video_file_path.absolute().as_posix()
-    audio_path = Path(audio_path).absolute().as_posix()
-
-    prepared_video_path = video_file_path.with_stem(video_file_path.stem + "_prepared").absolute().as_posix()
-    loop_video(audio_path, video_path, prepared_video_path)
-
-    current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_path = str(output_dir / f"{video_file_path.stem}_{current_time}.mp4")
+    audio_path = tts_job.result[0]
 
     config = OmegaConf.load(UNET_CONFIG_PATH)
     config["run"].update(
@@ -98,33 +162,274 @@ def process_video(
         }
     )
 
-    args = create_args(prepared_video_path, audio_path, output_path, inference_steps, guidance_scale, seed)
+    # 视频比音频短时由流水线按正放、倒放交替循环源视频帧，不再预先生成循环视频文件
+    output_path = job_output_path(job, Path(video_path).stem, ".mp4")
+    args = create_args(
+        video_path,
+        audio_path,
+        output_path,
+        inference_steps,
+        guidance_scale,
+        seed,
+        cfg_mode,
+        scheduler,
+        temporal_reuse,
+    )
+    # 任务报告与调度器中的任务使用同一个id
+    args.profile_path = job_output_path(job, Path(video_path).stem, "_profile.json")
+    args.job_id = job.id
 
     try:
         print("开始处理视频...")
         inference_video_main(config=config, args=args)
         print("视频处理完成")
         return output_path
-    except Exception as e:
-        print(f"处理视频时出错: {str(e)}")
-        raise gr.Error(f"处理视频时出错: {str(e)}")
     finally:
         torch.cuda.empty_cache()
 
-def create_args(video_path, audio_path, output_path, inference_steps, guidance_scale, seed):
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--configs_path", type=str, required=True)
-    parser.add_argument("--inference_ckpt_path", type=str, required=True)
-    parser.add_argument("--video_path", type=str, required=True)
-    parser.add_argument("--audio_path", type=str, required=True)
-    parser.add_argument("--mask_image_path", type=str, required=True)
-    parser.add_argument("--video_out_path", type=str, required=True)
-    parser.add_argument("--inference_steps", type=int, default=20)
-    parser.add_argument("--guidance_scale", type=float, default=1.0)
-    parser.add_argument("--seed", type=int, default=1247)
-
-    return parser.parse_args(
+
+def collect_service_metrics():
+    """调度器队列、模型注册表和TTS引擎的即时状态，供/metrics导出"""
+    samples = []
+    scheduler_metrics = get_job_scheduler(SCHEDULER_POOLS).metrics()
+    for pool in SCHEDULER_POOLS:
+        stats = scheduler_metrics[pool]
+        for key in ("workers", "queue_depth", "running", "completed", "failed", "avg_wait_seconds",
+                    "max_wait_seconds", "oldest_wait_seconds", "run_seconds"):
+            samples.append((f"lipsync_scheduler_{key}", {"pool": pool}, stats[key]))
+    samples.append(("lipsync_scheduler_pending_jobs", {}, scheduler_metrics["pending_jobs"]))
+    for device, reserved in scheduler_metrics["reserved_bytes"].items():
+        samples.append(("lipsync_scheduler_reserved_bytes", {"device": device}, reserved))
+    registry_stats = get_registry().stats()
+    samples.append(("lipsync_models_resident", {}, registry_stats["resident"]))
+    samples.append(("lipsync_model_loads", {}, registry_stats["loads"]))
+    tts_stats = get_tts_engine().stats()
+    samples.append(("lipsync_tts_loaded", {}, int(tts_stats["loaded"])))
+    return samples
+
+
+def submit_tts_job(ref_audio, ref_text, gen_text, remove_silence, cross_fade_duration, nfe_step, speed):
+    return get_job_scheduler(SCHEDULER_POOLS).submit(
+        "音频合成",
         [
+            Stage(
+                "tts",
+                partial(
+                    tts_stage,
+                    ref_audio=ref_audio,
+                    ref_text=ref_text,
+                    gen_text=gen_text,
+                    remove_silence=remove_silence,
+                    cross_fade_duration=cross_fade_duration,
+                    nfe_step=nfe_step,
+                    speed=speed,
+                ),
+                memory=TTS_MEMORY,
+                device=DEVICE,
+            )
+        ],
+        priority=TTS_PRIORITY,
+    )
+
+
+def job_status_text(job):
+    status = JOB_STATUS_TEXT.get(job.status, job.status)
+    if job.status == "queued":
+        position = get_job_scheduler(SCHEDULER_POOLS).queue_position(job)
+        return f"{job.name}：{status}（{job.stage}，前面还有 {position} 个任务）"
+    if job.status == "running":
+        return f"{job.name}：{status}（{job.stage}）"
+    if job.status == "failed":
+        return f"{job.name}：{status}（{job.error}）"
+    return f"{job.name}：{status}"
+
+
+def scheduler_status_text():
+    metrics = get_job_scheduler(SCHEDULER_POOLS).metrics()
+    pools = [
+        f"{pool} 排队 {metrics[pool]['queue_depth']} / 运行 {metrics[pool]['running']} / 平均等待 {metrics[pool]['avg_wait_seconds']:.1f}s"
+        for pool in SCHEDULER_POOLS
+    ]
+    return "，".join(pools)
+
+
+def poll_jobs(jobs, tts_job):
+    """轮询直到最后一个任务结束，产出(新合成的音频块, 状态文本)"""
+    streamed = 0
+    while True:
+        finished = jobs[-1].finished
+        chunks = tts_job.partial[streamed:]
+        streamed += len(chunks)
+        status = [job_status_text(job) for job in jobs] + [scheduler_status_text()]
+        yield chunks, "\n\n".join(status)
+        if finished:
+            return
+        time.sleep(POLL_INTERVAL)
+
+
+def check_tts_inputs(ref_audio_input, gen_text_input):
+    if not ref_audio_input:
+        gr.Warning("请提供参考音频。")
+        return False
+    if not gen_text_input.strip():
+        gr.Warning("请输入要生成的文本。")
+        return False
+    return True
+
+
+def generate_audio(
+    ref_audio_input,
+    ref_text_input,
+    gen_text_input,
+    remove_silence,
+    cross_fade_duration_slider,
+    nfe_slider,
+    speed_slider
+):
+    if not check_tts_inputs(ref_audio_input, gen_text_input):
+        yield gr.update(), gr.update(), ref_text_input, gr.update()
+        return
+
+    tts_job = submit_tts_job(
+        ref_audio_input,
+        ref_text_input,
+        gen_text_input,
+        remove_silence,
+        cross_fade_duration_slider,
+        nfe_slider,
+        speed_slider,
+    )
+    try:
+        for chunks, status in poll_jobs([tts_job], tts_job):
+            for chunk in chunks:
+                yield chunk, gr.update(), gr.update(), status
+            if not chunks:
+                yield gr.update(), gr.update(), gr.update(), status
+        if tts_job.status != "done":
+            raise gr.Error(f"处理音频时出错: {tts_job.error}")
+        audio_path, ref_text = tts_job.result
+        yield gr.update(), audio_path, ref_text, job_status_text(tts_job)
+    finally:
+        # 页面断开时取消还未完成的任务
+        get_job_scheduler(SCHEDULER_POOLS).cancel(tts_job.id)
+
+
+def generate_video(
+    video_path,
+    ref_audio_input,
+    ref_text_input,
+    gen_text_input,
+    remove_silence,
+    cross_fade_duration_slider,
+    nfe_slider,
+    speed_slider,
+    guidance_scale,
+    inference_steps,
+    seed,
+    cfg_mode,
+    diffusion_scheduler,
+    temporal_reuse
+):
+    if not video_path:
+        gr.Warning("请提供输入视频。")
+        yield gr.update(), gr.update(), ref_text_input, gr.update(), gr.update()
+        return
+    if not check_tts_inputs(ref_audio_input, gen_text_input):
+        yield gr.update(), gr.update(), ref_text_input, gr.update(), gr.update()
+        return
+
+    video_path = Path(video_path).absolute().as_posix()
+
+    # 音频合成和人脸预处理互不依赖，同时排队；两者都完成后才开始扩散推理
+    scheduler = get_job_scheduler(SCHEDULER_POOLS)
+    tts_job = submit_tts_job(
+        ref_audio_input,
+        ref_text_input,
+        gen_text_input,
+        remove_silence,
+        cross_fade_duration_slider,
+        nfe_slider,
+        speed_slider,
+    )
+    prep_job = scheduler.submit(
+        "人脸预处理",
+        [
+            Stage(
+                "face_prep",
+                partial(face_prep_stage, video_path=video_path),
+                memory=FACE_PREP_MEMORY,
+                device=DEVICE,
+            )
+        ],
+        priority=FACE_PREP_PRIORITY,
+    )
+    video_job = scheduler.submit(
+        "视频生成",
+        [
+            Stage(
+                "diffusion",
+                partial(
+                    diffusion_stage,
+                    video_path=video_path,
+                    tts_job=tts_job,
+                    guidance_scale=guidance_scale,
+                    inference_steps=inference_steps,
+                    seed=seed,
+                    cfg_mode=cfg_mode,
+                    scheduler=diffusion_scheduler,
+                    temporal_reuse=temporal_reuse,
+                ),
+                memory=DIFFUSION_MEMORY,
+                device=DEVICE,
+            ),
+        ],
+        priority=VIDEO_PRIORITY,
+        depends_on=[tts_job, prep_job],
+    )
+    jobs = [tts_job, prep_job, video_job]
+
+    try:
+        audio_sent = False
+        for chunks, status in poll_jobs(jobs, tts_job):
+            for chunk in chunks:
+                yield chunk, gr.update(), gr.update(), gr.update(), status
+            if not audio_sent and tts_job.status == "done":
+                audio_sent = True
+                audio_path, ref_text = tts_job.result
+                yield gr.update(), audio_path, ref_text, gr.update(), status
+            elif not chunks:
+                yield gr.update(), gr.update(), gr.update(), gr.update(), status
+        for job in jobs:
+            if job.status == "failed":
+                raise gr.Error(f"{job.name}出错: {job.error}")
+        yield gr.update(), gr.update(), gr.update(), video_job.result, status
+    finally:
+        for job in jobs:
+            scheduler.cancel(job.id)
+
+
+def apply_preset(preset):
+    """选择档位时同步更新scheduler和推理步数，custom保持当前设置"""
+    if preset not in PRESETS:
+        return gr.update(), gr.update()
+    return gr.update(value=PRESETS[preset]["scheduler"]), gr.update(value=PRESETS[preset]["inference_steps"])
+
+
+def create_args(
+    video_path,
+    audio_path,
+    output_path,
+    inference_steps,
+    guidance_scale,
+    seed,
+    cfg_mode="full",
+    scheduler="ddim",
+    temporal_reuse=False,
+):
+    extra_args = ["--temporal_reuse"] if temporal_reuse else []
+    return build_parser().parse_args(
+        extra_args
+        + [
             "--configs_path", CONFIGS_PATH.absolute().as_posix(),
             "--inference_ckpt_path", CHECKPOINT_PATH.absolute().as_posix(),
             "--video_path", video_path,
@@ -134,6 +439,13 @@ def create_args(video_path, audio_path, output_path, inference_steps, guidance_s
             "--inference_steps", str(inference_steps),
             "--guidance_scale", str(guidance_scale),
             "--seed", str(seed),
+            "--cross_request_batching",
+            "--max_batch_size", str(DIFFUSION_WORKERS),
+            "--cfg_mode", cfg_mode,
+            "--scheduler", scheduler,
+            "--device", DEVICE,
+            # 索引写在文件开头，网页播放器可以边下边播
+            "--faststart",
         ]
     )
 
@@ -209,9 +521,21 @@ with gr.Blocks(title="AvatarX", fill_width=True, css=css, js=js) as app:
                     value=2.0,
                     step=0.5,
                 )
+                preset = gr.Dropdown(
+                    label="质量档位",
+                    info="draft：快速预览；standard：日常使用；high：最高质量。选择后自动设置下面的采样器和推理步数。",
+                    choices=["custom"] + list(PRESETS),
+                    value="custom",
+                )
+                diffusion_scheduler = gr.Dropdown(
+                    label="采样器",
+                    info="dpm++在较少步数下即可得到接近ddim多步的效果。",
+                    choices=list(SCHEDULERS),
+                    value="ddim",
+                )
                 inference_steps = gr.Slider(
                     label="推理步数",
-                    minimum=10,
+                    minimum=4,
                     maximum=50,
                     value=20,
                     step=1,
@@ -221,6 +545,17 @@ with gr.Blocks(title="AvatarX", fill_width=True, css=css, js=js) as app:
                     value=1247,
                     precision=0,
                 )
+                cfg_mode = gr.Dropdown(
+                    label="引导模式",
+                    info="full：每步都计算无条件分支；interval：只在前半程计算；cache：每隔几步计算一次并复用。后两者更快，口型可能略有差异。",
+                    choices=["full", "interval", "cache"],
+                    value="full",
+                )
+                temporal_reuse = gr.Checkbox(
+                    label="静音段复用",
+                    info="音频静音或几乎不变的片段从之前生成的结果开始，只做部分去噪，速度更快。",
+                    value=False,
+                )
 
         # Audio processing column
         with gr.Column():
@@ -261,44 +596,58 @@ with gr.Blocks(title="AvatarX", fill_width=True, css=css, js=js) as app:
                     step=0.01,
                 )
 
+            streaming_audio = gr.Audio(label="合成的音频", streaming=True, autoplay=True, interactive=False)
             generated_audio = gr.Audio(label="合成的音频", type="filepath", visible=False)
+            generate_audio_btn = gr.Button("生成音频")
 
         with gr.Column():
             video_output = gr.Video(label="输出视频", height="75vh")
             generate_Video_btn = gr.Button("生成视频", variant="primary")
+            job_status = gr.Markdown()
 
     # Configure queue
+    # 推理在调度器的工作池中执行，事件处理函数只负责提交任务和轮询状态，可以同时服务多个用户
     app.queue(
-        default_concurrency_limit=1,
-        max_size=10
+        default_concurrency_limit=16,
+        max_size=64
+    )
+
+    tts_inputs = [
+        ref_audio_input,
+        ref_text_input,
+        gen_text_input,
+        remove_silence,
+        cross_fade_duration_slider,
+        nfe_slider,
+        speed_slider,
+    ]
+
+    # Bind audio generation button
+    generate_audio_btn.click(
+        fn=generate_audio,
+        inputs=tts_inputs,
+        outputs=[streaming_audio, generated_audio, ref_text_input, job_status],
+        queue=True
+    )
+
+    preset.change(
+        fn=apply_preset,
+        inputs=[preset],
+        outputs=[diffusion_scheduler, inference_steps],
     )
 
     # Bind video generation button
     generate_Video_btn.click(
-        fn=basic_tts,
-        inputs=[
-            ref_audio_input,
-            ref_text_input,
-            gen_text_input,
-            remove_silence,
-            cross_fade_duration_slider,
-            nfe_slider,
-            speed_slider,
-        ],
-        outputs=[generated_audio, ref_text_input],
-        queue=True
-    ).success(
-        fn=process_video,
-        inputs=[
-            video_input,
-            generated_audio,
-            guidance_scale,
-            inference_steps,
-            seed,
-        ],
-        outputs=video_output,
+        fn=generate_video,
+        inputs=[video_input] + tts_inputs + [guidance_scale, inference_steps, seed, cfg_mode, diffusion_scheduler, temporal_reuse],
+        outputs=[streaming_audio, generated_audio, ref_text_input, video_output, job_status],
         queue=True
     )
 
 if __name__ == "__main__":
+    # 启动时预加载TTS模型，避免第一个任务承担加载耗时
+    get_tts_engine().warmup()
+    get_job_scheduler(SCHEDULER_POOLS)
+    get_metrics_registry().register_collector("service", collect_service_metrics)
+    start_metrics_server(METRICS_PORT)
     app.launch(inbrowser=True, share=True)
\ No newline at end of file
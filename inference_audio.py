@@ -1,19 +1,20 @@
 # ruff: noqa: E402
 # Above allows ruff to ignore E402: module level import not at top of file
 
+import gc
 import json
-from pathlib import Path
+import random
 import re
-import shutil
 import tempfile
+import threading
+import time
 
 import librosa
 import numpy as np
 import soundfile as sf
 import torch
-import torchaudio
 from cached_path import cached_path
-from pydub import AudioSegment
+from pydub import AudioSegment, silence
 import tqdm
 
 try:
@@ -32,17 +33,25 @@ def gpu_decorator(func):
 
 
 from f5_tts.model import DiT, UNetT
+from f5_tts.model.utils import convert_char_to_pinyin
 from f5_tts.infer.utils_infer import (
     load_vocoder,
     load_model,
-    preprocess_ref_audio_text,
     infer_process,
-    remove_silence_for_generated_wav,
     save_spectrogram,
+    chunk_text,
+    target_sample_rate,
+    hop_length,
+    target_rms,
+    cfg_strength,
+    sway_sampling_coef,
+    mel_spec_type,
 )
 
 
 from numbers_converter import convert_numbers_to_chinese
+from pipeline_stages import StageTimer
+from ref_audio_cache import PreparedRefAudio, get_ref_audio_cache
 
 
 DEFAULT_TTS_MODEL = "F5-TTS_v1"
@@ -61,6 +70,68 @@ def load_f5tts():
     F5TTS_model_cfg = json.loads(DEFAULT_TTS_MODEL_CFG[2])
     return load_model(DiT, F5TTS_model_cfg, ckpt_path)
 
+
+class TTSEngine:
+    """进程内常驻的F5-TTS模型和声码器，所有infer/infer2调用共用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ema_model = None
+        self.vocoder = None
+        self.load_seconds = 0.0
+        self.loads = 0
+        self.hits = 0
+
+    @property
+    def is_loaded(self):
+        return self.ema_model is not None and self.vocoder is not None
+
+    def get(self):
+        """返回(ema_model, vocoder)，首次调用时加载"""
+        with self._lock:
+            if self.is_loaded:
+                self.hits += 1
+            else:
+                start_time = time.time()
+                self.vocoder = load_vocoder()
+                self.ema_model = load_f5tts()
+                self.load_seconds = time.time() - start_time
+                self.loads += 1
+                print(f"Loaded F5-TTS in {self.load_seconds:.2f}s")
+            return self.ema_model, self.vocoder
+
+    @torch.no_grad()
+    def warmup(self, nfe_step=2):
+        """加载模型并用静音输入跑一次采样和声码器解码"""
+        ema_model, vocoder = self.get()
+        device = next(ema_model.parameters()).device
+        cond = torch.zeros(1, 64, ema_model.num_channels, device=device)
+        generated, _ = ema_model.sample(cond=cond, text=["warmup"], duration=128, steps=nfe_step)
+        vocoder.decode(generated[:, 64:, :].to(torch.float32).permute(0, 2, 1))
+
+    def unload(self):
+        with self._lock:
+            self.ema_model = None
+            self.vocoder = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self):
+        return {
+            "loaded": self.is_loaded,
+            "loads": self.loads,
+            "hits": self.hits,
+            "load_seconds": round(self.load_seconds, 3),
+        }
+
+
+_tts_engine = TTSEngine()
+
+
+def get_tts_engine():
+    return _tts_engine
+
 # 文本分段函数
 def split_text(text, max_len=150):
     pattern = r'([。！？.!?])'
@@ -91,13 +162,179 @@ def split_text(text, max_len=150):
     
     return segments
 
-# 合并音频函数
-def merge_audio_with_crossfade(audio_files, crossfade_ms=50):
-    merged = AudioSegment.from_wav(audio_files[0])
-    for audio_file in audio_files[1:]:
-        next_audio = AudioSegment.from_wav(audio_file)
-        merged = merged.append(next_audio, crossfade=crossfade_ms)
-    return merged
+# 与infer_batch_process相同的线性交叉淡化拼接
+def cross_fade_waves(waves, cross_fade_duration, sample_rate=target_sample_rate):
+    if cross_fade_duration <= 0:
+        return np.concatenate(waves)
+    final_wave = waves[0]
+    for next_wave in waves[1:]:
+        cross_fade_samples = int(cross_fade_duration * sample_rate)
+        cross_fade_samples = min(cross_fade_samples, len(final_wave), len(next_wave))
+        if cross_fade_samples <= 0:
+            final_wave = np.concatenate([final_wave, next_wave])
+            continue
+        fade_out = np.linspace(1, 0, cross_fade_samples)
+        fade_in = np.linspace(0, 1, cross_fade_samples)
+        cross_faded_overlap = final_wave[-cross_fade_samples:] * fade_out + next_wave[:cross_fade_samples] * fade_in
+        final_wave = np.concatenate(
+            [final_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
+        )
+    return final_wave
+
+# CFM.sample的max_duration默认值，生成的mel帧数不超过它
+TTS_MAX_DURATION = 65536
+
+
+# 把分段文本再按参考音频长度切成模型可处理的小块，并估算每块的mel帧数
+def plan_tts_chunks(segments, ref_audio_len, ref_audio_duration, ref_text, speed, max_duration=TTS_MAX_DURATION):
+    max_chars = int(len(ref_text.encode("utf-8")) / ref_audio_duration * (22 - ref_audio_duration) * speed)
+    ref_text_len = len(ref_text.encode("utf-8"))
+    chunks = []
+    for segment_index, segment in enumerate(segments):
+        for text in chunk_text(segment, max_chars=max_chars):
+            local_speed = 0.3 if len(text.encode("utf-8")) < 10 else speed
+            gen_text_len = len(text.encode("utf-8"))
+            duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / local_speed)
+            text_list = convert_char_to_pinyin([ref_text + text])[0]
+            # 与CFM.sample内部对时长的修正保持一致：至少比文本和参考音频多一帧，且不超过max_duration
+            duration = min(max(max(len(text_list), ref_audio_len) + 1, duration), max_duration)
+            chunks.append({"segment": segment_index, "text": text_list, "duration": duration})
+    return chunks
+
+# 按时长排序后分组，相近长度的块放在同一批里以减少padding
+def group_tts_chunks(chunks, batch_size, max_batch_frames):
+    order = sorted(range(len(chunks)), key=lambda i: chunks[i]["duration"])
+    batches = []
+    current = []
+    for index in order:
+        candidate = current + [index]
+        batch_frames = len(candidate) * chunks[index]["duration"]
+        if current and (len(candidate) > batch_size or batch_frames > max_batch_frames):
+            batches.append(current)
+            candidate = [index]
+        current = candidate
+    if current:
+        batches.append(current)
+    return batches
+
+def resolve_tts_seed(seed):
+    """未指定seed时随机选一个，同一任务的所有批次都使用它，保证批量合成与逐段合成的初始噪声相同"""
+    if seed is None or seed < 0:
+        seed = random.randint(0, 2**31 - 1)
+    return seed
+
+def synthesize_segments(
+    ref_audio,
+    ref_text,
+    segments,
+    ema_model,
+    vocoder,
+    cross_fade_duration=0.15,
+    nfe_step=32,
+    speed=1,
+    batch_size=4,
+    max_batch_frames=8192,
+    seed=None,
+    progress=tqdm,
+    timer=None,
+):
+    """批量合成多个文本段：长度相近的段一起做一次DiT采样，返回每段的波形、频谱和吞吐统计
+
+    ref_audio可以是预处理后的音频路径或PreparedRefAudio（带缓存的mel特征）。
+    batch_size=1时即逐段合成。固定seed时每段的初始噪声与逐段合成相同，但批内的padding改变了计算顺序，
+    结果只在数值误差范围内一致，不是逐位相同（见tests/test_tts_batching.py）。seed为None时每批从全局随机状态取噪声，
+    批量与逐段的结果不再对应，调用方应先用resolve_tts_seed固定。
+    timer为StageTimer时分别统计DiT采样（tts_sample）和声码器（tts_vocoder）的耗时。
+    """
+    if timer is None:
+        timer = StageTimer()
+    start_time = time.time()
+    device = next(ema_model.parameters()).device
+    if not isinstance(ref_audio, PreparedRefAudio):
+        ref_audio = PreparedRefAudio.from_file(ref_audio, ref_text)
+    audio = ref_audio.audio.to(device)
+    rms = ref_audio.rms
+    # 有缓存的mel特征时直接作为条件输入，跳过模型内的mel计算
+    cond = ref_audio.mel.to(device) if ref_audio.mel is not None else audio
+    if len(ref_text[-1].encode("utf-8")) == 1:
+        ref_text = ref_text + " "
+
+    ref_audio_len = audio.shape[-1] // hop_length
+    chunks = plan_tts_chunks(segments, ref_audio_len, ref_audio.duration, ref_text, speed)
+    batches = group_tts_chunks(chunks, max(1, batch_size), max_batch_frames)
+
+    chunk_waves = [None] * len(chunks)
+    chunk_mels = [None] * len(chunks)
+    for batch in progress.tqdm(batches):
+        durations = [chunks[i]["duration"] for i in batch]
+        with torch.inference_mode():
+            with timer("tts_sample", len(batch)):
+                generated, _ = ema_model.sample(
+                    cond=cond.repeat(len(batch), *([1] * (cond.ndim - 1))),
+                    text=[chunks[i]["text"] for i in batch],
+                    duration=torch.tensor(durations, device=device, dtype=torch.long),
+                    steps=nfe_step,
+                    cfg_strength=cfg_strength,
+                    sway_sampling_coef=sway_sampling_coef,
+                    seed=seed,
+                    max_duration=TTS_MAX_DURATION,
+                )
+                del _
+                generated = generated.to(torch.float32)
+            # 声码器逐条解码，避免padding影响波形边缘
+            with timer("tts_vocoder", len(batch)):
+                for row, (index, duration) in enumerate(zip(batch, durations)):
+                    mel = generated[row : row + 1, ref_audio_len:duration, :].permute(0, 2, 1)
+                    if mel_spec_type == "vocos":
+                        wave = vocoder.decode(mel)
+                    else:
+                        wave = vocoder(mel)
+                    if rms < target_rms:
+                        wave = wave * rms / target_rms
+                    chunk_waves[index] = wave.squeeze().cpu().numpy()
+                    chunk_mels[index] = mel[0].cpu().numpy()
+
+    waves = []
+    spectrograms = []
+    for segment_index in range(len(segments)):
+        indices = [i for i, chunk in enumerate(chunks) if chunk["segment"] == segment_index]
+        waves.append(cross_fade_waves([chunk_waves[i] for i in indices], cross_fade_duration))
+        spectrograms.append(np.concatenate([chunk_mels[i] for i in indices], axis=1))
+
+    elapsed = time.time() - start_time
+    audio_seconds = sum(len(wave) for wave in waves) / target_sample_rate
+    stats = {
+        "segments": len(segments),
+        "chunks": len(chunks),
+        "batches": len(batches),
+        "seconds": elapsed,
+        "audio_seconds": audio_seconds,
+        "segments_per_second": len(segments) / elapsed if elapsed > 0 else 0.0,
+        "audio_seconds_per_second": audio_seconds / elapsed if elapsed > 0 else 0.0,
+    }
+    print(
+        f"TTS合成 {stats['segments']} 段 / {stats['batches']} 批: "
+        f"{stats['segments_per_second']:.2f} 段/秒, {stats['audio_seconds_per_second']:.2f} 音频秒/秒"
+    )
+    return waves, target_sample_rate, spectrograms, stats
+
+# 在内存中合并各段音频：交叉淡化拼接后做峰值归一化
+def merge_waves(waves, sample_rate, crossfade_ms=50):
+    merged = cross_fade_waves(waves, crossfade_ms / 1000, sample_rate)
+    return librosa.util.normalize(merged.astype(np.float32))
+
+# 与remove_silence_for_generated_wav相同的静音切除参数，但直接处理内存中的波形
+def remove_silence_from_wave(wave, sample_rate):
+    pcm = (np.clip(wave, -1.0, 1.0) * 32767).astype(np.int16)
+    aseg = AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=sample_rate, channels=1)
+    non_silent_segs = silence.split_on_silence(
+        aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
+    )
+    non_silent_wave = AudioSegment.silent(duration=0, frame_rate=sample_rate)
+    for non_silent_seg in non_silent_segs:
+        non_silent_wave += non_silent_seg
+    samples = np.array(non_silent_wave.get_array_of_samples(), dtype=np.float32)
+    return samples / 32768.0
 
 @gpu_decorator
 def infer(
@@ -112,10 +349,10 @@ def infer(
     show_info=print,
     progress=tqdm
 ):
-    ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+    ema_model, vocoder = get_tts_engine().get()
+    prepared = get_ref_audio_cache().get(ref_audio_orig, ref_text, show_info=show_info)
+    ref_audio, ref_text = prepared.path, prepared.text
 
-    vocoder = load_vocoder()
-    ema_model = load_f5tts()
     final_wave, final_sample_rate, combined_spectrogram = infer_process(
         ref_audio,
         ref_text,
@@ -131,11 +368,7 @@ def infer(
 
     # Remove silence
     if remove_silence:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            sf.write(f.name, final_wave, final_sample_rate)
-            remove_silence_for_generated_wav(f.name)
-            final_wave, _ = torchaudio.load(f.name)
-        final_wave = final_wave.squeeze().cpu().numpy()
+        final_wave = remove_silence_from_wave(final_wave, final_sample_rate)
 
     # Save the spectrogram
     with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_spectrogram:
@@ -155,79 +388,213 @@ def infer2(
     nfe_step=32,
     speed=1,
     show_info=print,
-    progress=tqdm
+    progress=tqdm,
+    batch_size=4,
+    seed=None,
+    save_spectrogram_image=True,
+    timer=None,
 ):
-    # Create the temp directory if it doesn't exist
-    output_dir = Path("output")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    temp_dir = Path(output_dir, "temp")
-    temp_dir.mkdir(parents=True, exist_ok=True)
+    if timer is None:
+        timer = StageTimer()
+    ema_model, vocoder = get_tts_engine().get()
+    seed = resolve_tts_seed(seed)
+    print(f"TTS seed: {seed}")
+
+    # 同一参考音频的裁剪、转录和mel特征走磁盘缓存
+    with timer("tts_ref_audio"):
+        ref_audio = get_ref_audio_cache().get(
+            ref_audio_orig, ref_text, mel_spec=ema_model.mel_spec, show_info=show_info
+        )
+    ref_text = ref_audio.text
+
+    with timer("tts_text"):
+        # 数字转换预处理
+        gen_text = convert_numbers_to_chinese(gen_text)
+
+        # 分段
+        segments = split_text(gen_text)
+
+    # 生成音频片段，长度相近的段批量合成
+    waves, sampling_rate, spectrograms, _ = synthesize_segments(
+        ref_audio,
+        ref_text,
+        segments,
+        ema_model,
+        vocoder,
+        cross_fade_duration=cross_fade_duration,
+        nfe_step=nfe_step,
+        speed=speed,
+        batch_size=batch_size,
+        seed=seed,
+        progress=progress,
+        timer=timer,
+    )
 
-    ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+    with timer("tts_merge"):
+        # 合并音频并做音量归一化，全程在内存中完成
+        final_wave = merge_waves(waves, sampling_rate)
+        final_sample_rate = sampling_rate
+        combined_spectrogram = np.concatenate(spectrograms, axis=1)
+        # Remove silence
+        if remove_silence:
+            final_wave = remove_silence_from_wave(final_wave, final_sample_rate)
 
-    # 数字转换预处理
-    gen_text = convert_numbers_to_chinese(gen_text)
+    # Save the spectrogram
+    spectrogram_path = None
+    if save_spectrogram_image:
+        with timer("tts_spectrogram"), tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_spectrogram:
+            spectrogram_path = tmp_spectrogram.name
+            save_spectrogram(combined_spectrogram, spectrogram_path)
 
-    vocoder = load_vocoder()
-    ema_model = load_f5tts()
+    return (final_sample_rate, final_wave), spectrogram_path, ref_text
 
-    # 分段
-    segments = split_text(gen_text)
 
-    # 生成音频片段
-    audio_files = []
-    spectrograms = []
-    for i, text_segment in enumerate(segments):
-        print(f"生成第 {i+1} 段音频")
-        with torch.no_grad():
-            wave, sampling_rate, spectrogram = infer_process(
-                ref_audio,
-                ref_text,
-                text_segment,
-                ema_model,
-                vocoder,
-                cross_fade_duration=cross_fade_duration,
-                nfe_step=nfe_step,
-                speed=speed,
-                show_info=show_info,
-                progress=progress,
-            )
-        temp_file = Path(temp_dir, f"temp_{i}.wav").absolute().as_posix()
-        sf.write(temp_file, wave, sampling_rate)
-        audio_files.append(temp_file)
-        spectrograms.append(spectrogram)
-
-    # 合并音频
-    merged_audio_path = Path(temp_dir, "output_long_crossfade.wav").absolute().as_posix()
-    merged_audio = merge_audio_with_crossfade(audio_files)
-    merged_audio.export(merged_audio_path, format="wav")
-
-    # 音量归一化
-    final_audio, _ = librosa.load(merged_audio_path, sr=sampling_rate)
-    final_audio = librosa.util.normalize(final_audio)
-    # final_audio_path = Path(temp_dir, "output_long_final.wav").absolute().as_posix()
-    # sf.write(final_audio_path, final_audio, sampling_rate)
-    try:
-        shutil.rmtree(temp_dir)
-    except FileNotFoundError:
-        print(f"{temp_dir} is not found.")
-    except PermissionError:
-        print("权限不足，无法删除文件夹。")
-
-    final_wave = final_audio
-    final_sample_rate = sampling_rate
-    combined_spectrogram = np.concatenate(spectrograms, axis=1)
-    # Remove silence
-    if remove_silence:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            sf.write(f.name, final_wave, final_sample_rate)
-            remove_silence_for_generated_wav(f.name)
-            final_wave, _ = torchaudio.load(f.name)
-        final_wave = final_wave.squeeze().cpu().numpy()
+class TTSStream:
+    """infer2_stream的输出：逐段产出交叉淡化后的PCM块，同时累积完整音频供视频阶段使用
+
+    流式输出时还不知道全局峰值，实时播放的块只乘固定增益live_gain并截断到[-1, 1]；
+    wave/save得到的完整音频与infer2相同：拼接后按全局峰值归一化，再按需切除静音。
+    """
+
+    def __init__(self, generator, sample_rate, ref_text, remove_silence=False, live_gain=1.0):
+        self._generator = generator
+        self.sample_rate = sample_rate
+        self.ref_text = ref_text
+        self.remove_silence = remove_silence
+        self.live_gain = live_gain
+        # 未归一化的原始波形块
+        self.chunks = []
+        self.finished = False
+        self._wave = None
+
+    def __iter__(self):
+        for chunk in self._generator:
+            self.chunks.append(chunk)
+            yield self.sample_rate, np.clip(chunk * self.live_gain, -1.0, 1.0).astype(np.float32)
+        self.finished = True
+
+    @property
+    def wave(self):
+        """完整音频，会等待剩余片段生成完毕"""
+        if not self.finished:
+            for _ in self:
+                pass
+        if self._wave is None:
+            if not self.chunks:
+                return np.zeros(0, dtype=np.float32)
+            # 各块已经交叉淡化过，直接拼接即等于merge_waves的结果
+            wave = librosa.util.normalize(np.concatenate(self.chunks).astype(np.float32))
+            if self.remove_silence:
+                wave = remove_silence_from_wave(wave, self.sample_rate)
+            self._wave = wave
+        return self._wave
+
+    def save(self, path):
+        """等待剩余片段生成完毕，把完整音频写入path"""
+        sf.write(path, self.wave, self.sample_rate)
+        return path
+
+
+def _stream_segments(
+    ref_audio,
+    ref_text,
+    segments,
+    ema_model,
+    vocoder,
+    cross_fade_duration,
+    nfe_step,
+    speed,
+    batch_size,
+    seed,
+    crossfade_ms=50,
+    progress=tqdm,
+    timer=None,
+):
+    """逐段产出未归一化的波形块，相邻段之间与merge_waves一样做crossfade_ms的交叉淡化"""
+    sample_rate = target_sample_rate
+    crossfade_samples = int(sample_rate * crossfade_ms / 1000)
+    # 第一段单独合成以尽快出声，后面的段按batch_size成组批量合成
+    groups = [segments[:1]] + [segments[i : i + batch_size] for i in range(1, len(segments), batch_size)]
+    pending = None
+    for group in groups:
+        if not group:
+            continue
+        waves, _, _, _ = synthesize_segments(
+            ref_audio,
+            ref_text,
+            group,
+            ema_model,
+            vocoder,
+            cross_fade_duration=cross_fade_duration,
+            nfe_step=nfe_step,
+            speed=speed,
+            batch_size=batch_size,
+            seed=seed,
+            progress=progress,
+            timer=timer,
+        )
+        for wave in waves:
+            if pending is not None:
+                wave = cross_fade_waves([pending, wave], crossfade_ms / 1000, sample_rate)
+            # 保留末尾一段与下一段做交叉淡化，其余部分立即输出
+            split = max(len(wave) - crossfade_samples, 0)
+            out, pending = wave[:split], wave[split:]
+            if len(out) > 0:
+                yield out
+    if pending is not None and len(pending) > 0:
+        yield pending
 
-    # Save the spectrogram
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_spectrogram:
-        spectrogram_path = tmp_spectrogram.name
-        save_spectrogram(combined_spectrogram, spectrogram_path)
 
-    return (final_sample_rate, final_wave), spectrogram_path, ref_text
+@gpu_decorator
+def infer2_stream(
+    ref_audio_orig,
+    ref_text,
+    gen_text,
+    model,
+    remove_silence,
+    cross_fade_duration=0.15,
+    nfe_step=32,
+    speed=1,
+    show_info=print,
+    progress=tqdm,
+    batch_size=4,
+    seed=None,
+    timer=None,
+):
+    """infer2的流式版本：每个split_text分段合成完就产出对应的音频块
+
+    返回TTSStream，迭代得到(sample_rate, pcm)；参考文本在返回前就已确定。
+    静音切除作用在合并后的完整音频上（与infer2相同），实时播放的块不做切除。
+    timer为StageTimer时统计参考音频、文本处理以及每批合成的耗时。
+    合成发生在迭代时，在Spaces上应在同样带gpu_decorator的函数里迭代（如gradio_app.tts_stage）。
+    """
+    if timer is None:
+        timer = StageTimer()
+    ema_model, vocoder = get_tts_engine().get()
+    seed = resolve_tts_seed(seed)
+    print(f"TTS seed: {seed}")
+    with timer("tts_ref_audio"):
+        ref_audio = get_ref_audio_cache().get(
+            ref_audio_orig, ref_text, mel_spec=ema_model.mel_spec, show_info=show_info
+        )
+    ref_text = ref_audio.text
+
+    with timer("tts_text"):
+        gen_text = convert_numbers_to_chinese(gen_text)
+        segments = split_text(gen_text)
+
+    generator = _stream_segments(
+        ref_audio,
+        ref_text,
+        segments,
+        ema_model,
+        vocoder,
+        cross_fade_duration,
+        nfe_step,
+        speed,
+        max(1, batch_size),
+        seed,
+        progress=progress,
+        timer=timer,
+    )
+    return TTSStream(generator, target_sample_rate, ref_text, remove_silence=remove_silence)
@@ -18,27 +18,100 @@ from pathlib import Path
 from omegaconf import OmegaConf
 import torch
 from diffusers import AutoencoderKL, DDIMScheduler
-from accelerate.utils import set_seed
 from latentsync.models.unet import UNet3DConditionModel
 from latentsync.whisper.audio2feature import Audio2Feature
 
-from lipsync_pipeline_optimized import LipsyncPipelineOptimized
-
-
-def main(config, args):
-    if not os.path.exists(args.video_path):
-        raise RuntimeError(f"Video path '{args.video_path}' not found")
-    if not os.path.exists(args.audio_path):
-        raise RuntimeError(f"Audio path '{args.audio_path}' not found")
-
-    # Check if the GPU supports float16
-    is_fp16_supported = torch.cuda.is_available() and torch.cuda.get_device_capability()[0] > 7
-    dtype = torch.float16 if is_fp16_supported else torch.float32
-
-    print(f"Input video path: {args.video_path}")
-    print(f"Input audio path: {args.audio_path}")
-    print(f"Loaded checkpoint path: {args.inference_ckpt_path}")
-
+from device_utils import (
+    PRECISIONS,
+    configure_cpu_threads,
+    make_generator,
+    resolve_device,
+    select_dtype,
+    to_channels_last,
+)
+from lipsync_pipeline_optimized import SCHEDULERS, LipsyncPipelineOptimized
+from model_registry import get_registry
+
+SUBMODULES_PATH = Path("submodules")
+CONFIGS_PATH = Path(SUBMODULES_PATH, "LatentSync/configs")
+UNET_CONFIG_PATH = Path(CONFIGS_PATH, "unet/stage2.yaml")
+CHECKPOINT_PATH = Path("checkpoints/latentsync_unet.pt")
+MASK_IMAGE_PATH = Path(SUBMODULES_PATH, "LatentSync/latentsync/utils/mask.png")
+
+# 速度/质量档位：draft用于预览，standard为默认交付质量，high与原始DDIM多步结果一致
+PRESETS = {
+    "draft": {"scheduler": "dpm++", "inference_steps": 8},
+    "standard": {"scheduler": "dpm++", "inference_steps": 15},
+    "high": {"scheduler": "ddim", "inference_steps": 30},
+}
+# 未指定档位且命令行未给出时使用的值；解析器里这两个参数默认为None，以区分是否显式指定
+PRESET_DEFAULTS = {"scheduler": "ddim", "inference_steps": 20}
+
+
+def apply_preset(args):
+    """按preset设置args中未显式指定的scheduler和inference_steps，其余仍为None的参数填入PRESET_DEFAULTS"""
+    preset = PRESETS.get(getattr(args, "preset", None), {})
+    for name, default in PRESET_DEFAULTS.items():
+        current = getattr(args, name)
+        value = preset.get(name, default)
+        if current is None:
+            setattr(args, name, value)
+        elif name in preset and current != value:
+            print(f"Preset {args.preset}: keeping --{name} {current} instead of {value}")
+    return args
+
+
+def build_parser(video_out_required=True):
+    """命令行参数；gradio_app和benchmarks等调用方也用它构造args，保证参数和默认值只有一份。
+    benchmarks自己决定输出路径，传video_out_required=False"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--configs_path", type=str, default=CONFIGS_PATH.absolute().as_posix())
+    parser.add_argument("--unet_config_path", type=str, default=UNET_CONFIG_PATH.absolute().as_posix())
+    parser.add_argument("--inference_ckpt_path", type=str, default=CHECKPOINT_PATH.absolute().as_posix())
+    parser.add_argument("--video_path", type=str, required=True)
+    parser.add_argument("--audio_path", type=str, required=True)
+    parser.add_argument("--mask_image_path", type=str, default=MASK_IMAGE_PATH.absolute().as_posix())
+    parser.add_argument("--video_out_path", type=str, required=video_out_required)
+    parser.add_argument("--inference_steps", type=int, default=None)
+    parser.add_argument("--guidance_scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--video_codec", type=str, default="libx264")
+    parser.add_argument("--video_preset", type=str, default="medium")
+    parser.add_argument(
+        "--video_crf", type=int, default=18, help="恒定质量值，按编码器换成对应参数（nvenc为-cq，qsv为-global_quality）"
+    )
+    parser.add_argument("--encoder_threads", type=int, default=0)
+    parser.add_argument("--faststart", action="store_true", help="mp4索引写在文件开头，便于网页边下边播")
+    parser.add_argument("--cross_request_batching", action="store_true")
+    parser.add_argument("--max_batch_size", type=int, default=4)
+    parser.add_argument("--cfg_mode", type=str, default="full", choices=["full", "interval", "cache"])
+    parser.add_argument("--cfg_interval", type=float, nargs=2, default=[0.0, 0.5])
+    parser.add_argument("--cfg_refresh", type=int, default=3)
+    parser.add_argument("--scheduler", type=str, default=None, choices=list(SCHEDULERS))
+    parser.add_argument("--preset", type=str, default=None, choices=list(PRESETS))
+    parser.add_argument("--temporal_reuse", action="store_true")
+    parser.add_argument("--reuse_strength", type=float, default=0.4)
+    parser.add_argument("--silence_threshold_db", type=float, default=-40.0)
+    parser.add_argument("--duplicate_threshold", type=float, default=0.05)
+    parser.add_argument(
+        "--streaming_audio",
+        action="store_true",
+        help="按重叠窗口增量计算whisper特征，30秒之后的口型与默认的整段计算略有差异",
+    )
+    parser.add_argument("--device", type=str, default="auto")
+    parser.add_argument("--precision", type=str, default="auto", choices=list(PRECISIONS))
+    parser.add_argument("--num_threads", type=int, default=0)
+    parser.add_argument("--no_channels_last", dest="channels_last", action="store_false")
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--job_id", type=str, default=None)
+    parser.add_argument("--auto_chunk", action="store_true")
+    parser.add_argument("--max_chunks_per_batch", type=int, default=4)
+    parser.add_argument("--memory_fraction", type=float, default=0.9)
+    return parser
+
+
+def load_pipeline(config, args, dtype, device):
     scheduler = DDIMScheduler.from_pretrained(args.configs_path)
 
     if config.model.cross_attention_dim == 768:
@@ -53,7 +126,7 @@ def main(config, args):
     
     audio_encoder = Audio2Feature(
         model_path=whisper_model_path,
-        device="cuda",
+        device=device,
         num_frames=config.data.num_frames,
         audio_feat_length=config.data.audio_feat_length,
     )
@@ -75,14 +148,51 @@ def main(config, args):
         audio_encoder=audio_encoder,
         denoising_unet=denoising_unet,
         scheduler=scheduler,
-    ).to("cuda")
+    ).to(device)
+
+    if torch.device(device).type == "cpu" and getattr(args, "channels_last", True):
+        to_channels_last(pipeline.vae, pipeline.denoising_unet)
 
-    if args.seed != -1:
-        set_seed(args.seed)
+    return pipeline
+
+
+def main(config, args):
+    if not os.path.exists(args.video_path):
+        raise RuntimeError(f"Video path '{args.video_path}' not found")
+    if not os.path.exists(args.audio_path):
+        raise RuntimeError(f"Audio path '{args.audio_path}' not found")
+
+    # 没有GPU时在CPU上运行，精度和线程数按CPU的能力选择
+    device = resolve_device(args.device)
+    dtype = select_dtype(device, args.precision)
+    if torch.device(device).type == "cpu":
+        num_threads = configure_cpu_threads(args.num_threads)
+        print(f"Running on CPU with {num_threads} threads")
+    print(f"Device: {device}, dtype: {dtype}")
+
+    print(f"Input video path: {args.video_path}")
+    print(f"Input audio path: {args.audio_path}")
+    print(f"Loaded checkpoint path: {args.inference_ckpt_path}")
+
+    # 模型常驻内存，只在第一次任务时加载
+    if args.cross_request_batching:
+        # 多个任务共用同一组模型，各自的chunk在batcher中合并做UNet前向
+        with get_registry().acquire_batched(
+            config, args, dtype, device, load_pipeline, max_batch_size=args.max_batch_size
+        ) as (pipeline, batcher):
+            run_pipeline(pipeline, config, args, dtype, batcher=batcher)
     else:
-        torch.seed()
+        with get_registry().acquire(config, args, dtype, device, load_pipeline) as pipeline:
+            run_pipeline(pipeline, config, args, dtype)
 
-    print(f"Initial seed: {torch.initial_seed()}")
+
+def run_pipeline(pipeline, config, args, dtype, batcher=None):
+    # 每个任务使用自己的生成器，并发任务（--cross_request_batching）不会互相打乱随机序列
+    generator = make_generator(pipeline._execution_device, args.seed)
+    print(f"Initial seed: {generator.initial_seed()}")
+
+    pipeline.set_scheduler(args.scheduler)
+    print(f"Scheduler: {args.scheduler}, inference steps: {args.inference_steps}")
 
     pipeline(
         video_path=args.video_path,
@@ -92,32 +202,36 @@ def main(config, args):
         num_frames=config.data.num_frames,
         num_inference_steps=args.inference_steps,
         guidance_scale=args.guidance_scale,
+        generator=generator,
         weight_dtype=dtype,
         width=config.data.resolution,
         height=config.data.resolution,
         mask_image_path=args.mask_image_path,
+        video_codec=args.video_codec,
+        video_preset=args.video_preset,
+        video_crf=args.video_crf,
+        encoder_threads=args.encoder_threads,
+        video_faststart=args.faststart,
+        batcher=batcher,
+        cfg_mode=args.cfg_mode,
+        cfg_interval=tuple(args.cfg_interval),
+        cfg_refresh=args.cfg_refresh,
+        temporal_reuse=args.temporal_reuse,
+        reuse_strength=args.reuse_strength,
+        silence_threshold_db=args.silence_threshold_db,
+        duplicate_threshold=args.duplicate_threshold,
+        streaming_audio=args.streaming_audio,
+        profile=args.profile,
+        profile_path=args.profile_path,
+        job_id=args.job_id,
+        auto_chunk=args.auto_chunk,
+        max_chunks_per_batch=args.max_chunks_per_batch,
+        memory_fraction=args.memory_fraction,
     )
 
 
 if __name__ == "__main__":
-    SUBMODULES_PATH = Path("submodules")
-    CONFIGS_PATH = Path(SUBMODULES_PATH, "LatentSync/configs")
-    UNET_CONFIG_PATH = Path(CONFIGS_PATH, "unet/stage2.yaml")
-    CHECKPOINT_PATH = Path("checkpoints/latentsync_unet.pt")
-    MASK_IMAGE_PATH = Path(SUBMODULES_PATH, "LatentSync/latentsync/utils/mask.png")
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--configs_path", type=str, default=CONFIGS_PATH.absolute().as_posix())
-    parser.add_argument("--unet_config_path", type=str, default=UNET_CONFIG_PATH.absolute().as_posix())
-    parser.add_argument("--inference_ckpt_path", type=str, default=CHECKPOINT_PATH.absolute().as_posix())
-    parser.add_argument("--video_path", type=str, required=True)
-    parser.add_argument("--audio_path", type=str, required=True)
-    parser.add_argument("--mask_image_path", type=str, default=MASK_IMAGE_PATH.absolute().as_posix())
-    parser.add_argument("--video_out_path", type=str, required=True)
-    parser.add_argument("--inference_steps", type=int, default=20)
-    parser.add_argument("--guidance_scale", type=float, default=1.0)
-    parser.add_argument("--seed", type=int, default=1247)
-    args = parser.parse_args()
+    args = apply_preset(build_parser().parse_args())
 
     config = OmegaConf.load(args.unet_config_path)
     config["run"].update(
@@ -0,0 +1,320 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, defaultdict
+
+import torch
+
+# 编码在扩散步骤中与推理流水线并行进行，没有单独的编码池
+DEFAULT_POOLS = {
+    "tts": 1,
+    "face_prep": 1,
+    "diffusion": 1,
+}
+
+
+def free_memory(device):
+    """设备当前可用内存（字节），无法获取时返回None"""
+    if str(device).startswith("cuda"):
+        if torch.cuda.is_available():
+            free, _ = torch.cuda.mem_get_info(torch.device(device))
+            return free
+        return None
+    try:
+        import psutil
+
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class Stage:
+    """任务中的一个步骤：在指定的工作池中执行fn(job)，memory为预计占用的device内存，用于准入控制"""
+
+    def __init__(self, pool, fn, memory=0, device="cuda"):
+        self.pool = pool
+        self.fn = fn
+        self.memory = memory
+        self.device = device
+
+
+class Job:
+    """一个按顺序执行若干Stage的任务，web层通过job_id轮询状态"""
+
+    def __init__(self, name, stages, priority=0, depends_on=()):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.stages = list(stages)
+        self.priority = priority
+        self.depends_on = list(depends_on)
+        # pending -> queued -> running -> (queued -> running ...) -> done / failed / cancelled
+        self.status = "pending"
+        self.stage_index = 0
+        self.result = None
+        self.error = None
+        # 流式产出的中间结果，例如逐段合成的音频
+        self.partial = []
+        self.submitted_at = time.time()
+        self.enqueued_at = None
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def stage(self):
+        if self.stage_index < len(self.stages):
+            return self.stages[self.stage_index].pool
+        return None
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "stage": self.stage,
+            "priority": self.priority,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    """按工作池分别排队执行任务的各个步骤
+
+    每个池有独立的优先级队列和工作线程（priority越小越先执行），一个任务的下一步骤在上一步骤完成后
+    进入对应的池排队，depends_on中的任务全部完成后才开始第一步。
+    步骤声明了memory时先做准入检查：设备可用内存扣除余量后不足时留在队列中等待；
+    该设备上没有正在运行的步骤时总是放行，避免估计偏大时永远无法执行。
+    可用内存已经反映了运行中步骤实际分配的部分，只再扣除预留中尚未分配的部分，
+    即预留总量减去设备从开始有步骤运行以来减少的可用内存。
+    """
+
+    def __init__(self, pools=None, memory_headroom=512 << 20, max_finished_jobs=200):
+        self.pools = dict(DEFAULT_POOLS if pools is None else pools)
+        self.memory_headroom = memory_headroom
+        self.max_finished_jobs = max_finished_jobs
+        self._cond = threading.Condition()
+        self._queues = {pool: [] for pool in self.pools}
+        self._sequence = itertools.count()
+        self._jobs = OrderedDict()
+        self._waiting = []
+        self._running = defaultdict(int)
+        self._reserved = defaultdict(int)
+        # 设备上第一个步骤开始运行时的可用内存，用来估计运行中的步骤已经分配了多少
+        self._baseline_free = {}
+        self._metrics = {
+            pool: {"completed": 0, "failed": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "run_seconds": 0.0}
+            for pool in self.pools
+        }
+        self._threads = []
+        for pool, num_workers in self.pools.items():
+            for i in range(num_workers):
+                thread = threading.Thread(target=self._worker, args=(pool,), name=f"{pool}-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, name, stages, priority=0, depends_on=()):
+        job = Job(name, stages, priority=priority, depends_on=depends_on)
+        for stage in job.stages:
+            if stage.pool not in self._queues:
+                raise ValueError(f"Unknown worker pool: {stage.pool}")
+        with self._cond:
+            self._jobs[job.id] = job
+            self._trim_finished()
+            self._advance(job)
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """取消还未开始执行当前步骤的任务；正在执行的步骤不会被中断，完成后不再继续"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            if job.status in ("pending", "queued"):
+                self._finish(job, "cancelled")
+            else:
+                job.status = "cancelling"
+            return True
+
+    def queue_position(self, job):
+        """任务在当前池中排在第几位（从0开始），不在排队时返回None"""
+        with self._cond:
+            if job.status != "queued":
+                return None
+            entries = sorted(self._queues[job.stage])
+            for position, (_, _, queued_job) in enumerate(entries):
+                if queued_job is job:
+                    return position
+            return None
+
+    def _trim_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
+
+    def _advance(self, job):
+        # 调用时需持有self._cond
+        if job.finished:
+            return
+        if job.stage_index >= len(job.stages):
+            self._finish(job, "done")
+            return
+        if job.stage_index == 0:
+            failed = [dep for dep in job.depends_on if dep.finished and dep.status != "done"]
+            if failed:
+                job.error = f"Dependency {failed[0].name} {failed[0].status}"
+                self._finish(job, "failed")
+                return
+            if not all(dep.finished for dep in job.depends_on):
+                job.status = "pending"
+                if job not in self._waiting:
+                    self._waiting.append(job)
+                return
+        job.status = "queued"
+        job.enqueued_at = time.time()
+        heapq.heappush(self._queues[job.stage], (job.priority, next(self._sequence), job))
+        self._cond.notify_all()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job._done.set()
+        # 依赖此任务的任务可能可以开始了
+        waiting, self._waiting = self._waiting, []
+        for dependent in waiting:
+            self._advance(dependent)
+        self._cond.notify_all()
+
+    def _admit(self, stage):
+        if stage.memory <= 0 or self._running[stage.device] == 0:
+            return True
+        free = free_memory(stage.device)
+        if free is None:
+            return True
+        return free - self._outstanding(stage.device, free) - self.memory_headroom >= stage.memory
+
+    def _outstanding(self, device, free):
+        """运行中的步骤预留了但还没有分配的内存"""
+        baseline = self._baseline_free.get(device)
+        allocated = max(baseline - free, 0) if baseline is not None else 0
+        return max(self._reserved[device] - allocated, 0)
+
+    def _next(self, pool):
+        # 调用时需持有self._cond；只检查队首任务，内存不够时不让低优先级任务插队
+        queue = self._queues[pool]
+        while True:
+            while queue and queue[0][2].finished:
+                heapq.heappop(queue)
+            if queue:
+                job = queue[0][2]
+                stage = job.stages[job.stage_index]
+                if self._admit(stage):
+                    heapq.heappop(queue)
+                    return job, stage
+            self._cond.wait(timeout=1.0)
+
+    def _worker(self, pool):
+        while True:
+            with self._cond:
+                job, stage = self._next(pool)
+                job.status = "running"
+                now = time.time()
+                if job.started_at is None:
+                    job.started_at = now
+                wait_seconds = now - job.enqueued_at
+                metrics = self._metrics[pool]
+                metrics["wait_seconds"] += wait_seconds
+                metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], wait_seconds)
+                if self._running[stage.device] == 0:
+                    self._baseline_free[stage.device] = free_memory(stage.device)
+                self._running[stage.device] += 1
+                self._reserved[stage.device] += stage.memory
+
+            start_time = time.perf_counter()
+            error = None
+            try:
+                job.result = stage.fn(job)
+            except Exception as e:
+                traceback.print_exc()
+                error = str(e) or type(e).__name__
+
+            with self._cond:
+                self._running[stage.device] -= 1
+                self._reserved[stage.device] -= stage.memory
+                metrics["run_seconds"] += time.perf_counter() - start_time
+                if error is not None:
+                    metrics["failed"] += 1
+                    job.error = error
+                    self._finish(job, "failed")
+                elif job.status == "cancelling":
+                    metrics["completed"] += 1
+                    self._finish(job, "cancelled")
+                else:
+                    metrics["completed"] += 1
+                    job.stage_index += 1
+                    self._advance(job)
+                self._cond.notify_all()
+
+    def metrics(self):
+        with self._cond:
+            result = {}
+            for pool, metrics in self._metrics.items():
+                started = metrics["completed"] + metrics["failed"] + self._count_running(pool)
+                queue = [entry[2] for entry in self._queues[pool] if not entry[2].finished]
+                now = time.time()
+                result[pool] = {
+                    "workers": self.pools[pool],
+                    "queue_depth": len(queue),
+                    "running": self._count_running(pool),
+                    "completed": metrics["completed"],
+                    "failed": metrics["failed"],
+                    "avg_wait_seconds": round(metrics["wait_seconds"] / started, 3) if started else 0.0,
+                    "max_wait_seconds": round(metrics["max_wait_seconds"], 3),
+                    "oldest_wait_seconds": round(max((now - job.enqueued_at for job in queue), default=0.0), 3),
+                    "run_seconds": round(metrics["run_seconds"], 3),
+                }
+            result["pending_jobs"] = len(self._waiting)
+            result["reserved_bytes"] = dict(self._reserved)
+            return result
+
+    def _count_running(self, pool):
+        return sum(1 for job in self._jobs.values() if job.status in ("running", "cancelling") and job.stage == pool)
+
+
+_job_scheduler = None
+_job_scheduler_lock = threading.Lock()
+
+
+def get_job_scheduler(pools=None):
+    """进程内共享的调度器，第一次使用时按pools创建工作线程；之后传入不同的pools不会生效"""
+    global _job_scheduler
+    with _job_scheduler_lock:
+        if _job_scheduler is None:
+            _job_scheduler = JobScheduler(pools=pools)
+        elif pools is not None and dict(pools) != _job_scheduler.pools:
+            print(f"Warning: job scheduler already running with pools {_job_scheduler.pools}, ignoring {pools}")
+        return _job_scheduler
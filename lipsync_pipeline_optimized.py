@@ -1,11 +1,11 @@
 # Adapted from https://github.com/guoyww/AnimateDiff/blob/main/animatediff/pipelines/pipeline_animation.py
 
+import copy
 import inspect
-import math
-import os
-import shutil
+import threading
+import time
+import uuid
 from typing import Callable, List, Optional, Union
-import subprocess
 
 import numpy as np
 import torch
@@ -15,6 +15,7 @@ from packaging import version
 
 from diffusers.configuration_utils import FrozenDict
 from diffusers.models import AutoencoderKL
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
 from diffusers.pipelines import DiffusionPipeline
 from diffusers.schedulers import (
     DDIMScheduler,
@@ -33,13 +34,78 @@ from latentsync.whisper import whisper
 
 from latentsync.models.unet import UNet3DConditionModel
 from latentsync.utils.util import check_ffmpeg_installed
-from latentsync.utils.image_processor import ImageProcessor, load_fixed_mask
+from latentsync.utils.image_processor import load_fixed_mask
 from latentsync.whisper.audio2feature import Audio2Feature
 import tqdm
-import soundfile as sf
+
+from audio_features import StreamingAudioFeatures, frame_loudness_db
+from avatar_prebake import get_avatar_latent_store
+from device_utils import synchronize
+from diffusion_batcher import DenoiseRequest
+from face_aligner import FaceAligner, create_image_processor
+from face_alignment_cache import get_face_alignment_cache
+from face_restorer import restore_faces_batched
+from frame_source import FrameSource, SourceFrameReader
+from memory_planner import ChunkPlan, get_memory_planner, host_buffer_budget, is_out_of_memory, release_memory
+from metrics import get_metrics_registry, peak_memory, reset_peak_memory, write_report
+from pipeline_stages import StageTimer, run_staged
+from video_encoder import VideoEncoder
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
+SCHEDULERS = {
+    "ddim": DDIMScheduler,
+    "dpm++": DPMSolverMultistepScheduler,
+    "euler": EulerDiscreteScheduler,
+    "euler_a": EulerAncestralDiscreteScheduler,
+    "pndm": PNDMScheduler,
+    "lms": LMSDiscreteScheduler,
+}
+
+
+def ping_pong_indices(start, count, num_source_frames):
+    """输出帧号start开始的count帧对应的源视频帧号，按正放、倒放交替循环"""
+    period = 2 * num_source_frames
+    positions = np.arange(start, start + count) % period
+    return np.where(positions < num_source_frames, positions, period - 1 - positions)
+
+
+def detect_static_frames(audio_embeds, loudness_db, previous_embeds=None, silence_db=-40.0, duplicate_threshold=0.05):
+    """标记一组帧中音频静音或与前一帧几乎相同的帧，这些帧的口型与前面已生成的帧基本一致
+
+    静音按每帧对应音频片段的RMS（loudness_db）判断；几乎相同按whisper特征与前一帧的相对L2距离判断，
+    previous_embeds为这组帧之前一帧的特征。
+    """
+    static = np.asarray(loudness_db) < silence_db
+    features = audio_embeds.float().flatten(1)
+    if previous_embeds is not None:
+        features = torch.cat([previous_embeds.float().flatten()[None], features])
+    difference = (features[1:] - features[:-1]).norm(dim=1) / features[:-1].norm(dim=1).clamp(min=1e-6)
+    static[len(static) - len(difference) :] |= (difference < duplicate_threshold).cpu().numpy()
+    return static
+
+
+class VideoChunk:
+    """流水线中传递的一组连续帧及其人脸对齐结果
+
+    start是输出视频中的帧号，indices是对应的源视频帧号（循环视频时两者不同）
+    """
+
+    def __init__(self, start, frames, faces, boxes, affine_matrices, slot=None, indices=None):
+        self.start = start
+        self.slot = slot
+        self.indices = np.arange(start, start + len(frames)) if indices is None else indices
+        self.frames = frames
+        self.faces = faces
+        self.boxes = boxes
+        self.affine_matrices = affine_matrices
+        self.decoded_latents = None
+        self.audio_embeds = None
+        self.is_static = False
+
+    def __len__(self):
+        return len(self.frames)
+
 
 class LipsyncPipelineOptimized(DiffusionPipeline):
     _optional_components = []
@@ -118,9 +184,34 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         )
 
         self.vae_scale_factor = 2 ** (len(self.vae.config.block_out_channels) - 1)
+        # fork出的副本共享这里的ImageProcessor（含人脸检测模型）
+        self._shared_image_processors = {}
+        self._shared_image_processors_lock = threading.Lock()
+        # 切换scheduler时都从加载时的配置创建，避免配置在不同scheduler之间来回转换
+        self._base_scheduler_config = self.scheduler.config
+        self.scheduler_name = next(
+            (name for name, cls in SCHEDULERS.items() if type(scheduler) is cls), type(scheduler).__name__
+        )
 
         self.set_progress_bar_config(desc="Steps")
 
+    def set_scheduler(self, name):
+        """按名称切换scheduler（见SCHEDULERS），名称相同时不重新创建"""
+        if name not in SCHEDULERS:
+            raise ValueError(f"Unknown scheduler {name}, choose from {list(SCHEDULERS)}")
+        if name != self.scheduler_name:
+            self.scheduler = SCHEDULERS[name].from_config(self._base_scheduler_config)
+            self.scheduler_name = name
+        return self.scheduler
+
+    def fork(self):
+        """共享模型权重的轻量副本，scheduler和人脸对齐的平滑状态各自独立，多个任务可以同时使用"""
+        pipeline = copy.copy(self)
+        pipeline.scheduler = copy.deepcopy(self.scheduler)
+        pipeline._image_processor_key = None
+        pipeline.image_processor = None
+        return pipeline
+
     def enable_vae_slicing(self):
         self.vae.enable_slicing()
 
@@ -140,6 +231,28 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
                 return torch.device(module._hf_hook.execution_device)
         return self.device
 
+    def get_image_processor(self, resolution, mask_image_path):
+        # ImageProcessor内含人脸检测模型，pipeline常驻时只创建一次；人脸检测与扩散模型在同一设备上运行
+        device = self._execution_device
+        key = (resolution, mask_image_path, str(device))
+        if getattr(self, "_image_processor_key", None) != key:
+            shared = self._shared_image_processors
+            # 并发任务同时第一次使用时只创建一个检测模型；检测本身由FaceAligner按批加锁
+            with self._shared_image_processors_lock:
+                if key not in shared:
+                    mask_image = load_fixed_mask(resolution, mask_image_path)
+                    shared[key] = create_image_processor(resolution, device.type, mask_image=mask_image)
+                image_processor = shared[key]
+            # 检测模型共享，保存平滑状态的restorer每个pipeline副本各一份
+            self.image_processor = copy.copy(image_processor)
+            self.image_processor.restorer = copy.deepcopy(image_processor.restorer)
+            self._image_processor_key = key
+        # 仿射矩阵的平滑状态不能跨视频延续
+        restorer = self.image_processor.restorer
+        if hasattr(restorer, "p_bias"):
+            restorer.p_bias = None
+        return self.image_processor
+
     def decode_latents(self, latents):
         latents = latents / self.vae.config.scaling_factor + self.vae.config.shift_factor
         latents = rearrange(latents, "b c f h w -> (b f) c h w")
@@ -193,38 +306,84 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         latents = latents * self.scheduler.init_noise_sigma
         return latents
 
+    def encode_moments(self, images, device, dtype):
+        # VAE编码得到的高斯分布参数(mean, logvar)，与音频无关，可以预先计算并保存
+        images = images.to(device=device, dtype=dtype)
+        return self.vae.encode(images).latent_dist.parameters
+
+    @staticmethod
+    def sample_moments(moments, device, dtype, generator):
+        moments = moments.to(device=device, dtype=dtype)
+        return DiagonalGaussianDistribution(moments).sample(generator=generator)
+
+    def get_fixed_mask(self, height, width, dtype, device, do_classifier_free_guidance):
+        """固定嘴部遮罩在latent分辨率下的结果和原分辨率的保留区域，按设备和精度缓存在pipeline上
+
+        返回的mask latent形状为(b, 1, 1, h, w)，使用时沿帧维度expand成视图即可，不再逐chunk分配。
+        """
+        key = (self._image_processor_key, height, width, dtype, str(device), do_classifier_free_guidance)
+        cache = getattr(self, "_fixed_mask_cache", None)
+        if cache is None or cache[0] != key:
+            mask = self.image_processor.mask_image[0:1].unsqueeze(0)
+            mask_latents = torch.nn.functional.interpolate(
+                mask, size=(height // self.vae_scale_factor, width // self.vae_scale_factor)
+            )
+            mask_latents = mask_latents.to(device=device, dtype=dtype)
+            mask_latents = rearrange(mask_latents, "f c h w -> 1 c f h w")
+            mask_latents = torch.cat([mask_latents] * 2) if do_classifier_free_guidance else mask_latents
+            surrounding_mask = (1 - mask).to(device=device, dtype=dtype)
+            cache = (key, mask_latents, surrounding_mask)
+            self._fixed_mask_cache = cache
+        return cache[1], cache[2]
+
     def prepare_mask_latents(
-        self, mask, masked_image, height, width, dtype, device, generator, do_classifier_free_guidance
+        self, mask, masked_image, height, width, dtype, device, generator, do_classifier_free_guidance,
+        masked_image_moments=None,
     ):
-        # resize the mask to latents shape as we concatenate the mask to the latents
-        # we do that before converting to dtype to avoid breaking in case we're using cpu_offload
-        # and half precision
-        mask = torch.nn.functional.interpolate(
-            mask, size=(height // self.vae_scale_factor, width // self.vae_scale_factor)
-        )
-        masked_image = masked_image.to(device=device, dtype=dtype)
+        """mask为None时使用缓存的固定遮罩"""
+        num_frames = len(masked_image) if masked_image_moments is None else len(masked_image_moments)
+        if mask is None:
+            mask_latents, _ = self.get_fixed_mask(height, width, dtype, device, do_classifier_free_guidance)
+            mask = mask_latents.expand(-1, -1, num_frames, -1, -1)
+        else:
+            # resize the mask to latents shape as we concatenate the mask to the latents
+            # we do that before converting to dtype to avoid breaking in case we're using cpu_offload
+            # and half precision
+            mask = torch.nn.functional.interpolate(
+                mask, size=(height // self.vae_scale_factor, width // self.vae_scale_factor)
+            )
 
         # encode the mask image into latents space so we can concatenate it to the latents
-        masked_image_latents = self.vae.encode(masked_image).latent_dist.sample(generator=generator)
+        if masked_image_moments is None:
+            masked_image = masked_image.to(device=device, dtype=dtype)
+            masked_image_latents = self.vae.encode(masked_image).latent_dist.sample(generator=generator)
+        else:
+            masked_image_latents = self.sample_moments(masked_image_moments, device, dtype, generator)
         masked_image_latents = (masked_image_latents - self.vae.config.shift_factor) * self.vae.config.scaling_factor
 
         # aligning device to prevent device errors when concating it with the latent model input
         masked_image_latents = masked_image_latents.to(device=device, dtype=dtype)
-        mask = mask.to(device=device, dtype=dtype)
 
         # assume batch size = 1
-        mask = rearrange(mask, "f c h w -> 1 c f h w")
         masked_image_latents = rearrange(masked_image_latents, "f c h w -> 1 c f h w")
 
-        mask = torch.cat([mask] * 2) if do_classifier_free_guidance else mask
+        if mask.ndim == 4:
+            mask = mask.to(device=device, dtype=dtype)
+            mask = rearrange(mask, "f c h w -> 1 c f h w")
+            mask = torch.cat([mask] * 2) if do_classifier_free_guidance else mask
         masked_image_latents = (
             torch.cat([masked_image_latents] * 2) if do_classifier_free_guidance else masked_image_latents
         )
         return mask, masked_image_latents
 
-    def prepare_image_latents(self, images, device, dtype, generator, do_classifier_free_guidance):
-        images = images.to(device=device, dtype=dtype)
-        image_latents = self.vae.encode(images).latent_dist.sample(generator=generator)
+    def prepare_image_latents(
+        self, images, device, dtype, generator, do_classifier_free_guidance, image_moments=None
+    ):
+        if image_moments is None:
+            images = images.to(device=device, dtype=dtype)
+            image_latents = self.vae.encode(images).latent_dist.sample(generator=generator)
+        else:
+            image_latents = self.sample_moments(image_moments, device, dtype, generator)
         image_latents = (image_latents - self.vae.config.shift_factor) * self.vae.config.scaling_factor
         image_latents = rearrange(image_latents, "f c h w -> 1 c f h w")
         image_latents = torch.cat([image_latents] * 2) if do_classifier_free_guidance else image_latents
@@ -253,19 +412,10 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         return images
 
     def affine_transform_video(self, video_frames: np.ndarray):
-        faces = []
-        boxes = []
-        affine_matrices = []
-        # print(f"Affine transforming {len(video_frames)} faces...")
-        # for frame in tqdm.tqdm(video_frames):
-        for frame in video_frames:
-            face, box, affine_matrix = self.image_processor.affine_transform(frame)
-            faces.append(face)
-            boxes.append(box)
-            affine_matrices.append(affine_matrix)
-
-        faces = torch.stack(faces)
-        return faces, boxes, affine_matrices
+        face_aligner = getattr(self, "face_aligner", None)
+        if face_aligner is None or face_aligner.image_processor is not self.image_processor:
+            face_aligner = FaceAligner(self.image_processor)
+        return face_aligner(video_frames)
 
     def restore_frame(self, face, frame, box, affine_matrix):
         x1, y1, x2, y2 = box
@@ -275,24 +425,18 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         face_resized = rearrange(face_resized, "c h w -> h w c")
         face_resized = (face_resized / 2 + 0.5).clamp(0, 1)
         face_resized = (face_resized * 255).to(torch.uint8).cpu().numpy()
-        # face_resized = cv2.resize(face, (width, height), interpolation=cv2.INTER_LANCZOS4)
         restored_frame = self.image_processor.restorer.restore_img(frame, face_resized, affine_matrix)
         return restored_frame
 
+    def restore_chunk(self, chunk):
+        # 整组帧一起在GPU上做逆仿射变换和融合，替代逐帧调用restore_frame
+        return restore_faces_batched(chunk.decoded_latents, chunk.frames, chunk.boxes, chunk.affine_matrices)
+
     def restore_video(self, faces: torch.Tensor, video_frames: np.ndarray, boxes: list, affine_matrices: list):
         video_frames = video_frames[: len(faces)]
         out_frames = []
         print(f"Restoring {len(faces)} faces...")
         for index, face in enumerate(tqdm.tqdm(faces)):
-            # x1, y1, x2, y2 = boxes[index]
-            # height = int(y2 - y1)
-            # width = int(x2 - x1)
-            # face = torchvision.transforms.functional.resize(face, size=(height, width), antialias=True)
-            # face = rearrange(face, "c h w -> h w c")
-            # face = (face / 2 + 0.5).clamp(0, 1)
-            # face = (face * 255).to(torch.uint8).cpu().numpy()
-            # # face = cv2.resize(face, (width, height), interpolation=cv2.INTER_LANCZOS4)
-            # out_frame = self.image_processor.restorer.restore_img(video_frames[index], face, affine_matrices[index])
             out_frame = self.restore_frame(face, video_frames[index], boxes[index], affine_matrices[index])
             out_frames.append(out_frame)
         return np.stack(out_frames, axis=0)
@@ -301,33 +445,175 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         # If the audio is longer than the video, we need to loop the video
         if len(whisper_chunks) > len(video_frames):
             faces, boxes, affine_matrices = self.affine_transform_video(video_frames)
-            num_loops = math.ceil(len(whisper_chunks) / len(video_frames))
-            loop_video_frames = []
-            loop_faces = []
-            loop_boxes = []
-            loop_affine_matrices = []
-            for i in range(num_loops):
-                if i % 2 == 0:
-                    loop_video_frames.append(video_frames)
-                    loop_faces.append(faces)
-                    loop_boxes += boxes
-                    loop_affine_matrices += affine_matrices
-                else:
-                    loop_video_frames.append(video_frames[::-1])
-                    loop_faces.append(faces.flip(0))
-                    loop_boxes += boxes[::-1]
-                    loop_affine_matrices += affine_matrices[::-1]
-
-            video_frames = np.concatenate(loop_video_frames, axis=0)[: len(whisper_chunks)]
-            faces = torch.cat(loop_faces, dim=0)[: len(whisper_chunks)]
-            boxes = loop_boxes[: len(whisper_chunks)]
-            affine_matrices = loop_affine_matrices[: len(whisper_chunks)]
+            indices = ping_pong_indices(0, len(whisper_chunks), len(video_frames))
+            video_frames = video_frames[indices]
+            faces = faces[indices]
+            boxes = [boxes[i] for i in indices]
+            affine_matrices = [affine_matrices[i] for i in indices]
         else:
             video_frames = video_frames[: len(whisper_chunks)]
             faces, boxes, affine_matrices = self.affine_transform_video(video_frames)
 
         return video_frames, faces, boxes, affine_matrices
 
+    def denoise_chunk(
+        self,
+        faces,
+        audio_embeds,
+        timesteps,
+        height,
+        width,
+        weight_dtype,
+        device,
+        generator,
+        guidance_scale,
+        extra_step_kwargs,
+        masked_image_moments=None,
+        image_moments=None,
+        batcher=None,
+        cfg_mode="full",
+        cfg_interval=(0.0, 0.5),
+        cfg_refresh=3,
+        num_inference_steps=None,
+        init_latents=None,
+        strength=1.0,
+        return_latents=False,
+        timer=None,
+        frames_per_row=None,
+    ):
+        """对一组对齐后的人脸做完整的去噪，返回贴回嘴部以外像素后的解码结果
+
+        masked_image_moments/image_moments为预先计算的VAE编码分布参数，提供时跳过VAE编码。
+        batcher为DiffusionBatcher时，去噪循环与其他任务的chunk合并执行。
+        cfg_mode/cfg_interval/cfg_refresh控制无条件分支在哪些步计算，见DenoiseRequest。
+        给出num_inference_steps时每个chunk重新设置scheduler的时间步。
+        给出init_latents时从加噪到strength对应时间步的init_latents开始，只执行最后strength比例的步数；
+        return_latents为True时同时返回去噪后的latents。
+        timer为StageTimer时分别统计VAE编码、每一步UNet和VAE解码的耗时。
+        frames_per_row小于帧数且能整除时，每frames_per_row帧作为一行、多行一起去噪，
+        每行是UNet看到的一个时间窗口；返回的latents仍按帧排成一行。
+        """
+        if timer is None:
+            timer = StageTimer()
+        batch_size = 1
+        processing_frames = len(faces)
+        num_channels_latents = self.vae.config.latent_channels
+        # here `guidance_scale` is defined analog to the guidance weight `w` of equation (2)
+        # of the Imagen paper: https://arxiv.org/pdf/2205.11487.pdf . `guidance_scale = 1`
+        # corresponds to doing no classifier free guidance.
+        do_classifier_free_guidance = guidance_scale > 1.0
+
+        if audio_embeds is not None:
+            audio_embeds = audio_embeds.to(device, dtype=weight_dtype)
+            if do_classifier_free_guidance:
+                null_audio_embeds = torch.zeros_like(audio_embeds)
+                audio_embeds = torch.cat([null_audio_embeds, audio_embeds])
+
+        # 5. Prepare latent variables
+        latents = self.prepare_latents(
+            batch_size,
+            processing_frames,
+            num_channels_latents,
+            height,
+            width,
+            weight_dtype,
+            device,
+            generator
+        )
+
+        # 6. Prepare msked images
+        pixel_values, masked_pixel_values, _ = self.image_processor.prepare_masks_and_masked_images(
+            faces, affine_transform=False
+        )
+        # 遮罩对每一帧都相同，直接使用缓存在设备上的版本
+        _, surrounding_mask = self.get_fixed_mask(height, width, weight_dtype, device, do_classifier_free_guidance)
+
+        with timer("vae_encode", processing_frames, sync=True):
+            # 7. Prepare mask latent variables
+            mask_latents, masked_image_latents = self.prepare_mask_latents(
+                None,
+                masked_pixel_values,
+                height,
+                width,
+                weight_dtype,
+                device,
+                generator,
+                do_classifier_free_guidance,
+                masked_image_moments=masked_image_moments,
+            )
+
+            # 8. Prepare image latents
+            image_latents = self.prepare_image_latents(
+                pixel_values,
+                device,
+                weight_dtype,
+                generator,
+                do_classifier_free_guidance,
+                image_moments=image_moments,
+            )
+
+        # 9. Denoising loop
+        # 使用batcher时每个chunk带自己的scheduler副本，多步scheduler的历史状态互不干扰；
+        # DPM-Solver等多步scheduler在去噪过程中累积历史输出和步数，每个chunk都要从头设置时间步
+        scheduler = self.scheduler if batcher is None else copy.deepcopy(self.scheduler)
+        if num_inference_steps is not None:
+            scheduler.set_timesteps(num_inference_steps, device=device)
+            timesteps = scheduler.timesteps
+        total_steps = len(timesteps)
+        if init_latents is not None:
+            # 与img2img相同：跳过前面的步数，把已有的latents加噪到剩余第一步的噪声水平
+            num_steps = len(timesteps) // scheduler.order
+            t_start = num_steps - min(max(int(num_steps * strength), 1), num_steps)
+            timesteps = timesteps[t_start * scheduler.order :]
+            if hasattr(scheduler, "set_begin_index"):
+                scheduler.set_begin_index(t_start * scheduler.order)
+            noise = latents / scheduler.init_noise_sigma
+            latents = scheduler.add_noise(init_latents.to(device, dtype=weight_dtype), noise, timesteps[:1])
+        reuse_stats = getattr(self, "reuse_stats", None)
+        if reuse_stats is not None:
+            reuse_stats["steps"] += total_steps * processing_frames
+            reuse_stats["skipped_steps"] += (total_steps - len(timesteps)) * processing_frames
+        condition = torch.cat([mask_latents, masked_image_latents, image_latents], dim=1)
+        rows = 1
+        if frames_per_row and processing_frames > frames_per_row and processing_frames % frames_per_row == 0:
+            rows = processing_frames // frames_per_row
+            # 帧维拆成多行；CFG时无条件、有条件两组各自拆分，音频特征按(b f)展开的顺序不变
+            latents = rearrange(latents, "b c (r f) h w -> (b r) c f h w", r=rows)
+            condition = rearrange(condition, "b c (r f) h w -> (b r) c f h w", r=rows)
+        request = DenoiseRequest(
+            latents,
+            condition,
+            audio_embeds,
+            scheduler,
+            timesteps,
+            guidance_scale,
+            extra_step_kwargs,
+            cfg_mode=cfg_mode,
+            cfg_interval=cfg_interval,
+            cfg_refresh=cfg_refresh,
+            timer=timer,
+        )
+        if batcher is None:
+            latents = request.run(self.denoising_unet)
+        else:
+            latents = batcher.run(request)
+        if rows > 1:
+            latents = rearrange(latents, "(b r) c f h w -> b c (r f) h w", r=rows)
+        cfg_stats = getattr(self, "cfg_stats", None)
+        if cfg_stats is not None and request.do_classifier_free_guidance:
+            cfg_stats["steps"] += len(timesteps)
+            cfg_stats["uncond_steps"] += request.uncond_steps
+
+        # Recover the pixel values
+        with timer("vae_decode", processing_frames, sync=True):
+            decoded_latents = self.decode_latents(latents)
+            decoded_latents = self.paste_surrounding_pixels_back(
+                decoded_latents, pixel_values, surrounding_mask, device, weight_dtype
+            )
+        if return_latents:
+            return decoded_latents, latents
+        return decoded_latents
+
     @torch.no_grad()
     def __call__(
         self,
@@ -348,6 +634,35 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         generator: Optional[Union[torch.Generator, List[torch.Generator]]] = None,
         callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
         callback_steps: Optional[int] = 1,
+        pipelined: bool = True,
+        queue_size: int = 2,
+        alignment_workers: int = 4,
+        use_alignment_cache: bool = True,
+        use_prebaked_latents: bool = True,
+        batched_restore: bool = True,
+        video_codec: str = "libx264",
+        video_preset: str = "medium",
+        video_crf: int = 18,
+        encoder_threads: int = 0,
+        video_faststart: bool = False,
+        decode_backend: str = "opencv",
+        loop_short_video: bool = True,
+        loop_buffer_bytes: int = 2 << 30,
+        batcher=None,
+        cfg_mode: str = "full",
+        cfg_interval: tuple = (0.0, 0.5),
+        cfg_refresh: int = 3,
+        temporal_reuse: bool = False,
+        reuse_strength: float = 0.4,
+        silence_threshold_db: float = -40.0,
+        duplicate_threshold: float = 0.05,
+        streaming_audio: bool = False,
+        profile: bool = False,
+        profile_path: Optional[str] = None,
+        job_id: Optional[str] = None,
+        auto_chunk: bool = False,
+        max_chunks_per_batch: int = 4,
+        memory_fraction: float = 0.9,
         **kwargs,
     ):
         is_train = self.denoising_unet.training
@@ -356,10 +671,9 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         check_ffmpeg_installed()
 
         # 0. Define call parameters
-        batch_size = 1
         device = self._execution_device
-        mask_image = load_fixed_mask(height, mask_image_path)
-        self.image_processor = ImageProcessor(height, device="cuda", mask_image=mask_image)
+        self.image_processor = self.get_image_processor(height, mask_image_path)
+        self.face_aligner = FaceAligner(self.image_processor, num_workers=alignment_workers)
         self.set_progress_bar_config(desc=f"Sample frames: {num_frames}")
 
         # 1. Default height and width to unet
@@ -369,293 +683,356 @@ class LipsyncPipelineOptimized(DiffusionPipeline):
         # 2. Check inputs
         self.check_inputs(height, width, callback_steps)
 
-        # here `guidance_scale` is defined analog to the guidance weight `w` of equation (2)
-        # of the Imagen paper: https://arxiv.org/pdf/2205.11487.pdf . `guidance_scale = 1`
-        # corresponds to doing no classifier free guidance.
-        do_classifier_free_guidance = guidance_scale > 1.0
-
         # 3. set timesteps
         self.scheduler.set_timesteps(num_inference_steps, device=device)
         timesteps = self.scheduler.timesteps
 
         # 4. Prepare extra step kwargs.
         extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
-        num_channels_latents = self.vae.config.latent_channels
-
-        whisper_feature = self.audio_encoder.audio2feat(audio_path)
-        whisper_chunks = self.audio_encoder.feature2chunks(feature_array=whisper_feature, fps=video_fps)
-
-        # 视频文件读取
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise ValueError(f"无法打开文件： {video_path}")
 
-        video_frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-        # 取视频和音频帧的最小值作为实际处理帧数
-        total_frames = min(video_frame_count, len(whisper_chunks))
-        if total_frames < num_frames:
-            print(f"Warning: Total frames({total_frames}) is less than batch size({num_frames})")
-            num_frames = total_frames
-
-        # 创建临时视频文件存储处理后的帧
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        file_dir = os.path.dirname(video_out_path)
-        file_name = os.path.basename(video_out_path)
-        file_base, file_ext = os.path.splitext(file_name)
-        temp_video_path = os.path.join(file_dir, f"{file_base}_temp{file_ext}")
-        out = cv2.VideoWriter(temp_video_path, fourcc, video_fps, (frame_width, frame_height))
-
-        # 读取指定帧数的视频
-        def read_video(count: int):
-            frames = []
-            for _ in range(count):
-                success, frame = cap.read()
-                if not success:
-                    break
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frames.append(frame)
-            return len(frames) > 0, np.array(frames)
+        # profile为True时GPU上的阶段结束前先同步，耗时计入实际执行的阶段，代价是少量的流水线重叠
+        timer = StageTimer(synchronize=(lambda: synchronize(device)) if profile else None)
+        start_time = time.perf_counter()
+        reset_peak_memory(device)
 
-        with tqdm.tqdm(total=total_frames, desc="Processing video") as pbar:
-            # 按num_frames分组处理视频
-            processed_frames = 0
-            while processed_frames < total_frames:
-                count = min(total_frames - processed_frames, num_frames)
-                success, video_frames = read_video(count)
-                if not success:
-                    break
-
-                faces, boxes, affine_matrices = self.affine_transform_video(video_frames)
-
-                processing_frames = len(video_frames)
-
-                if self.denoising_unet.add_audio_layer:
-                    audio_embeds = torch.stack(whisper_chunks[processed_frames : processed_frames + processing_frames])
-                    audio_embeds = audio_embeds.to(device, dtype=weight_dtype)
-                    if do_classifier_free_guidance:
-                        null_audio_embeds = torch.zeros_like(audio_embeds)
-                        audio_embeds = torch.cat([null_audio_embeds, audio_embeds])
-                else:
-                    audio_embeds = None
-                    
-                # 5. Prepare latent variables
-                latents = self.prepare_latents(
-                    batch_size,
-                    processing_frames,
-                    num_channels_latents,
-                    height,
-                    width,
-                    weight_dtype,
-                    device,
-                    generator
-                )
-                
-                # 6. Prepare msked images
-                pixel_values, masked_pixel_values, masks = self.image_processor.prepare_masks_and_masked_images(
-                    faces, affine_transform=False
-                )
-                
-                # 7. Prepare mask latent variables
-                mask_latents, masked_image_latents = self.prepare_mask_latents(
-                    masks,
-                    masked_pixel_values,
+        if streaming_audio:
+            # 音频特征按窗口增量计算，在解码阶段随视频帧一起取出，不再等待整段音频编码完成
+            with timer("audio_load"):
+                whisper_chunks = StreamingAudioFeatures(self.audio_encoder, audio_path, fps=video_fps)
+        else:
+            with timer("audio_features"):
+                whisper_feature = self.audio_encoder.audio2feat(audio_path)
+                whisper_chunks = self.audio_encoder.feature2chunks(feature_array=whisper_feature, fps=video_fps)
+
+        # 静音或音频几乎不变的帧口型基本不变，整段都是这类帧的chunk复用之前生成的latents，只做部分去噪
+        loudness_db = None
+        if temporal_reuse:
+            if streaming_audio:
+                audio_samples = whisper_chunks.audio_samples
+            else:
+                audio_samples = whisper.load_audio(audio_path)
+            loudness_db = frame_loudness_db(audio_samples, len(whisper_chunks), video_fps)
+
+        # 按可用显存选择分块：每num_frames帧一行，显存允许时多行一起去噪；显存不足时去噪中途缩小并重试
+        chunk_plan = ChunkPlan(num_frames)
+        if auto_chunk:
+            with timer("memory_profile"):
+                audio_shape = tuple(whisper_chunks[0].shape) if self.denoising_unet.add_audio_layer else None
+                chunk_plan = get_memory_planner().plan(
+                    self,
                     height,
                     width,
                     weight_dtype,
                     device,
-                    generator,
-                    do_classifier_free_guidance
-                )
-                
-                # 8. Prepare image latents
-                image_latents = self.prepare_image_latents(
-                    pixel_values,
-                    device,
-                    weight_dtype,
-                    generator,
-                    do_classifier_free_guidance
+                    num_frames,
+                    audio_shape,
+                    guidance_scale,
+                    max_rows=max_chunks_per_batch,
+                    memory_fraction=memory_fraction,
                 )
+            print(f"Auto chunk: {chunk_plan}")
+
+        # 视频帧由后台线程预读，流水线中同时存在的chunk都要占用一个缓冲区；
+        # 缓冲区在主机内存中，总量超过可用内存的一部分（扣除循环视频的整段缓冲）时减少每个chunk的行数
+        frame_source = FrameSource(
+            video_path,
+            chunk_plan.chunk_frames,
+            backend=decode_backend,
+            num_buffers=2 * queue_size + 4,
+            max_frames=len(whisper_chunks),
+            max_buffer_bytes=host_buffer_budget(loop_buffer_bytes if loop_short_video else 0),
+            batch_multiple=chunk_plan.frames_per_row,
+        )
+        if frame_source.batch_size < min(chunk_plan.chunk_frames, frame_source.max_frames):
+            chunk_plan.rows_per_batch = max(frame_source.batch_size // chunk_plan.frames_per_row, 1)
+            print(f"Decode buffers limited by host memory to {frame_source.batch_size} frames, using {chunk_plan}")
+        chunk_frames = chunk_plan.chunk_frames
+        frame_width = frame_source.width
+        frame_height = frame_source.height
+
+        # 取视频和音频帧的最小值作为需要处理的源视频帧数；
+        # 音频更长时按正放、倒放交替循环源视频，帧数与音频一致
+        num_source_frames = frame_source.max_frames
+        looping = loop_short_video and frame_source.frame_count < len(whisper_chunks)
+        total_frames = len(whisper_chunks) if looping else num_source_frames
+        if total_frames < num_frames:
+            print(f"Warning: Total frames({total_frames}) is less than batch size({num_frames})")
+        chunk_frames = min(chunk_frames, total_frames)
+
+        # 生成的帧直接通过管道交给ffmpeg编码，同时合并音频
+        encoder = VideoEncoder(
+            video_out_path,
+            frame_width,
+            frame_height,
+            video_fps,
+            audio_path=audio_path,
+            codec=video_codec,
+            preset=video_preset,
+            crf=video_crf,
+            threads=encoder_threads,
+            faststart=video_faststart,
+        )
 
-                # 9. Denoising loop
-                for t in timesteps:
-                    # expand the latents if we are doing classifier free guidance
-                    denoising_unet_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-
-                    denoising_unet_input = self.scheduler.scale_model_input(denoising_unet_input, t)
-
-                    # concat latents, mask, masked_image_latents in the channel dimension
-                    denoising_unet_input = torch.cat(
-                        [denoising_unet_input, mask_latents, masked_image_latents, image_latents], dim=1
+        self.cfg_stats = {"steps": 0, "uncond_steps": 0}
+        # steps/skipped_steps按帧累计（每帧的去噪步数）
+        self.reuse_stats = {"steps": 0, "skipped_steps": 0, "chunks": 0, "reused_chunks": 0}
+        # 当前连续静音/重复段中最近一个chunk的latents，后续同类chunk从它开始部分去噪
+        reuse_state = {"latents": None}
+
+        # 同一源视频的人脸对齐结果走磁盘缓存，命中时完全跳过人脸检测
+        alignment_cache = get_face_alignment_cache() if use_alignment_cache else None
+        cached_alignment = None
+        alignment_writer = None
+        if alignment_cache is not None:
+            cached_alignment = alignment_cache.load(video_path, height, num_source_frames)
+            if cached_alignment is None:
+                alignment_writer = alignment_cache.writer(video_path, height, num_source_frames)
+            else:
+                print(f"Using cached face alignment for {video_path}")
+
+        # 预先烘焙过的头像视频直接按帧号读取VAE编码结果
+        prebaked_latents = None
+        if use_prebaked_latents:
+            prebaked_latents = get_avatar_latent_store().load(
+                video_path, height, mask_image_path, weight_dtype, self.vae, num_source_frames
+            )
+            if prebaked_latents is not None:
+                print(f"Using prebaked latents for {video_path}")
+
+        # 阶段一：按num_frames分组解码视频并做人脸对齐，同时取出对应的音频特征
+        def decode_chunks():
+            previous_embeds = None
+            for chunk in decode_video_chunks():
+                if self.denoising_unet.add_audio_layer or loudness_db is not None:
+                    with timer("audio_features", len(chunk)):
+                        audio_embeds = torch.stack(whisper_chunks[chunk.start : chunk.start + len(chunk)])
+                    if self.denoising_unet.add_audio_layer:
+                        chunk.audio_embeds = audio_embeds
+                    if loudness_db is not None:
+                        chunk.is_static = detect_static_frames(
+                            audio_embeds,
+                            loudness_db[chunk.start : chunk.start + len(chunk)],
+                            previous_embeds=previous_embeds,
+                            silence_db=silence_threshold_db,
+                            duplicate_threshold=duplicate_threshold,
+                        ).all()
+                    previous_embeds = audio_embeds[-1]
+                yield chunk
+
+        def decode_video_chunks():
+            source_frames = None
+            if looping:
+                # 循环时保留源视频的对齐结果，之后的帧按帧号取用；原始帧不超过loop_buffer_bytes时也留在内存中，
+                # 否则（如较长的1080p视频）循环部分按帧号重新解码
+                source_faces, source_boxes, source_affine_matrices = [], [], []
+                if num_source_frames * frame_height * frame_width * 3 <= loop_buffer_bytes:
+                    source_frames = np.empty((num_source_frames, frame_height, frame_width, 3), dtype=np.uint8)
+            decoded = 0
+            for slot, start, video_frames in frame_source:
+                with timer("affine_transform", len(video_frames)):
+                    if cached_alignment is not None:
+                        faces, boxes, affine_matrices = cached_alignment.get(start, len(video_frames))
+                    else:
+                        faces, boxes, affine_matrices = self.affine_transform_video(video_frames)
+                        if alignment_writer is not None:
+                            alignment_writer.write(start, faces, boxes, affine_matrices)
+                decoded = start + len(video_frames)
+                if source_frames is not None:
+                    source_frames[start:decoded] = video_frames
+                    frame_source.release(slot)
+                    video_frames, slot = source_frames[start:decoded], None
+                if looping:
+                    source_faces.append(faces)
+                    source_boxes += boxes
+                    source_affine_matrices += affine_matrices
+                yield VideoChunk(start, video_frames, faces, boxes, affine_matrices, slot=slot)
+
+            if not looping or decoded == 0:
+                return
+            source_faces = torch.cat(source_faces)
+            source_reader = None if source_frames is not None else SourceFrameReader(video_path)
+            try:
+                start = decoded
+                while start < total_frames:
+                    count = min(chunk_frames, total_frames - start)
+                    indices = ping_pong_indices(start, count, decoded)
+                    if source_reader is None:
+                        frames = source_frames[indices]
+                    else:
+                        with timer("loop_decode", count):
+                            frames = source_reader.read(indices)
+                    yield VideoChunk(
+                        start,
+                        frames,
+                        source_faces[indices],
+                        [source_boxes[i] for i in indices],
+                        [source_affine_matrices[i] for i in indices],
+                        indices=indices,
                     )
-
-                    # predict the noise residual
-                    noise_pred = self.denoising_unet(
-                        denoising_unet_input, t, encoder_hidden_states=audio_embeds
-                    ).sample
-
-                    # perform guidance
-                    if do_classifier_free_guidance:
-                        noise_pred_uncond, noise_pred_audio = noise_pred.chunk(2)
-                        noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_audio - noise_pred_uncond)
-
-                    # compute the previous noisy sample x_t -> x_t-1
-                    latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
-                
-                # Recover the pixel values
-                decoded_latents = self.decode_latents(latents)
-                decoded_latents = self.paste_surrounding_pixels_back(
-                    decoded_latents, pixel_values, 1 - masks, device, weight_dtype
-                )
-
-                # 恢复并写入生成的帧
-                for i in range(processing_frames):
-                    frame = self.restore_frame(
-                        decoded_latents[i],
-                        video_frames[i],
-                        boxes[i],
-                        affine_matrices[i]
+                    start += count
+            finally:
+                if source_reader is not None:
+                    source_reader.close()
+
+        def denoise_planned(chunk, masked_image_moments, image_moments, init_latents):
+            # 按当前分块计划把chunk分组去噪；显存不足时缩小计划，从出错的那一组重新开始
+            decoded_groups, latent_groups = [], []
+            start = 0
+            while start < len(chunk):
+                end = start + chunk_plan.group_frames(len(chunk) - start)
+                out_of_memory = False
+                try:
+                    decoded_latents, latents = self.denoise_chunk(
+                        chunk.faces[start:end],
+                        None if chunk.audio_embeds is None else chunk.audio_embeds[start:end],
+                        timesteps,
+                        height,
+                        width,
+                        weight_dtype,
+                        device,
+                        generator,
+                        guidance_scale,
+                        extra_step_kwargs,
+                        masked_image_moments=None if masked_image_moments is None else masked_image_moments[start:end],
+                        image_moments=None if image_moments is None else image_moments[start:end],
+                        batcher=batcher,
+                        cfg_mode=cfg_mode,
+                        cfg_interval=cfg_interval,
+                        cfg_refresh=cfg_refresh,
+                        num_inference_steps=num_inference_steps,
+                        init_latents=None if init_latents is None else init_latents[:, :, start:end],
+                        strength=reuse_strength,
+                        return_latents=True,
+                        timer=timer,
+                        frames_per_row=chunk_plan.frames_per_row,
                     )
-                    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                    out.write(frame)
-
-                # 更新进度
-                processed_frames += processing_frames
-                pbar.update(processing_frames)
-
-            # 清理资源
-            cap.release()
-            out.release()
+                except Exception as e:
+                    if not is_out_of_memory(e) or not chunk_plan.back_off(self):
+                        raise
+                    out_of_memory = True
+                if out_of_memory:
+                    # 异常对象引用着出错时的中间结果，离开except之后再释放显存
+                    release_memory(device)
+                    print(f"Out of memory at frame {chunk.start + start}, retrying with {chunk_plan}")
+                    continue
+                decoded_groups.append(decoded_latents)
+                latent_groups.append(latents)
+                start = end
+            return torch.cat(decoded_groups), torch.cat(latent_groups, dim=2)
+
+        # 阶段二：扩散推理，留在当前线程执行以保证随机数的使用顺序
+        def diffuse(chunk):
+            with timer("diffusion", len(chunk)):
+                masked_image_moments, image_moments = None, None
+                if prebaked_latents is not None:
+                    masked_image_moments, image_moments = prebaked_latents.take(chunk.indices)
+                init_latents = None
+                if chunk.is_static and reuse_state["latents"] is not None:
+                    # 对齐后的人脸位置基本一致，用参考chunk的最后一帧作为每一帧的初始值
+                    init_latents = reuse_state["latents"][:, :, -1:].expand(-1, -1, len(chunk), -1, -1)
+                    self.reuse_stats["reused_chunks"] += 1
+                self.reuse_stats["chunks"] += 1
+                chunk.decoded_latents, latents = denoise_planned(
+                    chunk, masked_image_moments, image_moments, init_latents
+                )
+                # 参考始终是连续静态段中最近的一个chunk；非静态chunk打断连续段，之后的静态段重新完整去噪
+                reuse_state["latents"] = latents if chunk.is_static else None
+            return chunk
+
+        # 阶段三：恢复并写入生成的帧
+        def restore_and_write(chunk):
+            if batched_restore:
+                with timer("restore", len(chunk)):
+                    restored_frames = self.restore_chunk(chunk)
+            else:
+                restored_frames = []
+                for i in range(len(chunk)):
+                    with timer("restore"):
+                        restored_frames.append(
+                            self.restore_frame(
+                                chunk.decoded_latents[i],
+                                chunk.frames[i],
+                                chunk.boxes[i],
+                                chunk.affine_matrices[i]
+                            )
+                        )
+            with timer("encode", len(restored_frames)):
+                encoder.write(np.asarray(restored_frames))
+            if chunk.slot is not None:
+                frame_source.release(chunk.slot)
+            # 更新进度
+            pbar.update(len(chunk))
 
-            # 合并音频
-            command = f"ffmpeg -y -loglevel error -nostdin -i {temp_video_path} -i {audio_path} -c:v libx264 -crf 18 -c:a aac -q:v 0 -q:a 0 {video_out_path}"
-            subprocess.run(command, shell=True)
+        with tqdm.tqdm(total=total_frames, desc="Processing video") as pbar:
+            try:
+                if pipelined:
+                    # 解码对齐、扩散、恢复编码三个阶段在相邻的chunk之间重叠执行
+                    run_staged(decode_chunks(), diffuse, restore_and_write, queue_size=queue_size)
+                else:
+                    for chunk in decode_chunks():
+                        restore_and_write(diffuse(chunk))
+                if alignment_writer is not None:
+                    alignment_writer.commit()
+                    alignment_writer = None
+                # 等待ffmpeg编码完剩余的帧并写入音频
+                with timer("encode_flush"):
+                    encoder.close()
+                self.encode_stats = encoder.stats()
+                encoder = None
+            finally:
+                if alignment_writer is not None:
+                    alignment_writer.abort()
+                if encoder is not None:
+                    encoder.abort()
+                # 清理资源
+                frame_source.close()
+                self.face_aligner.close()
+            timer.add("decode", frame_source.decode_seconds, frame_source.frames_decoded)
+
+        self.stage_timings = timer.as_dict()
+        total_seconds = time.perf_counter() - start_time
+        print(f"Stage timings:\n{timer.summary()}")
+        print(f"Encode FPS: {self.encode_stats['fps']:.2f} ({video_codec}, preset={video_preset})")
+        if batcher is not None:
+            print(f"Diffusion batcher: {batcher.stats()}")
+        if self.cfg_stats["steps"] > 0:
+            steps, uncond_steps = self.cfg_stats["steps"], self.cfg_stats["uncond_steps"]
+            saved = (steps - uncond_steps) / (2 * steps)
+            print(f"CFG ({cfg_mode}): unconditional branch on {uncond_steps}/{steps} steps, {saved:.1%} of UNet rows saved")
+        if temporal_reuse and self.reuse_stats["steps"] > 0:
+            reuse_stats = self.reuse_stats
+            print(
+                f"Temporal reuse: {reuse_stats['reused_chunks']}/{reuse_stats['chunks']} chunks reused, "
+                f"skipped-step ratio {reuse_stats['skipped_steps'] / reuse_stats['steps']:.1%}"
+            )
 
-            # 删除临时文件
-            if os.path.exists(temp_video_path):
-                os.remove(temp_video_path)
+        # 每个任务一份结构化报告：写入profile_path，同时汇总到进程内的指标（Prometheus导出）
+        self.profile_report = {
+            "job_id": job_id or uuid.uuid4().hex,
+            "video_path": video_path,
+            "audio_path": audio_path,
+            "video_out_path": video_out_path,
+            "device": str(device),
+            "dtype": str(weight_dtype),
+            "frames": total_frames,
+            "num_inference_steps": num_inference_steps,
+            "seconds": round(total_seconds, 4),
+            "seconds_per_frame": round(total_seconds / max(total_frames, 1), 4),
+            "stages": self.stage_timings,
+            "peak_memory": peak_memory(device),
+            "decode": frame_source.stats(),
+            "encode": self.encode_stats,
+            "cfg": dict(self.cfg_stats, mode=cfg_mode),
+            "temporal_reuse": dict(self.reuse_stats) if temporal_reuse else None,
+            "chunk_plan": dict(chunk_plan.as_dict(), auto=auto_chunk),
+        }
+        if batcher is not None:
+            self.profile_report["batcher"] = batcher.stats()
+        get_metrics_registry().observe("lipsync", self.profile_report)
+        if profile_path is not None:
+            write_report(profile_path, self.profile_report)
+            print(f"Profile report saved to {profile_path}")
 
         # reset to training if need
         if is_train:
             self.denoising_unet.train()
-
-
-        # audio_samples = read_audio(audio_path)
-        # video_frames = read_video(video_path, use_decord=False)
-
-        # video_frames, faces, boxes, affine_matrices = self.loop_video(whisper_chunks, video_frames)
-
-        # synced_video_frames = []
-
-        # num_channels_latents = self.vae.config.latent_channels
-
-        # # Prepare latent variables
-        # all_latents = self.prepare_latents(
-        #     batch_size,
-        #     len(whisper_chunks),
-        #     num_channels_latents,
-        #     height,
-        #     width,
-        #     weight_dtype,
-        #     device,
-        #     generator,
-        # )
-
-        # num_inferences = math.ceil(len(whisper_chunks) / num_frames)
-        # for i in tqdm.tqdm(range(num_inferences), desc="Doing inference..."):
-        #     if self.denoising_unet.add_audio_layer:
-        #         audio_embeds = torch.stack(whisper_chunks[i * num_frames : (i + 1) * num_frames])
-        #         audio_embeds = audio_embeds.to(device, dtype=weight_dtype)
-        #         if do_classifier_free_guidance:
-        #             null_audio_embeds = torch.zeros_like(audio_embeds)
-        #             audio_embeds = torch.cat([null_audio_embeds, audio_embeds])
-        #     else:
-        #         audio_embeds = None
-        #     inference_faces = faces[i * num_frames : (i + 1) * num_frames]
-        #     latents = all_latents[:, :, i * num_frames : (i + 1) * num_frames]
-        #     ref_pixel_values, masked_pixel_values, masks = self.image_processor.prepare_masks_and_masked_images(
-        #         inference_faces, affine_transform=False
-        #     )
-
-        #     # 7. Prepare mask latent variables
-        #     mask_latents, masked_image_latents = self.prepare_mask_latents(
-        #         masks,
-        #         masked_pixel_values,
-        #         height,
-        #         width,
-        #         weight_dtype,
-        #         device,
-        #         generator,
-        #         do_classifier_free_guidance,
-        #     )
-
-        #     # 8. Prepare image latents
-        #     ref_latents = self.prepare_image_latents(
-        #         ref_pixel_values,
-        #         device,
-        #         weight_dtype,
-        #         generator,
-        #         do_classifier_free_guidance,
-        #     )
-
-        #     # 9. Denoising loop
-        #     num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
-        #     with self.progress_bar(total=num_inference_steps) as progress_bar:
-        #         for j, t in enumerate(timesteps):
-        #             # expand the latents if we are doing classifier free guidance
-        #             denoising_unet_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-
-        #             denoising_unet_input = self.scheduler.scale_model_input(denoising_unet_input, t)
-
-        #             # concat latents, mask, masked_image_latents in the channel dimension
-        #             denoising_unet_input = torch.cat(
-        #                 [denoising_unet_input, mask_latents, masked_image_latents, ref_latents], dim=1
-        #             )
-
-        #             # predict the noise residual
-        #             noise_pred = self.denoising_unet(
-        #                 denoising_unet_input, t, encoder_hidden_states=audio_embeds
-        #             ).sample
-
-        #             # perform guidance
-        #             if do_classifier_free_guidance:
-        #                 noise_pred_uncond, noise_pred_audio = noise_pred.chunk(2)
-        #                 noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_audio - noise_pred_uncond)
-
-        #             # compute the previous noisy sample x_t -> x_t-1
-        #             latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
-
-        #             # call the callback, if provided
-        #             if j == len(timesteps) - 1 or ((j + 1) > num_warmup_steps and (j + 1) % self.scheduler.order == 0):
-        #                 progress_bar.update()
-        #                 if callback is not None and j % callback_steps == 0:
-        #                     callback(j, t, latents)
-
-        #     # Recover the pixel values
-        #     decoded_latents = self.decode_latents(latents)
-        #     decoded_latents = self.paste_surrounding_pixels_back(
-        #         decoded_latents, ref_pixel_values, 1 - masks, device, weight_dtype
-        #     )
-        #     synced_video_frames.append(decoded_latents)
-
-        # synced_video_frames = self.restore_video(torch.cat(synced_video_frames), video_frames, boxes, affine_matrices)
-
-        # audio_samples_remain_length = int(synced_video_frames.shape[0] / video_fps * audio_sample_rate)
-        # audio_samples = audio_samples[:audio_samples_remain_length].cpu().numpy()
-
-        # if is_train:
-        #     self.denoising_unet.train()
-
-        # temp_dir = "temp"
-        # if os.path.exists(temp_dir):
-        #     shutil.rmtree(temp_dir)
-        # os.makedirs(temp_dir, exist_ok=True)
-
-        # write_video(os.path.join(temp_dir, "video.mp4"), synced_video_frames, fps=25)
-
-        # sf.write(os.path.join(temp_dir, "audio.wav"), audio_samples, audio_sample_rate)
-
-        # command = f"ffmpeg -y -loglevel error -nostdin -i {os.path.join(temp_dir, 'video.mp4')} -i {os.path.join(temp_dir, 'audio.wav')} -c:v libx264 -crf 18 -c:a aac -q:v 0 -q:a 0 {video_out_path}"
-        # subprocess.run(command, shell=True)
@@ -0,0 +1,221 @@
+import gc
+import threading
+
+import torch
+
+from job_scheduler import free_memory
+
+# 解码缓冲区等主机内存分配最多使用当前可用内存的这一比例
+HOST_MEMORY_FRACTION = 0.5
+
+
+def is_out_of_memory(error):
+    """显存或内存不足的异常；CPU上分配失败是普通的RuntimeError"""
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+
+def release_memory(device):
+    gc.collect()
+    if torch.device(device).type == "cuda" and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def available_memory(device):
+    """当前可用于新分配的显存（字节）：设备空闲显存加上分配器已缓存但未使用的部分；CPU返回None"""
+    device = torch.device(device)
+    if device.type != "cuda" or not torch.cuda.is_available():
+        return None
+    free, _ = torch.cuda.mem_get_info(device)
+    return free + torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+
+
+def host_buffer_budget(reserved=0):
+    """可用于解码缓冲区的主机内存（字节）：可用内存的HOST_MEMORY_FRACTION减去已预留的reserved，无法获取时返回None"""
+    available = free_memory("cpu")
+    if available is None:
+        return None
+    return max(available * HOST_MEMORY_FRACTION - reserved, 0)
+
+
+class ChunkPlan:
+    """一个任务的分块方式：每行frames_per_row帧（UNet一次看到的时间窗口），rows_per_batch行拼成一个batch去噪
+
+    back_off在显存不足时依次减少行数、开启VAE分片解码、缩短每行帧数，返回False表示已无法再缩小。
+    """
+
+    def __init__(self, frames_per_row, rows_per_batch=1, planner=None, key=None):
+        self.frames_per_row = max(int(frames_per_row), 1)
+        self.rows_per_batch = max(int(rows_per_batch), 1)
+        self.planner = planner
+        self.key = key
+        self.backoffs = 0
+
+    @property
+    def chunk_frames(self):
+        return self.frames_per_row * self.rows_per_batch
+
+    def group_frames(self, remaining):
+        """从剩余的remaining帧中取下一组一起去噪的帧数：尽量凑满整行，不足一行的尾部单独成组"""
+        if remaining >= self.chunk_frames:
+            return self.chunk_frames
+        if remaining > self.frames_per_row:
+            return remaining - remaining % self.frames_per_row
+        return remaining
+
+    def back_off(self, pipeline):
+        if self.rows_per_batch > 1:
+            self.rows_per_batch //= 2
+        elif not getattr(pipeline.vae, "use_slicing", True):
+            # VAE逐帧解码，解码阶段的峰值与帧数无关
+            pipeline.enable_vae_slicing()
+        elif self.frames_per_row > 1:
+            self.frames_per_row //= 2
+        else:
+            return False
+        self.backoffs += 1
+        if self.planner is not None:
+            self.planner.record_limit(self.key, self)
+        return True
+
+    def as_dict(self):
+        return {
+            "frames_per_row": self.frames_per_row,
+            "rows_per_batch": self.rows_per_batch,
+            "backoffs": self.backoffs,
+        }
+
+    def __repr__(self):
+        return f"ChunkPlan(frames_per_row={self.frames_per_row}, rows_per_batch={self.rows_per_batch})"
+
+
+class MemoryPlanner:
+    """按分辨率、精度和设备测量UNet/VAE每多一行的显存增量，结合当前可用显存选择分块方式
+
+    测量结果按配置缓存，每个任务只根据当时的空闲显存重新计算；任务中出现显存不足而缩小过的配置
+    记为上限，之后的任务不再超过它。测量在其他任务空闲时更准确，并发任务的分配会计入测量值（偏保守）。
+    CPU上内存通常不是瓶颈，不做测量，直接使用配置的帧数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._limits = {}
+
+    @staticmethod
+    def _measure_peak(fn, device):
+        torch.cuda.synchronize(device)
+        baseline = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        fn()
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device) - baseline
+
+    @torch.no_grad()
+    def profile(self, pipeline, height, width, dtype, device, frames_per_row, audio_shape, do_classifier_free_guidance):
+        """返回{阶段: (固定开销, 每行增量)}，分别用1行和2行的输入测量UNet前向、VAE编码和VAE解码的峰值"""
+        unet = pipeline.denoising_unet
+        vae = pipeline.vae
+        latent_height = height // pipeline.vae_scale_factor
+        latent_width = width // pipeline.vae_scale_factor
+        branches = 2 if do_classifier_free_guidance else 1
+        t = torch.tensor(999, device=device)
+
+        def unet_forward(rows):
+            sample = torch.randn(
+                branches * rows, unet.config.in_channels, frames_per_row, latent_height, latent_width,
+                device=device, dtype=dtype,
+            )
+            audio_embeds = None
+            if audio_shape is not None:
+                audio_embeds = torch.randn(branches * rows * frames_per_row, *audio_shape, device=device, dtype=dtype)
+            unet(sample, t, encoder_hidden_states=audio_embeds)
+
+        def vae_encode(rows):
+            images = torch.randn(rows * frames_per_row, 3, height, width, device=device, dtype=dtype)
+            vae.encode(images).latent_dist.sample()
+
+        def vae_decode(rows):
+            latents = torch.randn(
+                rows * frames_per_row, vae.config.latent_channels, latent_height, latent_width,
+                device=device, dtype=dtype,
+            )
+            vae.decode(latents)
+
+        costs = {}
+        for stage, fn in (("unet", unet_forward), ("vae_encode", vae_encode), ("vae_decode", vae_decode)):
+            one_row = self._measure_peak(lambda: fn(1), device)
+            two_rows = self._measure_peak(lambda: fn(2), device)
+            per_row = max(two_rows - one_row, 1)
+            costs[stage] = (max(one_row - per_row, 0), per_row)
+        release_memory(device)
+        return costs
+
+    def record_limit(self, key, chunk_plan):
+        if key is None:
+            return
+        with self._lock:
+            self._limits[key] = (chunk_plan.frames_per_row, chunk_plan.rows_per_batch)
+
+    def plan(
+        self,
+        pipeline,
+        height,
+        width,
+        dtype,
+        device,
+        num_frames,
+        audio_shape,
+        guidance_scale,
+        max_rows=4,
+        memory_fraction=0.9,
+    ):
+        """在可用显存的memory_fraction之内选择最多的行数；一行都放不下时缩短每行帧数"""
+        device = torch.device(device)
+        budget = available_memory(device)
+        if budget is None:
+            return ChunkPlan(num_frames)
+        budget *= memory_fraction
+        do_classifier_free_guidance = guidance_scale > 1.0
+        key = (height, width, str(dtype), str(device), num_frames, audio_shape, do_classifier_free_guidance)
+        with self._lock:
+            costs = self._profiles.get(key)
+            limit = self._limits.get(key)
+        if costs is None:
+            costs = self.profile(
+                pipeline, height, width, dtype, device, num_frames, audio_shape, do_classifier_free_guidance
+            )
+            with self._lock:
+                self._profiles[key] = costs
+            print(
+                "Memory profile per row of "
+                f"{num_frames} frames: "
+                + ", ".join(f"{stage} {per_row / 2**20:.0f}MB" for stage, (_, per_row) in costs.items())
+            )
+
+        # 各阶段的激活在下一阶段之前释放，峰值取各阶段的最大值
+        def peak(rows):
+            return max(fixed + rows * per_row for fixed, per_row in costs.values())
+
+        rows = 1
+        while rows < max_rows and peak(rows + 1) <= budget:
+            rows += 1
+        frames_per_row = num_frames
+        if peak(1) > budget:
+            # 按每帧的显存线性缩短时间窗口，口型连贯性会变差
+            fits = min((budget - fixed) / per_row for fixed, per_row in costs.values())
+            frames_per_row = max(int(num_frames * fits), 1)
+            print(f"Warning: one chunk of {num_frames} frames does not fit in memory, using {frames_per_row} frames")
+        if limit is not None:
+            frames_per_row = min(frames_per_row, limit[0])
+            rows = min(rows, limit[1]) if frames_per_row == limit[0] else 1
+        return ChunkPlan(frames_per_row, rows, planner=self, key=key)
+
+
+_memory_planner = MemoryPlanner()
+
+
+def get_memory_planner():
+    return _memory_planner
@@ -0,0 +1,219 @@
+import json
+import threading
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def reset_peak_memory(device):
+    device = torch.device(device)
+    if device.type == "cuda" and torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory(device):
+    """设备和进程的内存峰值（字节）
+
+    GPU为reset_peak_memory之后的显存分配峰值，多个任务共用一张卡时是它们合计的峰值；
+    host_rss为进程启动以来的常驻内存峰值。
+    """
+    result = {}
+    device = torch.device(device)
+    if device.type == "cuda" and torch.cuda.is_available():
+        result["device_allocated"] = torch.cuda.max_memory_allocated(device)
+        result["device_reserved"] = torch.cuda.max_memory_reserved(device)
+    if resource is not None:
+        # Linux上ru_maxrss的单位是KB
+        result["host_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+
+def write_report(path, report):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    items = ",".join(f'{key}="{str(value)}"' for key, value in sorted(labels.items()))
+    return "{" + items + "}"
+
+
+class MetricsRegistry:
+    """进程内累计的任务阶段耗时和内存峰值，按Prometheus文本格式导出，并保留最近任务的JSON报告
+
+    observe由任务结束时调用；register_collector注册的函数在每次导出时调用，
+    返回[(name, labels, value), ...]形式的即时指标（如调度器队列长度）。
+    """
+
+    def __init__(self, max_reports=200):
+        self._lock = threading.Lock()
+        self.max_reports = max_reports
+        self._stage_seconds = defaultdict(float)
+        self._stage_items = defaultdict(int)
+        self._stage_calls = defaultdict(int)
+        self._stage_max_seconds = defaultdict(float)
+        self._jobs = defaultdict(int)
+        self._job_seconds = defaultdict(float)
+        self._peak_memory = defaultdict(int)
+        self._reports = OrderedDict()
+        self._collectors = {}
+
+    def observe(self, kind, report):
+        """记录一个已完成任务的报告：report包含job_id、seconds、stages（StageTimer.as_dict()）和peak_memory"""
+        with self._lock:
+            self._jobs[kind] += 1
+            self._job_seconds[kind] += report.get("seconds", 0.0)
+            for stage, stats in report.get("stages", {}).items():
+                key = (kind, stage)
+                self._stage_seconds[key] += stats["seconds"]
+                self._stage_items[key] += stats["count"]
+                self._stage_calls[key] += stats.get("calls", 1)
+                self._stage_max_seconds[key] = max(self._stage_max_seconds[key], stats.get("max_seconds", 0.0))
+            for memory_kind, value in report.get("peak_memory", {}).items():
+                key = (kind, memory_kind)
+                self._peak_memory[key] = max(self._peak_memory[key], value)
+            job_id = report.get("job_id")
+            if job_id is not None:
+                self._reports[job_id] = dict(report, kind=kind, stages=dict(report.get("stages", {})))
+                while len(self._reports) > self.max_reports:
+                    self._reports.popitem(last=False)
+
+    def register_collector(self, name, fn):
+        with self._lock:
+            self._collectors[name] = fn
+
+    def report(self, job_id):
+        with self._lock:
+            return self._reports.get(job_id)
+
+    def reports(self):
+        with self._lock:
+            return [
+                {"job_id": job_id, "kind": report["kind"], "seconds": report.get("seconds")}
+                for job_id, report in self._reports.items()
+            ]
+
+    def render(self):
+        """Prometheus文本格式"""
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        with self._lock:
+            stage_labels = [({"job": key[0], "stage": key[1]}, key) for key in self._stage_seconds]
+            family(
+                "lipsync_stage_seconds_total",
+                "counter",
+                "Seconds spent in each pipeline stage",
+                [(labels, round(self._stage_seconds[key], 6)) for labels, key in stage_labels],
+            )
+            family(
+                "lipsync_stage_items_total",
+                "counter",
+                "Items (frames, steps, segments) processed by each stage",
+                [(labels, self._stage_items[key]) for labels, key in stage_labels],
+            )
+            family(
+                "lipsync_stage_calls_total",
+                "counter",
+                "Number of timed calls of each stage",
+                [(labels, self._stage_calls[key]) for labels, key in stage_labels],
+            )
+            family(
+                "lipsync_stage_max_seconds",
+                "gauge",
+                "Longest single call of each stage",
+                [(labels, round(self._stage_max_seconds[key], 6)) for labels, key in stage_labels],
+            )
+            family(
+                "lipsync_jobs_total",
+                "counter",
+                "Completed jobs",
+                [({"job": kind}, count) for kind, count in self._jobs.items()],
+            )
+            family(
+                "lipsync_job_seconds_total",
+                "counter",
+                "Wall seconds of completed jobs",
+                [({"job": kind}, round(seconds, 6)) for kind, seconds in self._job_seconds.items()],
+            )
+            family(
+                "lipsync_peak_memory_bytes",
+                "gauge",
+                "Highest peak memory observed by a job",
+                [({"job": kind, "memory": memory_kind}, value) for (kind, memory_kind), value in self._peak_memory.items()],
+            )
+            collectors = list(self._collectors.items())
+
+        # 即时指标按名称分组输出，同名的样本放在同一个family中
+        gauges = defaultdict(list)
+        for collector_name, fn in collectors:
+            try:
+                samples = fn()
+            except Exception as e:
+                print(f"Metrics collector {collector_name} failed: {e}")
+                continue
+            for name, labels, value in samples:
+                gauges[name].append((labels, value))
+        for name, samples in gauges.items():
+            family(name, "gauge", name.replace("_", " "), samples)
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send(200, self.registry.render(), "text/plain; version=0.0.4")
+        elif self.path == "/jobs":
+            self._send(200, json.dumps(self.registry.reports()), "application/json")
+        elif self.path.startswith("/jobs/"):
+            report = self.registry.report(self.path[len("/jobs/") :])
+            if report is None:
+                self._send(404, json.dumps({"error": "job not found"}), "application/json")
+            else:
+                self._send(200, json.dumps(report, ensure_ascii=False), "application/json")
+        else:
+            self._send(404, "not found\n", "text/plain")
+
+    def _send(self, status, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求很频繁，不打印访问日志
+        pass
+
+
+def start_metrics_server(port, host="0.0.0.0", registry=None):
+    """在后台线程提供/metrics（Prometheus）、/jobs和/jobs/<job_id>（JSON报告）"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or get_metrics_registry()})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    print(f"Metrics server listening on http://{host}:{port}/metrics")
+    return server
+
+
+_metrics_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    return _metrics_registry
@@ -0,0 +1,209 @@
+import gc
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+from omegaconf import OmegaConf
+
+from diffusion_batcher import DiffusionBatcher
+
+
+class _RegistryEntry:
+    def __init__(self, pipeline, load_seconds, warmup_seconds):
+        self.pipeline = pipeline
+        self.load_seconds = load_seconds
+        self.warmup_seconds = warmup_seconds
+        self.hits = 0
+        self.last_used = time.time()
+        # 同一个pipeline内部的scheduler/image_processor是有状态的，同一时间只允许一个任务使用
+        self.lock = threading.Lock()
+        # 已从注册表移除，等待锁的任务拿到锁后需要重新获取
+        self.released = False
+        # 跨任务合批时共用的DiffusionBatcher，随条目一起释放
+        self.batcher = None
+
+
+class ModelRegistry:
+    """进程级模型注册表：按配置、精度和设备缓存已加载并预热的LipsyncPipelineOptimized"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # 每个正在加载的配置一把锁：同一配置只加载一次，加载期间其他配置的命中和加载不受影响
+        self._load_locks = {}
+        self._metrics = {
+            "loads": 0,
+            "hits": 0,
+            "releases": 0,
+            "load_seconds": 0.0,
+            "warmup_seconds": 0.0,
+        }
+
+    @staticmethod
+    def make_key(config, args, dtype, device):
+        model_config = OmegaConf.to_yaml(OmegaConf.create({"model": config.model, "data": config.data}))
+        return (
+            model_config,
+            str(args.configs_path),
+            str(args.inference_ckpt_path),
+            str(dtype),
+            str(torch.device(device)),
+        )
+
+    def get_pipeline(self, config, args, dtype, device, loader, warmup=True):
+        """返回已缓存的pipeline，不存在时调用loader(config, args, dtype, device)加载"""
+        key = self.make_key(config, args, dtype, device)
+        with self._lock:
+            entry = self._hit(key)
+            if entry is not None:
+                return entry
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # 等待期间可能已由其他任务加载完成
+            with self._lock:
+                entry = self._hit(key)
+                if entry is not None:
+                    return entry
+
+            start_time = time.time()
+            pipeline = loader(config, args, dtype, device)
+            load_seconds = time.time() - start_time
+
+            warmup_seconds = 0.0
+            if warmup:
+                start_time = time.time()
+                warmup_pipeline(pipeline, config, dtype)
+                warmup_seconds = time.time() - start_time
+
+            entry = _RegistryEntry(pipeline, load_seconds, warmup_seconds)
+            with self._lock:
+                self._entries[key] = entry
+                self._load_locks.pop(key, None)
+                self._metrics["loads"] += 1
+                self._metrics["load_seconds"] += load_seconds
+                self._metrics["warmup_seconds"] += warmup_seconds
+            print(f"Loaded lipsync pipeline in {load_seconds:.2f}s (warmup {warmup_seconds:.2f}s)")
+            return entry
+
+    def _hit(self, key):
+        # 调用时需持有self._lock
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.hits += 1
+            entry.last_used = time.time()
+            self._metrics["hits"] += 1
+        return entry
+
+    @contextmanager
+    def acquire(self, config, args, dtype, device, loader, warmup=True, shared=False):
+        """独占使用一个缓存的pipeline；shared为True时返回共享权重的副本(pipeline.fork())，不需要等待其他任务
+
+        拿到的条目在等待期间被release时重新获取（必要时重新加载），不会返回已释放的pipeline。
+        """
+        while True:
+            entry = self.get_pipeline(config, args, dtype, device, loader, warmup=warmup)
+            if shared:
+                pipeline = entry.pipeline
+                if entry.released or pipeline is None:
+                    continue
+                entry.last_used = time.time()
+                yield pipeline.fork()
+                return
+            with entry.lock:
+                if entry.released:
+                    continue
+                entry.last_used = time.time()
+                yield entry.pipeline
+                return
+
+    @contextmanager
+    def acquire_batched(self, config, args, dtype, device, loader, max_batch_size=4, warmup=True):
+        """返回(共享权重的副本, 该模型的DiffusionBatcher)，多个任务的chunk在batcher中合并做UNet前向"""
+        while True:
+            entry = self.get_pipeline(config, args, dtype, device, loader, warmup=warmup)
+            with self._lock:
+                if entry.released:
+                    continue
+                if entry.batcher is None:
+                    entry.batcher = DiffusionBatcher(entry.pipeline.denoising_unet, max_batch_size=max_batch_size)
+                batcher = entry.batcher
+                pipeline = entry.pipeline
+                batcher.attach()
+            break
+        try:
+            entry.last_used = time.time()
+            yield pipeline.fork(), batcher
+        finally:
+            batcher.detach()
+
+    def release(self, key=None):
+        """显式释放模型，key为None时释放全部"""
+        with self._lock:
+            keys = list(self._entries) if key is None else [key]
+            entries = [self._entries.pop(k) for k in keys if k in self._entries]
+            for entry in entries:
+                entry.released = True
+            self._metrics["releases"] += len(entries)
+        # 不持有全局锁等待正在使用的任务结束，其他配置的任务照常获取和加载
+        for entry in entries:
+            if entry.batcher is not None:
+                # 正在合批的任务结束后batcher的工作线程退出，不再引用UNet
+                entry.batcher.close()
+                entry.batcher = None
+            with entry.lock:
+                entry.pipeline = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats["resident"] = len(self._entries)
+            stats["entries"] = [
+                {
+                    "dtype": key[3],
+                    "device": key[4],
+                    "hits": entry.hits,
+                    "load_seconds": round(entry.load_seconds, 3),
+                    "warmup_seconds": round(entry.warmup_seconds, 3),
+                    "last_used": entry.last_used,
+                }
+                for key, entry in self._entries.items()
+            ]
+            return stats
+
+
+@torch.no_grad()
+def warmup_pipeline(pipeline, config, dtype):
+    """用全零输入跑一次VAE和UNet，提前完成CUDA内核选择和显存分配"""
+    device = pipeline._execution_device
+    num_frames = config.data.num_frames
+    resolution = config.data.resolution
+    latent_size = resolution // pipeline.vae_scale_factor
+
+    images = torch.zeros(1, 3, resolution, resolution, device=device, dtype=dtype)
+    latents = pipeline.vae.encode(images).latent_dist.mode()
+    pipeline.vae.decode(latents)
+
+    unet = pipeline.denoising_unet
+    unet_input = torch.zeros(
+        1, unet.config.in_channels, num_frames, latent_size, latent_size, device=device, dtype=dtype
+    )
+    audio_embeds = None
+    if unet.add_audio_layer:
+        audio_embeds = torch.zeros(num_frames, 50, config.model.cross_attention_dim, device=device, dtype=dtype)
+    timestep = pipeline.scheduler.config.num_train_timesteps - 1
+    unet(unet_input, timestep, encoder_hidden_states=audio_embeds)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+_registry = ModelRegistry()
+
+
+def get_registry():
+    return _registry
@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_END = object()
+
+
+class StageTimer:
+    """按阶段累计耗时和处理数量，可在多个线程中同时使用
+
+    synchronize为可选的回调（如torch.cuda.synchronize），sync=True的阶段结束前先调用它，
+    GPU上的异步计算才会计入该阶段，而不是下一个等待结果的阶段。
+    """
+
+    def __init__(self, synchronize=None):
+        self._lock = threading.Lock()
+        self._synchronize = synchronize
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.calls = defaultdict(int)
+        self.max_seconds = defaultdict(float)
+        self.started_at = time.time()
+
+    @contextmanager
+    def __call__(self, stage, count=1, sync=False):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            if sync and self._synchronize is not None:
+                self._synchronize()
+            self.add(stage, time.perf_counter() - start_time, count)
+
+    def add(self, stage, seconds, count=1):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.counts[stage] += count
+            self.calls[stage] += 1
+            self.max_seconds[stage] = max(self.max_seconds[stage], seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                stage: {
+                    "seconds": round(self.seconds[stage], 4),
+                    "count": self.counts[stage],
+                    "calls": self.calls[stage],
+                    "max_seconds": round(self.max_seconds[stage], 4),
+                }
+                for stage in self.seconds
+            }
+
+    def summary(self):
+        lines = []
+        for stage, stats in self.as_dict().items():
+            seconds, count = stats["seconds"], stats["count"]
+            rate = count / seconds if seconds > 0 else 0.0
+            lines.append(f"  {stage:<16} {seconds:8.2f}s  {count:6d} items  {rate:8.2f} items/s")
+        return "\n".join(lines)
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_staged(source, process, sink, queue_size=2):
+    """三段式流水线：source在后台线程迭代产出，process在当前线程处理，sink在后台线程消费
+
+    各阶段之间用有界队列连接，保证顺序不变；任何一个阶段出错都会停止整条流水线并在当前线程重新抛出。
+    process留在调用线程，便于GPU推理和随机数生成器的使用顺序与串行执行保持一致。
+    """
+    in_queue = queue.Queue(maxsize=queue_size)
+    out_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for item in source:
+                if not _put(in_queue, item, stop):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(in_queue, _END, stop)
+
+    def consume():
+        try:
+            while True:
+                item = _get(out_queue, stop)
+                if item is _END:
+                    return
+                sink(item)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    producer = threading.Thread(target=produce, name="pipeline-producer", daemon=True)
+    consumer = threading.Thread(target=consume, name="pipeline-consumer", daemon=True)
+    producer.start()
+    consumer.start()
+    try:
+        while True:
+            item = _get(in_queue, stop)
+            if item is _END:
+                break
+            if not _put(out_queue, process(item), stop):
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        _put(out_queue, _END, stop)
+        consumer.join()
+        stop.set()
+        producer.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchaudio
+
+from f5_tts.infer.utils_infer import (
+    hop_length,
+    mel_spec_type,
+    n_fft,
+    n_mel_channels,
+    preprocess_ref_audio_text,
+    target_rms,
+    target_sample_rate,
+    win_length,
+)
+
+from disk_cache import DiskLRUCache, hash_file
+
+CACHE_VERSION = 3
+
+
+# 加载参考音频，做与infer_batch_process相同的单声道、音量和采样率处理
+def load_ref_audio(ref_audio):
+    audio, sr = torchaudio.load(ref_audio)
+    ref_audio_duration = audio.shape[-1] / sr
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+    rms = torch.sqrt(torch.mean(torch.square(audio)))
+    if rms < target_rms:
+        audio = audio * target_rms / rms
+    if sr != target_sample_rate:
+        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
+        audio = resampler(audio)
+    return audio, ref_audio_duration, float(rms)
+
+
+class PreparedRefAudio:
+    """预处理完成的参考音频：裁剪后的音频文件、转录文本、归一化波形和mel特征"""
+
+    def __init__(self, path, text, audio, duration, rms, mel=None):
+        self.path = path
+        self.text = text
+        self.audio = audio
+        self.duration = duration
+        self.rms = rms
+        self.mel = mel
+
+    @classmethod
+    def from_file(cls, ref_audio, ref_text, mel_spec=None):
+        audio, duration, rms = load_ref_audio(ref_audio)
+        mel = None
+        if mel_spec is not None:
+            mel = compute_ref_mel(audio, mel_spec)
+        return cls(ref_audio, ref_text, audio, duration, rms, mel)
+
+
+@torch.no_grad()
+def compute_ref_mel(audio, mel_spec):
+    device = next(mel_spec.buffers(), torch.empty(0)).device
+    mel = mel_spec(audio.to(device))
+    # 与CFM.sample内部一致：(b, d, n) -> (b, n, d)
+    return mel.permute(0, 2, 1).float().cpu()
+
+
+def mel_settings(mel_spec=None):
+    """决定缓存mel内容的参数；mel_spec为None时取F5-TTS的默认值"""
+    settings = {
+        "n_fft": n_fft,
+        "hop_length": hop_length,
+        "win_length": win_length,
+        "n_mel_channels": n_mel_channels,
+        "mel_spec_type": mel_spec_type,
+    }
+    if mel_spec is not None:
+        for name in ("n_fft", "hop_length", "win_length", "n_mel_channels"):
+            settings[name] = getattr(mel_spec, name, settings[name])
+        # MelSpec不保存mel_spec_type，只保存对应的提取函数get_<type>_mel_spectrogram
+        extractor = getattr(mel_spec, "extractor", None)
+        if extractor is not None:
+            name = getattr(extractor, "__name__", "")
+            settings["mel_spec_type"] = name.removeprefix("get_").removesuffix("_mel_spectrogram") or name
+    return settings
+
+
+class RefAudioCache(DiskLRUCache):
+    """按参考音频内容哈希缓存预处理结果的磁盘缓存，超过max_bytes时按最近使用时间淘汰"""
+
+    def __init__(self, cache_dir="output/cache/ref_audio", max_bytes=1 << 30):
+        super().__init__(cache_dir, max_bytes)
+
+    @staticmethod
+    def make_key(ref_audio_orig, ref_text, mel_spec=None):
+        params = json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "audio": hash_file(ref_audio_orig),
+                "ref_text": ref_text.strip(),
+                "sample_rate": target_sample_rate,
+                "mel": mel_settings(mel_spec),
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+    def get(self, ref_audio_orig, ref_text, mel_spec=None, show_info=print):
+        """返回PreparedRefAudio，命中缓存时跳过裁剪、重采样和ASR转录"""
+        key = self.make_key(ref_audio_orig, ref_text, mel_spec)
+        entry_dir = self.cache_dir / key
+        prepared = self._load(entry_dir)
+        if prepared is not None:
+            self.record_hit(entry_dir)
+            if prepared.mel is None and mel_spec is not None:
+                prepared.mel = compute_ref_mel(prepared.audio, mel_spec)
+                self._write_mel(entry_dir, prepared.mel)
+            return prepared
+
+        self.record_miss()
+        ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+        prepared = PreparedRefAudio.from_file(ref_audio, ref_text, mel_spec)
+        self._store(entry_dir, prepared)
+        self.evict()
+        return prepared
+
+    def _load(self, entry_dir):
+        meta_path = entry_dir / "meta.json"
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            audio = torch.from_numpy(np.load(entry_dir / "audio.npy"))
+            mel_path = entry_dir / "mel.npy"
+            mel = torch.from_numpy(np.load(mel_path)) if mel_path.exists() else None
+        except (OSError, ValueError) as e:
+            print(f"参考音频缓存损坏，重新生成: {entry_dir} ({e})")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        return PreparedRefAudio(
+            (entry_dir / "ref.wav").as_posix(), meta["ref_text"], audio, meta["duration"], meta["rms"], mel
+        )
+
+    def _store(self, entry_dir, prepared):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # 先写到临时目录再整体改名，避免并发任务读到写了一半的缓存
+        temp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp_"))
+        shutil.copyfile(prepared.path, temp_dir / "ref.wav")
+        np.save(temp_dir / "audio.npy", prepared.audio.numpy())
+        if prepared.mel is not None:
+            np.save(temp_dir / "mel.npy", prepared.mel.numpy())
+        meta = {
+            "ref_text": prepared.text,
+            "duration": prepared.duration,
+            "rms": prepared.rms,
+            "created": time.time(),
+        }
+        with open(temp_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        try:
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # 其它任务已经写入了同一个条目
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        prepared.path = (entry_dir / "ref.wav").as_posix()
+
+    def _write_mel(self, entry_dir, mel):
+        temp_path = entry_dir / f".mel_{os.getpid()}_{threading.get_ident()}.npy"
+        np.save(temp_path, mel.numpy())
+        os.replace(temp_path, entry_dir / "mel.npy")
+
+
+_ref_audio_cache = RefAudioCache()
+
+
+def get_ref_audio_cache():
+    return _ref_audio_cache
@@ -0,0 +1,8 @@
+# 与launch.sh一致，测试时把仓库根目录和LatentSync子模块加入导入路径；benchmarks下的合成输入和小模型也供测试使用
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "submodules" / "LatentSync", ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
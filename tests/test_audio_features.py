@@ -0,0 +1,53 @@
+# StreamingAudioFeatures与Audio2Feature整段计算的对比：第一个窗口保留的部分在数值误差内一致，
+# 之后的特征因窗口划分不同而有差异。使用随机初始化的小whisper，缺少LatentSync时跳过。
+import pytest
+import torch
+
+pytest.importorskip("latentsync")
+pytest.importorskip("soundfile")
+
+FPS = 25
+
+
+@pytest.fixture(scope="module")
+def audio_encoder(tmp_path_factory):
+    from latentsync.whisper.audio2feature import Audio2Feature
+    from tiny_models import make_tiny_whisper_checkpoint
+
+    whisper_path = make_tiny_whisper_checkpoint(str(tmp_path_factory.mktemp("whisper") / "tiny.pt"))
+    return Audio2Feature(model_path=whisper_path, device="cpu", num_frames=16, audio_feat_length=[2, 2])
+
+
+def whole_file_chunks(audio_encoder, audio_path):
+    whisper_feature = audio_encoder.audio2feat(audio_path)
+    return audio_encoder.feature2chunks(feature_array=whisper_feature, fps=FPS)
+
+
+def test_short_audio_matches_whole_file(audio_encoder, tmp_path):
+    from audio_features import StreamingAudioFeatures
+    from synthetic import make_tone_audio
+
+    audio_path = make_tone_audio(str(tmp_path / "short.wav"), seconds=8.0)
+    expected = whole_file_chunks(audio_encoder, audio_path)
+    streaming = StreamingAudioFeatures(audio_encoder, audio_path, fps=FPS)
+    assert len(streaming) == len(expected)
+    for i in range(len(expected)):
+        torch.testing.assert_close(streaming[i], expected[i], rtol=1e-4, atol=1e-4)
+
+
+def test_long_audio_matches_inside_first_window(audio_encoder, tmp_path):
+    from audio_features import StreamingAudioFeatures
+    from synthetic import make_tone_audio
+
+    audio_path = make_tone_audio(str(tmp_path / "long.wav"), seconds=40.0)
+    expected = whole_file_chunks(audio_encoder, audio_path)
+    streaming = StreamingAudioFeatures(audio_encoder, audio_path, fps=FPS)
+    assert len(streaming) == len(expected)
+    # 第一个窗口保留的特征下标小于stride+margin；每个chunk向右多取(audio_feat_length[1]+1)*2个特征
+    last_feature = streaming.stride + streaming.margin - (audio_encoder.audio_feat_length[1] + 1) * 2
+    first_window_frames = int(last_feature / streaming.feature_multiplier)
+    for i in range(first_window_frames):
+        torch.testing.assert_close(streaming[i], expected[i], rtol=1e-4, atol=1e-4)
+    for i in range(first_window_frames, len(expected)):
+        assert streaming[i].shape == expected[i].shape
+    assert streaming.windows_encoded >= 2
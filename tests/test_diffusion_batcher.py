@@ -0,0 +1,128 @@
+# DenoiseRequest的CFG模式与DiffusionBatcher的合批。UNet和scheduler用简单的线性替身，
+# 条件分支与无条件分支的差（引导残差）固定为1，此时cache模式与full模式结果相同。
+import threading
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from diffusion_batcher import DenoiseRequest, DiffusionBatcher
+
+LATENT_CHANNELS = 4
+NUM_STEPS = 10
+
+
+class FakeScheduler:
+    def scale_model_input(self, sample, t):
+        return sample
+
+    def step(self, noise_pred, t, latents):
+        return SimpleNamespace(prev_sample=latents - 0.1 * noise_pred)
+
+
+class FakeUNet:
+    """预测噪声 = 0.5 * latents + 条件通道；无条件分支的条件通道为0，有条件分支为1"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, sample, t, encoder_hidden_states=None):
+        self.batch_sizes.append(sample.shape[0])
+        return SimpleNamespace(sample=0.5 * sample[:, :LATENT_CHANNELS] + sample[:, LATENT_CHANNELS:])
+
+
+def make_request(cfg_mode="full", guidance_scale=1.5, rows=1, seed=0, **kwargs):
+    generator = torch.Generator().manual_seed(seed)
+    latents = torch.randn(rows, LATENT_CHANNELS, 2, 4, 4, generator=generator)
+    condition = torch.cat([torch.zeros(rows, 1, 2, 4, 4), torch.ones(rows, 1, 2, 4, 4)])
+    if guidance_scale <= 1.0:
+        condition = condition[rows:]
+    return DenoiseRequest(
+        latents,
+        condition,
+        None,
+        FakeScheduler(),
+        list(range(NUM_STEPS)),
+        guidance_scale,
+        {},
+        cfg_mode=cfg_mode,
+        **kwargs,
+    )
+
+
+def test_full_mode_computes_uncond_every_step():
+    unet = FakeUNet()
+    request = make_request("full")
+    request.run(unet)
+    assert request.uncond_steps == NUM_STEPS
+    assert unet.batch_sizes == [2] * NUM_STEPS
+
+
+def test_interval_mode_limits_uncond_to_interval():
+    unet = FakeUNet()
+    request = make_request("interval", cfg_interval=(0.0, 0.5))
+    request.run(unet)
+    assert request.uncond_steps == NUM_STEPS // 2
+    assert unet.batch_sizes == [2] * (NUM_STEPS // 2) + [1] * (NUM_STEPS // 2)
+
+
+def test_cache_mode_reuses_guidance_residual():
+    unet = FakeUNet()
+    request = make_request("cache", cfg_refresh=3)
+    latents = request.run(unet)
+    # 第0、3、6、9步刷新
+    assert request.uncond_steps == 4
+    assert unet.batch_sizes.count(2) == 4
+    torch.testing.assert_close(latents, make_request("full").run(FakeUNet()))
+
+
+def test_no_guidance_skips_uncond_branch():
+    unet = FakeUNet()
+    request = make_request("full", guidance_scale=1.0)
+    request.run(unet)
+    assert request.uncond_steps == 0
+    assert unet.batch_sizes == [1] * NUM_STEPS
+
+
+def test_unknown_cfg_mode_is_rejected():
+    with pytest.raises(ValueError):
+        make_request("sometimes")
+
+
+def test_batcher_matches_direct_run():
+    expected = [make_request("full", seed=seed).run(FakeUNet()) for seed in range(3)]
+    requests = [make_request("full", seed=seed) for seed in range(3)]
+    batcher = DiffusionBatcher(FakeUNet(), max_batch_size=3)
+    results = [None] * len(requests)
+
+    def run(index):
+        results[index] = batcher.run(requests[index])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10.0)
+    for result, reference in zip(results, expected):
+        torch.testing.assert_close(result, reference)
+    stats = batcher.stats()
+    assert stats["requests"] == 3 and stats["batched_requests"] == 3 * NUM_STEPS
+
+
+def test_closed_batcher_stops_and_drops_unet_after_last_user():
+    batcher = DiffusionBatcher(FakeUNet(), max_batch_size=2)
+    batcher.attach()
+    batcher.run(make_request("full"))
+    thread = batcher._thread
+    batcher.close()
+    # 还有任务attach时线程继续服务
+    batcher.run(make_request("full", seed=1))
+    assert thread.is_alive()
+    batcher.detach()
+    thread.join(5.0)
+    assert not thread.is_alive()
+    assert batcher.denoising_unet is None
+    with pytest.raises(RuntimeError):
+        batcher.attach()
+    with pytest.raises(RuntimeError):
+        batcher.run(make_request("full"))
@@ -0,0 +1,101 @@
+# 磁盘缓存的写入提交和LRU淘汰，以人脸对齐缓存为例；只依赖numpy和torch。
+import os
+
+import numpy as np
+import torch
+
+from disk_cache import DiskLRUCache, hash_file
+from face_alignment_cache import FaceAlignmentCache
+
+
+def make_entry(cache_dir, name, size, last_used):
+    entry_dir = cache_dir / name
+    entry_dir.mkdir(parents=True)
+    (entry_dir / "data.bin").write_bytes(b"\0" * size)
+    (entry_dir / "meta.json").write_text("{}")
+    os.utime(entry_dir / "meta.json", (last_used, last_used))
+    return entry_dir
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    cache = DiskLRUCache(tmp_path, max_bytes=2500)
+    old = make_entry(tmp_path, "old", 1000, last_used=100)
+    middle = make_entry(tmp_path, "middle", 1000, last_used=200)
+    new = make_entry(tmp_path, "new", 1000, last_used=300)
+    # 正在写入的临时目录不参与淘汰
+    temp = make_entry(tmp_path, ".tmp_writing", 1000, last_used=0)
+
+    # 命中更新最近使用时间，old变成最新的条目
+    cache.record_hit(old)
+    assert cache.evict() == 1
+    assert old.exists() and new.exists() and temp.exists()
+    assert not middle.exists()
+    assert cache.stats() == {"hits": 1, "misses": 0, "evictions": 1}
+
+
+def test_evict_is_noop_without_limit(tmp_path):
+    make_entry(tmp_path, "entry", 1000, last_used=100)
+    assert DiskLRUCache(tmp_path, max_bytes=None).evict() == 0
+    assert DiskLRUCache(tmp_path / "missing", max_bytes=0).evict() == 0
+
+
+def test_hash_file_follows_content(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"first")
+    first = hash_file(path)
+    os.utime(path, ns=(1, 1))
+    path.write_bytes(b"second")
+    assert hash_file(path) != first
+
+
+def write_alignment(cache, video_path, resolution, num_frames, commit_frames=None):
+    writer = cache.writer(video_path, resolution, num_frames)
+    faces = torch.randint(0, 255, (num_frames, 3, resolution, resolution), dtype=torch.uint8)
+    boxes = [[i, i, i + 10, i + 10] for i in range(num_frames)]
+    matrices = [np.eye(2, 3) * (i + 1) for i in range(num_frames)]
+    commit_frames = num_frames if commit_frames is None else commit_frames
+    writer.write(0, faces[:commit_frames], boxes[:commit_frames], matrices[:commit_frames])
+    return writer.commit(), faces
+
+
+def test_alignment_cache_commit_and_load(tmp_path):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"video")
+    cache = FaceAlignmentCache(tmp_path / "cache")
+    assert cache.load(video_path, 16, 4) is None
+
+    committed, faces = write_alignment(cache, video_path, 16, 4)
+    assert committed
+    cached = cache.load(video_path, 16, 4)
+    loaded_faces, boxes, matrices = cached.get(1, 2)
+    torch.testing.assert_close(loaded_faces, faces[1:3])
+    assert boxes[0] == [1, 1, 11, 11]
+    np.testing.assert_array_equal(matrices[1], np.eye(2, 3) * 3)
+    # 缓存的帧数不够时视为未命中
+    assert cache.load(video_path, 16, 8) is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "evictions": 0}
+
+
+def test_alignment_cache_discards_incomplete_writes(tmp_path):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"video")
+    cache = FaceAlignmentCache(tmp_path / "cache")
+    committed, _ = write_alignment(cache, video_path, 16, 4, commit_frames=3)
+    assert not committed
+    assert cache.load(video_path, 16, 1) is None
+    assert list(cache.cache_dir.iterdir()) == []
+
+
+def test_alignment_cache_evicts_after_commit(tmp_path):
+    # 一个条目约2KB，上限只放得下一个
+    cache = FaceAlignmentCache(tmp_path / "cache", max_bytes=3000)
+    first = tmp_path / "a.mp4"
+    first.write_bytes(b"a")
+    write_alignment(cache, first, 16, 2)
+    os.utime(cache.entry_dir(first, 16) / "meta.json", (100, 100))
+    second = tmp_path / "b.mp4"
+    second.write_bytes(b"b")
+    write_alignment(cache, second, 16, 2)
+    assert cache.evictions == 1
+    assert cache.load(first, 16, 2) is None
+    assert cache.load(second, 16, 2) is not None
@@ -0,0 +1,52 @@
+# 没有GPU时走真实的get_image_processor：CPU上应创建CPUFaceDetector，人脸对齐可以正常运行。
+# 需要LatentSync、insightface和checkpoints/auxiliary下的检测权重，缺少时跳过。
+import os
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+pytest.importorskip("diffusers")
+pytest.importorskip("insightface")
+pytest.importorskip("latentsync")
+
+ROOT = Path(__file__).resolve().parent.parent
+MASK_IMAGE_PATH = ROOT / "submodules" / "LatentSync" / "latentsync" / "utils" / "mask.png"
+VIDEO_PATH = ROOT / "assets" / "demo1_video.mp4"
+
+
+@pytest.fixture(autouse=True)
+def in_repo_root(monkeypatch):
+    # FaceDetector按相对路径查找checkpoints/auxiliary
+    monkeypatch.chdir(ROOT)
+    if not os.path.isdir("checkpoints/auxiliary"):
+        pytest.skip("checkpoints/auxiliary is not downloaded")
+
+
+def test_cpu_image_processor_aligns_real_face():
+    import cv2
+
+    from face_aligner import CPUFaceDetector
+    from lipsync_pipeline_optimized import LipsyncPipelineOptimized
+
+    pipeline = SimpleNamespace(
+        _execution_device=torch.device("cpu"),
+        _shared_image_processors={},
+        _shared_image_processors_lock=threading.Lock(),
+    )
+    image_processor = LipsyncPipelineOptimized.get_image_processor(pipeline, 256, str(MASK_IMAGE_PATH))
+    assert isinstance(image_processor.face_detector, CPUFaceDetector)
+    # 同一配置复用同一个检测模型
+    pipeline._image_processor_key = None
+    again = LipsyncPipelineOptimized.get_image_processor(pipeline, 256, str(MASK_IMAGE_PATH))
+    assert again.face_detector is image_processor.face_detector
+
+    capture = cv2.VideoCapture(str(VIDEO_PATH))
+    ok, frame = capture.read()
+    capture.release()
+    assert ok
+    face, box, affine_matrix = image_processor.affine_transform(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    assert tuple(face.shape) == (3, 256, 256)
+    assert affine_matrix.shape == (2, 3)
@@ -0,0 +1,56 @@
+# 批量人脸贴回与LatentSync逐帧AlignRestore.restore_img的结果一致（允许少量取整误差），
+# 包括同一组帧里人脸框大小不同的情况。缺少LatentSync时跳过。
+import numpy as np
+import pytest
+import torch
+from einops import rearrange
+
+pytest.importorskip("latentsync")
+
+FRAME_HEIGHT, FRAME_WIDTH = 240, 320
+
+
+def affine_matrix(face_size, index):
+    # 人脸位于画面中部，带轻微的旋转和缩放抖动
+    face_width, face_height = face_size
+    angle = 0.05 * np.sin(index)
+    scale = face_width / (FRAME_WIDTH * 0.4) * (1 + 0.01 * np.cos(index))
+    c, s = scale * np.cos(angle), scale * np.sin(angle)
+    center_x, center_y = FRAME_WIDTH / 2, FRAME_HEIGHT / 2
+    return np.array(
+        [
+            [c, -s, face_width / 2 - c * center_x + s * center_y],
+            [s, c, face_height / 2 - s * center_x - c * center_y],
+        ]
+    )
+
+
+def restore_per_frame(restorers, faces, frames, boxes, affine_matrices):
+    from face_restorer import faces_to_uint8
+
+    out_frames = []
+    for face, frame, (x1, y1, x2, y2), matrix, restorer in zip(faces, frames, boxes, affine_matrices, restorers):
+        face_uint8 = faces_to_uint8(face[None], int(y2 - y1), int(x2 - x1))[0]
+        out_frames.append(restorer.restore_img(frame, rearrange(face_uint8, "c h w -> h w c").numpy(), matrix))
+    return np.stack(out_frames)
+
+
+@pytest.mark.parametrize("resolutions", [[256] * 4, [256, 256, 192, 256]])
+def test_batched_restore_matches_restore_img(resolutions):
+    from latentsync.utils.affine_transform import AlignRestore
+
+    from face_restorer import restore_faces_batched
+
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (len(resolutions), FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    faces = torch.rand(len(resolutions), 3, 64, 64, generator=torch.Generator().manual_seed(0)) * 2 - 1
+    restorers = [AlignRestore(resolution=resolution) for resolution in resolutions]
+    boxes = [[0, 0, *restorer.face_size] for restorer in restorers]
+    affine_matrices = [affine_matrix(restorer.face_size, i) for i, restorer in enumerate(restorers)]
+
+    expected = restore_per_frame(restorers, faces, frames, boxes, affine_matrices)
+    restored = restore_faces_batched(faces, frames, boxes, affine_matrices)
+    diff = np.abs(restored.astype(np.int16) - expected.astype(np.int16))
+    assert diff.max() <= 2
+    assert diff.mean() < 0.5
+    assert (restored != frames).any(axis=-1).sum() > 0
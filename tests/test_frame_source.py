@@ -0,0 +1,48 @@
+# FrameSource的预读和缓冲区大小限制，用OpenCV写一个小视频作为输入。
+import cv2
+import numpy as np
+
+from frame_source import FrameSource
+
+WIDTH, HEIGHT = 32, 24
+
+
+def make_video(path, num_frames):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 25, (WIDTH, HEIGHT))
+    for i in range(num_frames):
+        writer.write(np.full((HEIGHT, WIDTH, 3), i * 4, dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+def read_all(frame_source):
+    batches = []
+    try:
+        for slot, start, frames in frame_source:
+            batches.append((start, len(frames), int(frames[0, 0, 0, 0])))
+            frame_source.release(slot)
+    finally:
+        frame_source.close()
+    return batches
+
+
+def test_batches_cover_all_frames_in_order(tmp_path):
+    video_path = make_video(tmp_path / "video.avi", 20)
+    batches = read_all(FrameSource(video_path, 8, num_buffers=2))
+    assert [(start, count) for start, count, _ in batches] == [(0, 8), (8, 8), (16, 4)]
+    # 颜色按帧号递增，JPEG压缩有少量误差
+    assert [abs(value - start * 4) <= 4 for start, _, value in batches] == [True] * 3
+
+
+def test_max_buffer_bytes_shrinks_batches_to_whole_rows(tmp_path):
+    video_path = make_video(tmp_path / "video.avi", 20)
+    frame_bytes = WIDTH * HEIGHT * 3
+    # 4个缓冲区、每个最多7帧的内存，按每行2帧取整为6帧
+    frame_source = FrameSource(video_path, 16, num_buffers=4, max_buffer_bytes=4 * 7 * frame_bytes, batch_multiple=2)
+    assert frame_source.batch_size == 6
+    assert [count for _, count, _ in read_all(frame_source)] == [6, 6, 6, 2]
+
+    # 一行都放不下时仍保留一行
+    frame_source = FrameSource(video_path, 16, num_buffers=4, max_buffer_bytes=frame_bytes, batch_multiple=4)
+    assert frame_source.batch_size == 4
+    frame_source.close()
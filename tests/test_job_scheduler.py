@@ -0,0 +1,120 @@
+# JobScheduler的优先级、依赖和内存准入。可用内存通过替换job_scheduler.free_memory模拟，不依赖真实设备。
+import threading
+import time
+
+import pytest
+
+import job_scheduler
+from job_scheduler import JobScheduler, Stage
+
+GB = 1 << 30
+
+
+def wait_all(*jobs, timeout=5.0):
+    for job in jobs:
+        assert job.wait(timeout), f"{job.name} did not finish"
+
+
+def wait_running(job, timeout=5.0):
+    deadline = time.time() + timeout
+    while job.status != "running":
+        assert time.time() < deadline, f"{job.name} did not start"
+        time.sleep(0.01)
+
+
+def test_priority_order_within_pool():
+    scheduler = JobScheduler(pools={"diffusion": 1}, memory_headroom=0)
+    gate = threading.Event()
+    order = []
+    blocker = scheduler.submit("blocker", [Stage("diffusion", lambda job: gate.wait(5.0))])
+    wait_running(blocker)
+    jobs = [
+        scheduler.submit(name, [Stage("diffusion", lambda job: order.append(job.name))], priority=priority)
+        for name, priority in (("low", 5), ("high", 0), ("mid", 1))
+    ]
+    assert scheduler.queue_position(jobs[1]) == 0
+    gate.set()
+    wait_all(blocker, *jobs)
+    assert order == ["high", "mid", "low"]
+
+
+def test_stages_run_in_their_pools_and_dependencies_wait():
+    scheduler = JobScheduler(pools={"tts": 1, "diffusion": 1}, memory_headroom=0)
+    calls = []
+    first = scheduler.submit(
+        "first",
+        [
+            Stage("tts", lambda job: calls.append(("first", threading.current_thread().name))),
+            Stage("diffusion", lambda job: calls.append(("first", threading.current_thread().name))),
+        ],
+    )
+    second = scheduler.submit("second", [Stage("tts", lambda job: calls.append(("second", None)))], depends_on=[first])
+    wait_all(first, second)
+    assert [call[0] for call in calls] == ["first", "first", "second"]
+    assert calls[0][1].startswith("tts-worker") and calls[1][1].startswith("diffusion-worker")
+    assert first.status == second.status == "done"
+
+
+def test_failed_dependency_fails_dependent():
+    scheduler = JobScheduler(pools={"tts": 1}, memory_headroom=0)
+
+    def fail(job):
+        raise RuntimeError("boom")
+
+    first = scheduler.submit("first", [Stage("tts", fail)])
+    second = scheduler.submit("second", [Stage("tts", lambda job: None)], depends_on=[first])
+    wait_all(first, second)
+    assert first.status == "failed" and first.error == "boom"
+    assert second.status == "failed" and "first" in second.error
+
+
+def test_admission_counts_only_unallocated_reservations(monkeypatch):
+    scheduler = JobScheduler(pools={}, memory_headroom=1 * GB)
+    free = {"value": 10 * GB}
+    monkeypatch.setattr(job_scheduler, "free_memory", lambda device: free["value"])
+
+    # 没有运行中的步骤时总是放行
+    assert scheduler._admit(Stage("diffusion", None, memory=20 * GB, device="cuda:0"))
+
+    # 一个预留6GB的步骤开始运行，还没有分配内存：10 - 6 - 1 = 3GB可用
+    scheduler._baseline_free["cuda:0"] = free["value"]
+    scheduler._running["cuda:0"] = 1
+    scheduler._reserved["cuda:0"] = 6 * GB
+    assert scheduler._admit(Stage("diffusion", None, memory=3 * GB, device="cuda:0"))
+    assert not scheduler._admit(Stage("diffusion", None, memory=4 * GB, device="cuda:0"))
+
+    # 它已经分配了4GB：可用内存降为6GB，只再扣除剩余的2GB预留，结果仍为3GB，不会重复扣除
+    free["value"] = 6 * GB
+    assert scheduler._outstanding("cuda:0", free["value"]) == 2 * GB
+    assert scheduler._admit(Stage("diffusion", None, memory=3 * GB, device="cuda:0"))
+    assert not scheduler._admit(Stage("diffusion", None, memory=4 * GB, device="cuda:0"))
+
+    # 其它设备不受影响
+    assert scheduler._admit(Stage("diffusion", None, memory=20 * GB, device="cuda:1"))
+
+
+def test_queue_head_blocks_lower_priority_until_memory_frees(monkeypatch):
+    monkeypatch.setattr(job_scheduler, "free_memory", lambda device: 8 * GB)
+    scheduler = JobScheduler(pools={"diffusion": 2}, memory_headroom=0)
+    gate = threading.Event()
+    order = []
+    big = scheduler.submit("big", [Stage("diffusion", lambda job: gate.wait(5.0), memory=6 * GB)])
+    wait_running(big)
+    # 队首的large放不下时，后面放得下的small也不能插队；large运行时small仍放不下，两者依次执行
+    large = scheduler.submit("large", [Stage("diffusion", lambda job: order.append("large"), memory=7 * GB)], priority=0)
+    small = scheduler.submit("small", [Stage("diffusion", lambda job: order.append("small"), memory=2 * GB)], priority=1)
+    assert small.wait(0.2) is False
+    gate.set()
+    wait_all(big, large, small)
+    assert order == ["large", "small"]
+
+
+def test_unknown_pool_is_rejected():
+    scheduler = JobScheduler(pools={"tts": 1})
+    with pytest.raises(ValueError):
+        scheduler.submit("bad", [Stage("diffusion", lambda job: None)])
+
+
+def test_default_pools_have_no_idle_encode_worker():
+    scheduler = JobScheduler()
+    assert set(scheduler.pools) == {"tts", "face_prep", "diffusion"}
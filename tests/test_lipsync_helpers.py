@@ -0,0 +1,40 @@
+# 循环视频的帧号映射和静止帧检测，缺少diffusers或LatentSync时跳过。
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("diffusers")
+pytest.importorskip("latentsync")
+
+
+def test_ping_pong_indices_alternate_direction():
+    from lipsync_pipeline_optimized import ping_pong_indices
+
+    np.testing.assert_array_equal(ping_pong_indices(0, 10, 4), [0, 1, 2, 3, 3, 2, 1, 0, 0, 1])
+    # 从中间开始与整段计算的结果一致
+    np.testing.assert_array_equal(ping_pong_indices(5, 5, 4), ping_pong_indices(0, 10, 4)[5:])
+    np.testing.assert_array_equal(ping_pong_indices(0, 3, 1), [0, 0, 0])
+
+
+def test_detect_static_frames_marks_silence_and_duplicates():
+    from lipsync_pipeline_optimized import detect_static_frames
+
+    generator = torch.Generator().manual_seed(0)
+    embeds = torch.randn(5, 50, 384, generator=generator)
+    embeds[3] = embeds[2]
+    loudness_db = np.array([-20.0, -60.0, -20.0, -20.0, -20.0])
+    static = detect_static_frames(embeds, loudness_db)
+    np.testing.assert_array_equal(static, [False, True, False, True, False])
+
+
+def test_detect_static_frames_compares_with_previous_chunk():
+    from lipsync_pipeline_optimized import detect_static_frames
+
+    generator = torch.Generator().manual_seed(0)
+    previous = torch.randn(50, 384, generator=generator)
+    embeds = torch.randn(3, 50, 384, generator=generator)
+    loudness_db = np.full(3, -20.0)
+    assert not detect_static_frames(embeds, loudness_db)[0]
+    embeds[0] = previous
+    static = detect_static_frames(embeds, loudness_db, previous_embeds=previous)
+    np.testing.assert_array_equal(static, [True, False, False])
@@ -0,0 +1,95 @@
+# ModelRegistry的获取与释放：等待中的任务在条目被释放后重新加载，不会拿到已释放的pipeline；
+# 合批用的DiffusionBatcher随条目释放。缺少omegaconf时跳过。
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("omegaconf")
+
+
+class FakePipeline:
+    def __init__(self, index, denoising_unet=None):
+        self.index = index
+        self.denoising_unet = denoising_unet if denoising_unet is not None else object()
+
+    def fork(self):
+        return FakePipeline(self.index, self.denoising_unet)
+
+
+@pytest.fixture
+def registry_inputs():
+    from omegaconf import OmegaConf
+
+    from model_registry import ModelRegistry
+
+    loads = []
+
+    def loader(config, args, dtype, device):
+        loads.append(len(loads))
+        return FakePipeline(len(loads))
+
+    config = OmegaConf.create({"model": {"in_channels": 13}, "data": {"resolution": 256}})
+    args = SimpleNamespace(configs_path="configs", inference_ckpt_path="unet.pt")
+    return ModelRegistry(), (config, args, "torch.float32", "cpu", loader), loads
+
+
+def test_waiting_acquire_reloads_after_release(registry_inputs):
+    registry, inputs, loads = registry_inputs
+    holding = threading.Event()
+    finish = threading.Event()
+    results = {}
+
+    def hold():
+        with registry.acquire(*inputs, warmup=False) as pipeline:
+            results["first"] = pipeline
+            holding.set()
+            finish.wait(5.0)
+
+    def wait_for_entry():
+        with registry.acquire(*inputs, warmup=False) as pipeline:
+            results["second"] = pipeline
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert holding.wait(5.0)
+    waiter = threading.Thread(target=wait_for_entry)
+    waiter.start()
+    time.sleep(0.1)
+    releaser = threading.Thread(target=registry.release)
+    releaser.start()
+    time.sleep(0.1)
+    finish.set()
+    for thread in (holder, waiter, releaser):
+        thread.join(5.0)
+
+    assert results["first"].index == 1
+    assert results["second"] is not None and results["second"].index == 2
+    assert loads == [0, 1]
+
+
+def test_hits_reuse_loaded_pipeline(registry_inputs):
+    registry, inputs, loads = registry_inputs
+    with registry.acquire(*inputs, warmup=False) as first:
+        pass
+    with registry.acquire(*inputs, warmup=False) as second:
+        pass
+    assert first is second
+    assert loads == [0]
+    assert registry.stats()["hits"] == 1
+
+
+def test_batcher_is_shared_and_stopped_on_release(registry_inputs):
+    registry, inputs, loads = registry_inputs
+    with registry.acquire_batched(*inputs, warmup=False) as (first, batcher):
+        with registry.acquire_batched(*inputs, warmup=False) as (second, same_batcher):
+            assert same_batcher is batcher
+            assert first is not second and first.denoising_unet is second.denoising_unet
+        # 释放时仍有任务在使用，batcher等它结束
+        registry.release()
+        assert batcher.denoising_unet is first.denoising_unet
+    assert batcher._closed and batcher._users == 0
+    with registry.acquire_batched(*inputs, warmup=False) as (_, new_batcher):
+        assert new_batcher is not batcher
+    assert loads == [0, 1]
@@ -0,0 +1,31 @@
+# 命令行档位：未显式指定的参数取档位的值，显式指定的值优先，没有档位时使用默认值。
+# 缺少diffusers或LatentSync时跳过。
+import pytest
+
+pytest.importorskip("diffusers")
+pytest.importorskip("latentsync")
+
+REQUIRED = ["--video_path", "video.mp4", "--audio_path", "audio.wav", "--video_out_path", "out.mp4"]
+
+
+def parse(*extra):
+    from inference_video import apply_preset, build_parser
+
+    return apply_preset(build_parser().parse_args(REQUIRED + list(extra)))
+
+
+def test_preset_fills_unspecified_values():
+    args = parse("--preset", "draft")
+    assert (args.scheduler, args.inference_steps) == ("dpm++", 8)
+
+
+def test_explicit_values_win_even_when_equal_to_default():
+    args = parse("--preset", "draft", "--scheduler", "ddim", "--inference_steps", "20")
+    assert (args.scheduler, args.inference_steps) == ("ddim", 20)
+
+
+def test_defaults_without_preset():
+    from inference_video import PRESET_DEFAULTS
+
+    args = parse()
+    assert (args.scheduler, args.inference_steps) == (PRESET_DEFAULTS["scheduler"], PRESET_DEFAULTS["inference_steps"])
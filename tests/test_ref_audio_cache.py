@@ -0,0 +1,42 @@
+# 参考音频缓存：未命中时调用F5-TTS真实的preprocess_ref_audio_text，命中时直接读取磁盘结果。
+# 给出参考文本，不触发ASR转录；缺少F5-TTS或soundfile时跳过。
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("f5_tts")
+pytest.importorskip("soundfile")
+
+
+@pytest.fixture
+def ref_audio(tmp_path):
+    from synthetic import make_tone_audio
+
+    return make_tone_audio(str(tmp_path / "speaker.wav"), seconds=3.0, sample_rate=24000)
+
+
+def test_miss_runs_real_preprocess_then_hits(tmp_path, ref_audio):
+    from ref_audio_cache import RefAudioCache
+
+    cache = RefAudioCache(tmp_path / "cache")
+    messages = []
+    prepared = cache.get(ref_audio, "这是一段参考音频", show_info=messages.append)
+    assert cache.stats()["misses"] == 1
+    assert messages, "preprocess_ref_audio_text was not called"
+    assert prepared.text.startswith("这是一段参考音频")
+    assert prepared.audio.shape[0] == 1 and prepared.audio.shape[1] > 0
+
+    cached = cache.get(ref_audio, "这是一段参考音频", show_info=messages.append)
+    assert cache.stats()["hits"] == 1
+    assert cached.text == prepared.text
+    assert cached.path == prepared.path
+    assert cached.audio.shape == prepared.audio.shape
+
+
+def test_key_depends_on_text_and_mel_settings(ref_audio):
+    from ref_audio_cache import RefAudioCache
+
+    key = RefAudioCache.make_key(ref_audio, "参考文本")
+    assert RefAudioCache.make_key(ref_audio, " 参考文本 ") == key
+    assert RefAudioCache.make_key(ref_audio, "另一段文本") != key
+    assert RefAudioCache.make_key(ref_audio, "参考文本", SimpleNamespace(n_mel_channels=80)) != key
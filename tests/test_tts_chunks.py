@@ -0,0 +1,54 @@
+# 分段文本的切块、按时长分批和交叉淡化拼接，缺少F5-TTS时跳过。
+import numpy as np
+import pytest
+
+pytest.importorskip("f5_tts")
+
+
+def test_plan_tts_chunks_keeps_segment_order_and_duration_bounds():
+    from inference_audio import TTS_MAX_DURATION, plan_tts_chunks
+
+    segments = ["今天的天气很好。", "我们一起去公园散步，顺便买一些水果回来吧。" * 6]
+    ref_audio_len = 300
+    chunks = plan_tts_chunks(segments, ref_audio_len, 3.0, "这是一段参考音频。", speed=1)
+    assert [chunk["segment"] for chunk in chunks] == sorted(chunk["segment"] for chunk in chunks)
+    assert chunks[0]["segment"] == 0 and chunks[-1]["segment"] == 1
+    # 长段按参考音频长度切成多块
+    assert sum(chunk["segment"] == 1 for chunk in chunks) > 1
+    for chunk in chunks:
+        assert max(len(chunk["text"]), ref_audio_len) < chunk["duration"] <= TTS_MAX_DURATION
+
+    # 估算时长超过max_duration时截断，与CFM.sample一致
+    capped = plan_tts_chunks(segments, ref_audio_len, 3.0, "这是一段参考音频。", speed=1, max_duration=400)
+    assert [chunk["text"] for chunk in capped] == [chunk["text"] for chunk in chunks]
+    assert max(chunk["duration"] for chunk in capped) == 400 < max(chunk["duration"] for chunk in chunks)
+
+
+def test_group_tts_chunks_respects_batch_limits():
+    from inference_audio import group_tts_chunks
+
+    durations = [500, 100, 300, 120, 900, 310]
+    chunks = [{"duration": duration} for duration in durations]
+    batches = group_tts_chunks(chunks, batch_size=2, max_batch_frames=1000)
+    assert sorted(index for batch in batches for index in batch) == list(range(len(chunks)))
+    for batch in batches:
+        assert len(batch) <= 2
+        # 按时长排序分组，batch中最长的块决定padding后的帧数
+        assert len(batch) == 1 or len(batch) * max(durations[i] for i in batch) <= 1000
+    assert batches[0] == [1, 3]
+    assert batches[-1] == [4]
+
+
+def test_cross_fade_waves():
+    from inference_audio import cross_fade_waves
+
+    first = np.ones(100, dtype=np.float32)
+    second = np.zeros(100, dtype=np.float32)
+    np.testing.assert_array_equal(cross_fade_waves([first, second], 0), np.concatenate([first, second]))
+
+    merged = cross_fade_waves([first, second], 10, sample_rate=1)
+    assert len(merged) == 190
+    np.testing.assert_allclose(merged[90:100], np.linspace(1, 0, 10))
+    assert merged[:90].min() == 1 and merged[100:].max() == 0
+    # 重叠部分比波形还长时只重叠较短波形的长度
+    assert len(cross_fade_waves([first[:5], second], 10, sample_rate=1)) == 100
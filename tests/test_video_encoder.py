@@ -0,0 +1,99 @@
+# 各编码器的恒定质量参数；通过管道编码合成帧和音频，缺少ffmpeg时跳过相关测试。
+import os
+import re
+import shutil
+import subprocess
+import wave
+
+import cv2
+import numpy as np
+import pytest
+
+from video_encoder import VideoEncoder, quality_args
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not found")
+
+
+def test_quality_args_per_codec():
+    assert quality_args("libx264", 18) == ["-crf", "18"]
+    assert quality_args("libvpx-vp9", 30) == ["-b:v", "0", "-crf", "30"]
+    assert quality_args("h264_nvenc", 23) == ["-rc", "vbr", "-cq", "23"]
+    assert quality_args("hevc_qsv", 25) == ["-global_quality", "25"]
+
+
+def test_quality_args_skips_unknown_codec_and_missing_crf():
+    assert quality_args("libx264", None) == []
+    assert quality_args("mpeg4", 18) == []
+
+
+def stream_types(path):
+    # ffmpeg只给输入不给输出时以非零码退出，但会在stderr中列出各个流
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True)
+    return re.findall(r"Stream #0:\d+.*?: (Video|Audio)", result.stderr)
+
+
+def count_frames(path):
+    cap = cv2.VideoCapture(path)
+    count = 0
+    while cap.read()[0]:
+        count += 1
+    cap.release()
+    return count
+
+
+def make_wav(path, seconds, sample_rate=16000):
+    samples = (np.sin(2 * np.pi * 440 * np.arange(int(seconds * sample_rate)) / sample_rate) * 8000).astype(np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+def make_frames(num_frames, width=64, height=48):
+    return np.stack([np.full((height, width, 3), i * 8, dtype=np.uint8) for i in range(num_frames)])
+
+
+@requires_ffmpeg
+def test_encodes_frames_with_audio(tmp_path):
+    output_path = str(tmp_path / "out.mp4")
+    audio_path = make_wav(tmp_path / "audio.wav", seconds=2.0)
+    encoder = VideoEncoder(output_path, 64, 48, 25, audio_path=audio_path, preset="ultrafast")
+    frames = make_frames(25)
+    encoder.write(frames[:10])
+    encoder.write(frames[10])
+    encoder.write(frames[11:])
+    encoder.close()
+    assert encoder.frames_written == 25
+    assert sorted(stream_types(output_path)) == ["Audio", "Video"]
+    assert count_frames(output_path) == 25
+
+
+@requires_ffmpeg
+def test_ffmpeg_failure_raises_runtime_error(tmp_path):
+    encoder = VideoEncoder(str(tmp_path / "out.mp4"), 64, 48, 25, codec="no_such_codec", crf=None)
+    with pytest.raises(RuntimeError, match="ffmpeg exited"):
+        # 编码器打开失败后ffmpeg退出，在写入或close时报错
+        for _ in range(50):
+            encoder.write(make_frames(10))
+        encoder.close()
+
+
+@requires_ffmpeg
+def test_write_rejects_wrong_frame_shape(tmp_path):
+    encoder = VideoEncoder(str(tmp_path / "out.mp4"), 64, 48, 25, preset="ultrafast")
+    try:
+        with pytest.raises(ValueError):
+            encoder.write(make_frames(2, width=32))
+    finally:
+        encoder.abort()
+
+
+@requires_ffmpeg
+def test_abort_removes_partial_output(tmp_path):
+    output_path = str(tmp_path / "out.mp4")
+    encoder = VideoEncoder(output_path, 64, 48, 25, preset="ultrafast")
+    encoder.write(make_frames(25))
+    encoder.abort()
+    assert not os.path.exists(output_path)
@@ -0,0 +1,149 @@
+import os
+import subprocess
+import threading
+import time
+
+# 各编码器的恒定质量参数，crf的数值直接作为质量值传入；不在表中的编码器不传质量参数，使用其默认码率控制
+QUALITY_FLAGS = {
+    "libx264": ["-crf"],
+    "libx265": ["-crf"],
+    "libsvtav1": ["-crf"],
+    # VP9只有同时设置-b:v 0时crf才是恒定质量模式
+    "libvpx-vp9": ["-b:v", "0", "-crf"],
+    "h264_nvenc": ["-rc", "vbr", "-cq"],
+    "hevc_nvenc": ["-rc", "vbr", "-cq"],
+    "av1_nvenc": ["-rc", "vbr", "-cq"],
+    "h264_qsv": ["-global_quality"],
+    "hevc_qsv": ["-global_quality"],
+}
+
+
+def quality_args(codec, crf):
+    """codec对应的恒定质量参数，crf为None或编码器不支持时返回空列表"""
+    if crf is None:
+        return []
+    flags = QUALITY_FLAGS.get(codec)
+    if flags is None:
+        print(f"Warning: no constant-quality option known for {codec}, ignoring crf={crf}")
+        return []
+    return flags + [str(crf)]
+
+
+class VideoEncoder:
+    """通过管道把RGB原始帧送入单个ffmpeg进程编码，同时合并音频，只编码一次、不落临时文件
+
+    用法：
+        encoder = VideoEncoder(out_path, width, height, fps, audio_path=audio_path)
+        encoder.write(frames)  # (f, H, W, 3) uint8 RGB
+        encoder.close()        # 出错时调用abort()
+    """
+
+    def __init__(
+        self,
+        output_path,
+        width,
+        height,
+        fps,
+        audio_path=None,
+        codec="libx264",
+        preset="medium",
+        crf=18,
+        threads=0,
+        pix_fmt="yuv420p",
+        audio_codec="aac",
+        faststart=False,
+    ):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+        self.write_seconds = 0.0
+
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error", "-nostdin",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+        ]
+        if audio_path is not None:
+            command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+        command += ["-c:v", codec]
+        if preset:
+            command += ["-preset", preset]
+        command += quality_args(codec, crf)
+        command += ["-threads", str(threads), "-pix_fmt", pix_fmt]
+        if audio_path is not None:
+            # 视频可能比音频短（音频帧数多于视频帧数时），以较短者为准
+            command += ["-c:a", audio_codec, "-q:a", "0", "-shortest"]
+        if faststart:
+            # 封装结束时把索引移到文件开头，浏览器可以边下边播，不需要再复制一遍文件
+            command += ["-movflags", "+faststart"]
+        command.append(output_path)
+
+        self.command = command
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        # 持续读取stderr，避免输出过多时管道写满导致ffmpeg阻塞
+        self._stderr = []
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, name="ffmpeg-stderr", daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in iter(self._process.stderr.readline, b""):
+            self._stderr.append(line.decode(errors="replace"))
+
+    def _error(self):
+        return "".join(self._stderr).strip()
+
+    def write(self, frames):
+        """写入一帧(H, W, 3)或一组帧(f, H, W, 3)，uint8 RGB"""
+        if frames.ndim == 3:
+            frames = frames[None]
+        if frames.shape[1:] != (self.height, self.width, 3):
+            raise ValueError(f"Frame shape {frames.shape[1:]} does not match ({self.height}, {self.width}, 3)")
+        start_time = time.perf_counter()
+        try:
+            self._process.stdin.write(frames.tobytes())
+        except (BrokenPipeError, OSError):
+            self._process.wait()
+            self._stderr_thread.join()
+            raise RuntimeError(f"ffmpeg exited with code {self._process.returncode}: {self._error()}")
+        self.write_seconds += time.perf_counter() - start_time
+        self.frames_written += len(frames)
+
+    def close(self):
+        """写完所有帧后等待ffmpeg完成编码和封装"""
+        start_time = time.perf_counter()
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = self._process.wait()
+        self._stderr_thread.join()
+        self.write_seconds += time.perf_counter() - start_time
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with code {returncode}: {self._error()}")
+
+    def abort(self):
+        """终止ffmpeg并删除未完成的输出文件"""
+        if self._process.poll() is None:
+            self._process.kill()
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.wait()
+        self._stderr_thread.join()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    @property
+    def fps(self):
+        return self.frames_written / self.write_seconds if self.write_seconds > 0 else 0.0
+
+    def stats(self):
+        return {
+            "frames": self.frames_written,
+            "seconds": round(self.write_seconds, 4),
+            "fps": round(self.fps, 2),
+        }